@@ -0,0 +1,236 @@
+"""annotation_index.py
+
+Index of the annotations of all processing stages in an SQLite database, so
+that questions like "all location entities" or "all time expressions" can be
+answered without reading the LIF files again.
+
+Usage:
+
+$ python3 annotation_index.py --build -d DATA_DIR (-f FILELIST -b START -e END)
+      (-p PROCESSES) (--stages STAGE,...) (--index INDEX_FILE)
+
+$ python3 annotation_index.py --query -d DATA_DIR TAG (FEAT=VAL ...)
+      (--stage STAGE) (--limit N) (--index INDEX_FILE)
+
+The index is in DATA_DIR/ann/annotations.db unless --index is given. Building
+reads the stage files of the documents in the file list, by default of all
+stages, in PROCESSES worker processes. Building is incremental, a file is only
+indexed again if its size or modification time changed, so the index can be
+updated after running a stage on some more documents.
+
+For each annotation the index has the document, stage, view, short type (for
+example NamedEntity), offsets, the covered text (cut off after MAX_TEXT
+characters) and the features in FEATURES. The annotations table is indexed on
+type and the features table on feature name and value. Queries print the
+matching annotations with their offsets and text:
+
+$ python3 annotation_index.py --query -d $DATA NamedEntity category=location
+$ python3 annotation_index.py --query -d $DATA TimeExpression --stage ttk
+
+The index can also be used by collect_annotations.py (with --index).
+
+"""
+
+import os
+import sys
+import json
+import getopt
+import sqlite3
+from multiprocessing import Pool
+
+from lif import Text, read_file
+from utils import STAGE_FILES, elements, stage_file, docid, ensure_directory
+from mapreduce import PROCESSES
+
+
+INDEX_FILE = 'ann/annotations.db'
+
+# The features that are stored and indexed, other features are ignored.
+FEATURES = ('category', 'word', 'lemma', 'pos', 'type', 'value', 'tags')
+
+# Maximum length of the covered text stored for an annotation.
+MAX_TEXT = 200
+
+# Number of files indexed between commits.
+COMMIT_EVERY = 100
+
+
+class AnnotationIndex(object):
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.db = sqlite3.connect(fname)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (docid TEXT, stage TEXT,"
+                        " fname TEXT, mtime REAL, size INTEGER, PRIMARY KEY (docid, stage))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS annotations (id INTEGER PRIMARY KEY,"
+                        " docid TEXT, stage TEXT, view TEXT, type TEXT, start_offset INTEGER,"
+                        " end_offset INTEGER, text TEXT, features TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS features (id INTEGER, name TEXT, value TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS annotations_type ON annotations (type, stage)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS annotations_docid ON annotations (docid, stage)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS features_value ON features (name, value)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS features_id ON features (id)")
+        self.db.commit()
+
+    def __str__(self):
+        count = self.db.execute("SELECT COUNT(*) FROM annotations").fetchone()[0]
+        return "<AnnotationIndex %s with %d annotations>" % (self.fname, count)
+
+    def is_current(self, docid, stage, fname):
+        """Return True if the file was indexed and did not change since."""
+        row = self.db.execute("SELECT mtime, size FROM files WHERE docid = ? AND stage = ?",
+                              (docid, stage)).fetchone()
+        stat = os.stat(fname)
+        return row is not None and row == (stat.st_mtime, stat.st_size)
+
+    def add_file(self, docid, stage, fname, mtime, size, annotations):
+        """Replace the annotations of a stage of a document. Each annotation is a
+        tuple of view, type, start, end, text and a dictionary of features."""
+        self.remove_file(docid, stage)
+        next_id = self.db.execute("SELECT IFNULL(MAX(id), 0) + 1 FROM annotations").fetchone()[0]
+        rows = []
+        feature_rows = []
+        for i, (view, atype, start, end, text, features) in enumerate(annotations):
+            rows.append((next_id + i, docid, stage, view, atype, start, end, text,
+                         json.dumps(features)))
+            for name, value in features.items():
+                feature_rows.append((next_id + i, name, _feature_value(value)))
+        self.db.executemany("INSERT INTO annotations VALUES (?,?,?,?,?,?,?,?,?)", rows)
+        self.db.executemany("INSERT INTO features VALUES (?,?,?)", feature_rows)
+        self.db.execute("INSERT INTO files VALUES (?,?,?,?,?)", (docid, stage, fname, mtime, size))
+
+    def remove_file(self, docid, stage):
+        self.db.execute("DELETE FROM features WHERE id IN"
+                        " (SELECT id FROM annotations WHERE docid = ? AND stage = ?)",
+                        (docid, stage))
+        self.db.execute("DELETE FROM annotations WHERE docid = ? AND stage = ?", (docid, stage))
+        self.db.execute("DELETE FROM files WHERE docid = ? AND stage = ?", (docid, stage))
+
+    def commit(self):
+        self.db.commit()
+
+    def query(self, atype=None, features=None, stage=None, docids=None, limit=None):
+        """Return the annotations of a type with the given feature values, as
+        dictionaries. Feature values are compared as strings. Raises a
+        ValueError for features that are not in FEATURES, since those are not
+        in the index and would never match."""
+        unindexed = sorted(set(features or {}) - set(FEATURES))
+        if unindexed:
+            raise ValueError("features not in the index: %s" % ', '.join(unindexed))
+        conditions = []
+        values = []
+        if atype is not None:
+            conditions.append("type = ?")
+            values.append(atype)
+        if stage is not None:
+            conditions.append("stage = ?")
+            values.append(stage)
+        for name, value in sorted((features or {}).items()):
+            conditions.append("id IN (SELECT id FROM features WHERE name = ? AND value = ?)")
+            values.extend([name, _feature_value(value)])
+        query = ("SELECT docid, stage, view, type, start_offset, end_offset, text, features"
+                 " FROM annotations")
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY docid, stage, id"
+        if docids is not None:
+            docids = set(docids)
+        results = []
+        for row in self.db.execute(query, values):
+            if docids is not None and row[0] not in docids:
+                continue
+            results.append({'docid': row[0], 'stage': row[1], 'view': row[2],
+                            'type': row[3], 'start': row[4], 'end': row[5],
+                            'text': row[6], 'features': json.loads(row[7])})
+            if limit is not None and len(results) >= limit:
+                break
+        return results
+
+
+def _feature_value(value):
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def build_index(data_dir, fnames, stages=None, index_file=None, processes=PROCESSES):
+    """Add the stage files of the documents in fnames to the index, skipping files
+    that did not change since they were indexed."""
+    index_file = index_file or os.path.join(data_dir, INDEX_FILE)
+    ensure_directory(index_file)
+    index = AnnotationIndex(index_file)
+    jobs = []
+    skipped = 0
+    for fname in fnames:
+        for stage in (stages or sorted(STAGE_FILES)):
+            path = stage_file(data_dir, fname, stage)
+            if not os.path.exists(path):
+                continue
+            if index.is_current(docid(fname), stage, path):
+                skipped += 1
+            else:
+                jobs.append((docid(fname), stage, path))
+    with Pool(max(1, processes)) as pool:
+        for n, result in enumerate(pool.imap_unordered(_read_annotations, jobs, 4), 1):
+            index.add_file(*result)
+            if n % COMMIT_EVERY == 0:
+                index.commit()
+                print("%d/%d files" % (n, len(jobs)))
+    index.commit()
+    print("Indexed %d files, %d were up to date, %s" % (len(jobs), skipped, index))
+
+
+def _read_annotations(job):
+    """Read a stage file in a worker process and return the arguments for
+    AnnotationIndex.add_file()."""
+    doc, stage, fname = job
+    stat = os.stat(fname)
+    json_obj = json.loads(read_file(fname))
+    payload = json_obj.get('payload', json_obj)
+    text = Text(payload['text'], os.path.dirname(fname)).value
+    annotations = []
+    for view in payload['views']:
+        for anno in view['annotations']:
+            start, end = anno.get('start'), anno.get('end')
+            covered = None
+            if start is not None and end is not None:
+                covered = text[start:end][:MAX_TEXT]
+            features = anno.get('features', {})
+            features = dict((f, features[f]) for f in FEATURES if f in features)
+            annotations.append((view['id'], anno['@type'].rsplit('/', 1)[-1],
+                                start, end, covered, features))
+    return doc, stage, fname, stat.st_mtime, stat.st_size, annotations
+
+
+def print_annotations(annotations):
+    for anno in annotations:
+        text = (anno['text'] or '').replace('\n', ' ')[:80]
+        category = anno['features'].get('category', '')
+        print("%s  %s  %-15s %6s-%-6s  %-12s %s"
+              % (anno['docid'], anno['stage'], anno['type'], anno['start'], anno['end'],
+                 category, text))
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.gnu_getopt(
+        sys.argv[1:], 'd:f:b:e:p:',
+        ['build', 'query', 'index=', 'stages=', 'stage=', 'limit='])
+    options = dict(opts)
+    data_dir = options.get('-d')
+    index_file = options.get('--index') or os.path.join(data_dir, INDEX_FILE)
+    if '--build' in options:
+        filelist = options.get('-f', 'files-random.txt')
+        start = int(options.get('-b', 1))
+        end = int(options.get('-e', 1))
+        stages = options['--stages'].split(',') if '--stages' in options else None
+        fnames = [fname for n, fname in elements(filelist, start, end)]
+        build_index(data_dir, fnames, stages, index_file,
+                    int(options.get('-p', PROCESSES)))
+    elif '--query' in options:
+        features = dict(arg.split('=', 1) for arg in args[1:])
+        limit = int(options['--limit']) if '--limit' in options else None
+        unindexed = sorted(set(features) - set(FEATURES))
+        if unindexed:
+            sys.exit("ERROR: features not in the index: %s, indexed features are %s"
+                     % (', '.join(unindexed), ', '.join(FEATURES)))
+        index = AnnotationIndex(index_file)
+        print_annotations(index.query(args[0], features, options.get('--stage'), limit=limit))
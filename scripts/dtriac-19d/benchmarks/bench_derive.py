@@ -0,0 +1,57 @@
+"""bench_derive.py
+
+Compare LIF.derive() with the LIF(json_object=lif.as_json()) round trip that
+the stages used to create their output LIF object.
+
+Usage:
+
+$ python3 benchmarks/bench_derive.py (-a ANNOTATIONS) (-n REPEAT)
+
+Uses a synthetic LIF object with one view with ANNOTATIONS tokens (default is
+50000) and reports the average time per copy in milliseconds.
+
+"""
+
+import os
+import sys
+import getopt
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lif import LIF, View
+
+
+def synthetic_lif(annotations):
+    lif = LIF()
+    lif.text.value = 'word ' * annotations
+    view = View(json_obj={
+        'id': 'v1', 'metadata': {},
+        'annotations': [{'id': 't%d' % i, '@type': 'http://vocab.lappsgrid.org/Token',
+                         'start': i * 5, 'end': i * 5 + 4, 'features': {'pos': 'NN'}}
+                        for i in range(annotations)]})
+    lif.views.append(view)
+    return lif
+
+
+def clone(lif):
+    lif_out = LIF(json_object=lif.as_json())
+    lif_out.views = []
+    return lif_out
+
+
+def derive(lif):
+    return lif.derive()
+
+
+if __name__ == '__main__':
+
+    options = dict(getopt.getopt(sys.argv[1:], 'a:n:')[0])
+    annotations = int(options.get('-a', 50000))
+    repeat = int(options.get('-n', 20))
+    lif = synthetic_lif(annotations)
+    print("\n%d annotations, %d repeats\n" % (annotations, repeat))
+    for fun in (clone, derive):
+        seconds = timeit.timeit(lambda: fun(lif), number=repeat)
+        print("%-8s %10.3fms" % (fun.__name__, seconds * 1000 / repeat))
+    print('')
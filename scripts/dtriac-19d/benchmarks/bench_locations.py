@@ -0,0 +1,78 @@
+"""bench_locations.py
+
+Lookup latency of resources.Locations.
+
+Usage:
+
+$ python3 benchmarks/bench_locations.py (-n LOOKUPS)
+
+Run this from the dtriac-19d directory. The lookups are drawn from the
+locations in data/locations/locations.txt, weighted by how often they occur, so
+the hit rate of the LRU cache is about what it is when creating the index
+documents. Compares the old pickled dictionary that formatted the coordinates
+on each lookup, the SQLite database without and with the LRU cache, and the
+pickle fallback. Also checks that all give the same results.
+
+"""
+
+import os
+import sys
+import time
+import pickle
+import random
+import getopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resources
+from resources import Locations, LOCATIONS_INDEX
+from locations import get_locations
+
+
+class PickledLocations(object):
+
+    """The Locations class as it was before the SQLite database."""
+
+    def __init__(self):
+        self.data = pickle.load(open(LOCATIONS_INDEX, 'rb'))
+
+    def get_coordinates(self, location):
+        result = self.data.get(location)
+        if result is None:
+            return None
+        return "%.2f,%.2f" % (float(result['lat']), float(result['lon']))
+
+
+def workload(lookups):
+    locations = list(get_locations())
+    names = [location for count, location in locations]
+    weights = [count for count, location in locations]
+    return random.Random(42).choices(names, weights, k=lookups)
+
+
+def run(label, create, lookup, names):
+    t0 = time.time()
+    obj = create()
+    load = time.time() - t0
+    t0 = time.time()
+    results = [lookup(obj, name) for name in names]
+    latency = (time.time() - t0) / len(names)
+    print("%-22s  load %8.2fms  lookup %8.3fus" % (label, load * 1000, latency * 1000000))
+    return results
+
+
+if __name__ == '__main__':
+
+    options = dict(getopt.getopt(sys.argv[1:], 'n:')[0])
+    names = workload(int(options.get('-n', 200000)))
+    print("\n%d lookups of %d different locations\n" % (len(names), len(set(names))))
+    expected = run('pickle, format', PickledLocations,
+                   lambda obj, name: obj.get_coordinates(name), names)
+    results = [
+        run('sqlite', Locations,
+            lambda obj, name: obj._get_coordinates(name), names),
+        run('sqlite + lru', Locations,
+            lambda obj, name: obj.get_coordinates(name), names),
+        run('pickle fallback + lru', lambda: Locations(db_file='does-not-exist'),
+            lambda obj, name: obj.get_coordinates(name), names)]
+    print("\nSame results: %s\n" % all(r == expected for r in results))
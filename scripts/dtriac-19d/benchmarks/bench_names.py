@@ -0,0 +1,96 @@
+"""bench_names.py
+
+Throughput of resources.Names.filter().
+
+Usage:
+
+$ python3 benchmarks/bench_names.py (-n MENTIONS)
+
+Run this from the dtriac-19d directory. Person mentions are generated from the
+first names list with a Zipf-like distribution over a fixed set of names, mixed
+with the kinds of strings the filter is there for (initials, roads, Jr). Compares
+the filter as it was before it was compiled and cached with the current filter
+called on each mention and with filter_all() called on batches of 200 mentions,
+about what a document has, and checks that the verdicts are the same.
+
+"""
+
+import os
+import sys
+import time
+import random
+import getopt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resources import Names
+
+
+class UncompiledNames(Names):
+
+    """The filter as it was before it was compiled and cached."""
+
+    def filter(self, name):
+        if (name.lower() in self.names_to_filter
+            or name in ('Jr', 'Jr.', 'Sr', 'Sr.')):
+            return True
+        if name.endswith(' Road'):
+            return True
+        if name.lower() in ('john j.', 'john j. kingman'):
+            return True
+        if self.initials_only(name):
+            return True
+        if len(name) < 3 or ('.' in name and len(name) < 5):
+            return True
+        return False
+
+
+SURNAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller',
+            'Davis', 'Rodriguez', 'Martinez', 'Kingman', 'Wilson', 'Anderson']
+
+NOISE = ['Jr.', 'Sr', 'J. K.', 'A.', 'John J.', 'Kingman Road', 'Fort Belvoir Road',
+         'R. Smith', 'Ed', 'DAVID MILLER', 'X. Y. Z.']
+
+
+def mentions(first_names, count):
+    rnd = random.Random(42)
+    names = [rnd.choice(first_names) for _ in range(2000)]
+    names += ['%s %s' % (rnd.choice(first_names).capitalize(), rnd.choice(SURNAMES))
+              for _ in range(8000)]
+    names += ['%s. %s' % (rnd.choice(first_names)[0].upper(), rnd.choice(SURNAMES))
+              for _ in range(2000)]
+    names += NOISE
+    rnd.shuffle(names)
+    weights = [1.0 / (rank + 1) for rank in range(len(names))]
+    return rnd.choices(names, weights, k=count)
+
+
+def measure(label, fun, names):
+    t0 = time.time()
+    verdicts = fun(names)
+    seconds = time.time() - t0
+    print("%-14s  %10.0f mentions/sec" % (label, len(names) / seconds))
+    return verdicts
+
+
+if __name__ == '__main__':
+
+    options = dict(getopt.getopt(sys.argv[1:], 'n:')[0])
+    old = UncompiledNames()
+    new = Names()
+    names = mentions(sorted(new.names_to_filter), int(options.get('-n', 1000000)))
+    print("\n%d mentions of %d different names\n" % (len(names), len(set(names))))
+    expected = measure('uncompiled', lambda names: [old.filter(n) for n in names], names)
+    verdicts = measure('filter', lambda names: [new.filter(n) for n in names], names)
+
+    def batched(names):
+        verdicts = []
+        for i in range(0, len(names), 200):
+            batch = names[i:i + 200]
+            filtered = new.filter_all(batch)
+            verdicts.extend(n in filtered for n in batch)
+        return verdicts
+
+    new.verdicts.clear()
+    batched_verdicts = measure('filter_all', batched, names)
+    print("\nSame verdicts: %s\n" % (expected == verdicts == batched_verdicts))
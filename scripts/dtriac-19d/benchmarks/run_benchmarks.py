@@ -0,0 +1,286 @@
+"""run_benchmarks.py
+
+Timings of the hot paths of the pipeline on a synthetic corpus (see
+synthetic.py), stored so that changes between commits are visible.
+
+Usage:
+
+$ python3 benchmarks/run_benchmarks.py (-d DATA_DIR) (-n DOCUMENTS) (-r REPEAT)
+      (-o RESULTS) (--no-save) (BENCHMARK ...)
+
+Run this from the dtriac-19d directory. The corpus is generated in DATA_DIR if
+it does not have one yet, by default in a temporary directory, always with the
+same seed. Each benchmark runs over all DOCUMENTS documents (default 5), REPEAT
+times (default 3), and the best time per document in milliseconds is reported.
+Without arguments all benchmarks in BENCHMARKS run.
+
+Results are appended as a JSON line to RESULTS (benchmarks/results.jsonl by
+default) with the commit (from git describe) and the corpus size, and for each
+benchmark the change relative to the last stored result of another commit on
+the same corpus is printed. Benchmarks whose dependencies are missing, like
+NLTK for the sentence classifier, are skipped.
+
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import generate_corpus
+from utils import read_lif, create_view
+import resources
+import lookup
+import create_index_docs
+
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+# Size of the synthetic documents, see synthetic.generate_corpus().
+CORPUS = {'pages': 20, 'sentences': 30, 'tokens': 20, 'seed': 1}
+
+
+class Skipped(Exception):
+    pass
+
+
+class Benchmark(object):
+
+    """A benchmark with a setup for each document, which is not timed, and the
+    code that is timed. Subclasses define setup() and run(), run() gets what
+    setup() returns."""
+
+    name = None
+
+    def __init__(self, data_dir, fnames):
+        self.data_dir = data_dir
+        self.fnames = fnames
+
+    def prepare(self):
+        """Setup for the whole benchmark, like loading resources."""
+        pass
+
+    def setup(self, fname):
+        return None
+
+    def run(self, state):
+        raise NotImplementedError
+
+    def time(self, repeat):
+        """Return the best time per document in milliseconds."""
+        self.prepare()
+        best = None
+        for i in range(repeat):
+            elapsed = 0.0
+            for fname in self.fnames:
+                state = self.setup(fname)
+                t0 = time.perf_counter()
+                self.run(state)
+                elapsed += time.perf_counter() - t0
+            per_document = elapsed * 1000 / len(self.fnames)
+            best = per_document if best is None else min(best, per_document)
+        return best
+
+
+class LIFParse(Benchmark):
+
+    name = 'lif_parse'
+
+    def run(self, fname):
+        read_lif(self.data_dir, fname, 'pos')
+
+    def setup(self, fname):
+        return fname
+
+
+class LIFSerialize(Benchmark):
+
+    name = 'lif_serialize'
+
+    def setup(self, fname):
+        return read_lif(self.data_dir, fname, 'pos')
+
+    def run(self, lif):
+        lif.as_json_string()
+
+
+class LookupTechnologies(Benchmark):
+
+    name = 'lookup_technologies'
+
+    def prepare(self):
+        lookup.TECHNOLOGIES = resources.get('technologies')
+
+    def setup(self, fname):
+        lif = read_lif(self.data_dir, fname, 'pos')
+        tokens = [a for a in lif.get_view('v2').annotations if a.type.endswith('Token')]
+        return lif, tokens, create_view('tex', 'Technology', 'run_benchmarks.py')
+
+    def run(self, state):
+        lookup._lookup_technologies_in_tokens(*state)
+
+
+class SentenceClassifier(Benchmark):
+
+    name = 'sentence_classifier'
+
+    def prepare(self):
+        try:
+            import nltk
+        except ImportError:
+            raise Skipped('needs nltk')
+        import generate_sentence_types
+        self.classifier = generate_sentence_types.SentenceClassifier
+        self.words = resources.get('words')
+        resources.get('tokenizer')
+        resources.get('lemmatizer')
+
+    def setup(self, fname):
+        lif = read_lif(self.data_dir, fname, 'lif')
+        sentences = read_lif(self.data_dir, fname, 'spl').get_view('v2').annotations
+        return lif, sentences
+
+    def run(self, state):
+        lif, sentences = state
+        for sentence in sentences:
+            self.classifier(lif, sentence, self.words).is_crap()
+
+
+class CreateDocument(Benchmark):
+
+    name = 'create_document'
+
+    def prepare(self):
+        resources.get('names')
+        resources.get('locations')
+
+    def setup(self, fname):
+        return fname
+
+    def run(self, fname):
+        create_index_docs.Document(fname, self.data_dir)
+
+
+class IndexedAnnotationsFinish(Benchmark):
+
+    name = 'indexed_annotations_finish'
+
+    def prepare(self):
+        resources.get('names')
+        resources.get('locations')
+        self.documents = dict((fname, create_index_docs.Document(fname, self.data_dir))
+                              for fname in self.fnames)
+
+    def setup(self, fname):
+        doc = self.documents[fname]
+        indexes = []
+        for field in ('technologies', 'persons', 'locations', 'organizations'):
+            index = create_index_docs.IndexedAnnotations(doc, field)
+            for annotation in getattr(doc.annotations, field).annotations:
+                index.add(annotation)
+            indexes.append(index)
+        return indexes
+
+    def run(self, indexes):
+        for index in indexes:
+            index.finish()
+
+
+class WriteIndexDocument(Benchmark):
+
+    name = 'write_index_document'
+
+    def prepare(self):
+        resources.get('names')
+        resources.get('locations')
+        self.documents = dict((fname, create_index_docs.Document(fname, self.data_dir))
+                              for fname in self.fnames)
+        self.out_dir = tempfile.mkdtemp()
+
+    def setup(self, fname):
+        return self.documents[fname]
+
+    def run(self, doc):
+        doc.write(self.out_dir)
+
+
+BENCHMARKS = (LIFParse, LIFSerialize, LookupTechnologies, SentenceClassifier,
+              CreateDocument, IndexedAnnotationsFinish, WriteIndexDocument)
+
+
+def run_benchmarks(data_dir, fnames, names=None, repeat=3):
+    """Return a dictionary with the time per document of each benchmark."""
+    results = {}
+    for benchmark_class in BENCHMARKS:
+        if names and benchmark_class.name not in names:
+            continue
+        try:
+            results[benchmark_class.name] = benchmark_class(data_dir, fnames).time(repeat)
+            print("%-28s %10.2fms" % (benchmark_class.name, results[benchmark_class.name]))
+        except Skipped as e:
+            print("%-28s    skipped (%s)" % (benchmark_class.name, e))
+    return results
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(results_file, corpus, current_commit):
+    """Return the last stored results for the corpus from another commit."""
+    previous = None
+    if os.path.exists(results_file):
+        for line in open(results_file):
+            record = json.loads(line)
+            if record['corpus'] == corpus and record['commit'] != current_commit:
+                previous = record
+    return previous
+
+
+def print_comparison(results, previous):
+    print("\nCompared to %s (%s)\n" % (previous['commit'], previous['date']))
+    for name in sorted(results):
+        before = previous['results'].get(name)
+        if before:
+            change = (results[name] - before) * 100 / before
+            print("%-28s %10.2fms %10.2fms  %+6.1f%%" % (name, before, results[name], change))
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], 'd:n:r:o:', ['no-save'])
+    options = dict(opts)
+    documents = int(options.get('-n', 5))
+    repeat = int(options.get('-r', 3))
+    results_file = options.get('-o', RESULTS)
+    data_dir = options.get('-d') or tempfile.mkdtemp()
+    corpus = dict(CORPUS, documents=documents)
+    filelist = os.path.join(data_dir, 'files.txt')
+    if not os.path.exists(filelist):
+        print("Generating %d documents in %s" % (documents, data_dir))
+        generate_corpus(data_dir, **corpus)
+    fnames = [line.strip() for line in open(filelist)][:documents]
+    print("\n%d documents, %d repeats\n" % (len(fnames), repeat))
+    results = run_benchmarks(data_dir, fnames, args, repeat)
+    record = {'commit': commit(), 'date': time.strftime("%Y-%m-%d %H:%M:%S"),
+              'python': sys.version.split()[0], 'corpus': corpus, 'results': results}
+    previous = previous_results(results_file, corpus, record['commit'])
+    if previous is not None:
+        print_comparison(results, previous)
+    if '--no-save' not in options:
+        with open(results_file, 'a') as fh:
+            fh.write(json.dumps(record, sort_keys=True) + '\n')
+    if '-d' not in options:
+        shutil.rmtree(data_dir)
+    print('')
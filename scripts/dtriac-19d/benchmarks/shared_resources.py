@@ -0,0 +1,148 @@
+"""shared_resources.py
+
+Startup time and memory use of worker processes that build the technology
+ontology, the NLTK word list and the locations themselves, compared to workers
+that attach to the tables written by "python3 resources.py --build-tables".
+
+Usage:
+
+$ python3 benchmarks/shared_resources.py (-n LOOKUPS) (WORKERS ...)
+
+Run this from the dtriac-19d directory after building the tables. For each mode
+and each number of workers (1 and 16 by default) the workers are started at the
+same time, each loads the resources and does LOOKUPS lookups in each of them
+(default 20000), and then waits until all others are done, so memory is
+measured while all workers are alive. Workers load the resources after they
+start, like the stages do when several of them are run side by side.
+
+Printed are the mean startup time of a worker (loading the resources), the
+total RSS of the workers, the part of it that was added by loading and using
+the resources, and the total PSS. The PSS (proportional set size, from
+/proc/PID/smaps_rollup, Linux only) divides shared pages over the processes
+that share them, so unlike the RSS it shows what the workers cost together.
+The word list is left out if NLTK or the words table is not available.
+
+"""
+
+import os
+import sys
+import time
+import random
+import getopt
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resources
+from resources import Locations, WORDS_TABLE, LOCATIONS_TABLE
+from lookup import TechnologyOntology, TECHNOLOGY_LIST, TECHNOLOGY_TABLE
+from locations import get_locations
+from metrics import current_rss
+
+
+WORKERS = (1, 16)
+
+LOOKUPS = 20000
+
+MISSING = 'does-not-exist'
+
+
+def load_private():
+    """Load the resources the way they are loaded without tables."""
+    loaded = {'technologies': TechnologyOntology(table_file=MISSING),
+              'locations': Locations(db_file=MISSING, table_file=MISSING)}
+    try:
+        loaded['words'] = resources._load_nltk_words()
+    except (ImportError, LookupError):
+        pass
+    return loaded
+
+
+def load_shared():
+    """Load the resources from the tables."""
+    loaded = {'technologies': TechnologyOntology(),
+              'locations': Locations()}
+    if os.path.exists(WORDS_TABLE):
+        loaded['words'] = resources._load_words()
+    return loaded
+
+
+def workload(lookups):
+    """Return strings to look up in the technologies, locations and words, both
+    hits and misses, drawn with a fixed seed."""
+    rng = random.Random(42)
+    terms = [line.rstrip('\n').split('\t')[2] for line in open(TECHNOLOGY_LIST)]
+    locations = [location for count, location in get_locations()]
+    words = [w for term in terms for w in term.split()]
+    return {'technologies': [rng.choice(terms) for i in range(lookups)],
+            'locations': [rng.choice(locations) for i in range(lookups)],
+            'words': [rng.choice(words) for i in range(lookups)]}
+
+
+def use(loaded, strings):
+    loaded['technologies'].lookup.cache_clear()
+    for string in strings['technologies']:
+        loaded['technologies'].lookup(string)
+    for string in strings['locations']:
+        loaded['locations'].get_coordinates(string)
+    if 'words' in loaded:
+        words = loaded['words']
+        for string in strings['words']:
+            string in words
+
+
+def worker(load, strings, barrier, results):
+    rss = current_rss()
+    t0 = time.time()
+    loaded = load()
+    startup = time.time() - t0
+    use(loaded, strings)
+    barrier.wait()
+    results.put((startup, current_rss(), current_rss() - rss, pss(), sorted(loaded)))
+    barrier.wait()
+
+
+def pss():
+    """Return the proportional set size of the process in bytes."""
+    with open('/proc/self/smaps_rollup') as fh:
+        for line in fh:
+            if line.startswith('Pss:'):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def run(label, load, workers, strings):
+    barrier = multiprocessing.Barrier(workers)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(load, strings, barrier, results))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    measurements = [results.get() for i in range(workers)]
+    for process in processes:
+        process.join()
+    startup = sum(m[0] for m in measurements) / workers
+    print("%-8s %3d workers  startup %8.2fms  RSS %8s  added %8s  PSS %8s  (%s)"
+          % (label, workers, startup * 1000,
+             _megabytes(sum(m[1] for m in measurements)),
+             _megabytes(sum(m[2] for m in measurements)),
+             _megabytes(sum(m[3] for m in measurements)),
+             ', '.join(measurements[0][4])))
+
+
+def _megabytes(size):
+    return "%.1fMB" % (size / 1000000.0)
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], 'n:')
+    options = dict(opts)
+    strings = workload(int(options.get('-n', LOOKUPS)))
+    if not os.path.exists(TECHNOLOGY_TABLE) or not os.path.exists(LOCATIONS_TABLE):
+        sys.exit("No tables, run python3 resources.py --build-tables first")
+    print('')
+    for workers in [int(arg) for arg in args] or WORKERS:
+        run('private', load_private, workers, strings)
+        run('shared', load_shared, workers, strings)
+    print('')
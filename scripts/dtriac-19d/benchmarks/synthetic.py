@@ -0,0 +1,254 @@
+"""synthetic.py
+
+Generator of a synthetic corpus with the results of all processing stages, in
+the layout of a data directory (see utils.STAGE_FILES), for benchmarks.
+
+Usage:
+
+$ python3 benchmarks/synthetic.py -d DATA_DIR (-n DOCUMENTS) (-p PAGES) (-s SENTENCES)
+      (-t TOKENS) (--seed SEED)
+
+This writes DOCUMENTS documents with PAGES pages of SENTENCES sentences of about
+TOKENS tokens each, and a file list DATA_DIR/files.txt. The defaults are 10
+documents of 20 pages with 30 sentences of 20 tokens, which is about 12K tokens
+per document, a bit more than the 20 OCR-ed pages of a typical document.
+
+Documents are shaped like the output of the stages: the lif stage has a pages
+view, the spl, pos and ner stages are containers with the text and a token view
+followed by a sentence, token or entity view, and the sen, tex, top, mta and wik
+stages are written with utils.write_lif() and refer to the text of the lif
+stage. Words are drawn from the technology list, first names and the locations
+list in the data directory, so technology lookup, name filtering and location
+lookup find what they would find on real documents. The same seed gives the
+same corpus.
+
+"""
+
+import os
+import sys
+import json
+import getopt
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lif import LIF, View, Annotation, write_file
+from utils import stage_file, write_lif, ensure_directory
+
+
+VOCAB = 'http://vocab.lappsgrid.org/%s'
+
+TECHNOLOGY_LIST = 'data/technologies/technologies.txt'
+FIRST_NAMES = 'data/names/common-first-names.txt'
+LOCATIONS = 'data/locations/locations.txt'
+
+FILLER = ('the', 'of', 'and', 'a', 'in', 'to', 'is', 'was', 'for', 'with', 'that',
+          'on', 'by', 'as', 'are', 'from', 'reactor', 'radiation', 'dose', 'test',
+          'report', 'results', 'shown', 'table', 'figure', 'level', 'energy', 'were',
+          'measured', 'system', 'effects', 'exposure', 'analysis', 'data', 'field')
+
+LAST_NAMES = ('Smith', 'Johnson', 'Miller', 'Davis', 'Kingman', 'Brown', 'Wilson',
+              'Moore', 'Taylor', 'Anderson', 'Thomas', 'Jackson', 'White', 'Harris')
+
+ORGANIZATIONS = ('Defense Nuclear Agency', 'Los Alamos National Laboratory',
+                 'Armed Forces Radiobiology Research Institute', 'Department of Energy',
+                 'Naval Research Laboratory', 'Atomic Energy Commission')
+
+TOPICS = ('radiation dose exposure', 'reactor core fuel', 'blast wave pressure',
+          'cell tissue injury', 'detector energy spectrum')
+
+# Probabilities that the next word is the start of a technology term, a person
+# name, a location or an organization.
+TECHNOLOGY, PERSON, LOCATION, ORGANIZATION = 0.03, 0.01, 0.01, 0.005
+
+# Fraction of sentences that are not normal sentences.
+CRAP = 0.15
+
+# Number of tokens on a line.
+LINE_LENGTH = 12
+
+
+class Vocabulary(object):
+
+    def __init__(self):
+        self.technologies = [line.rstrip('\n').split('\t')[2]
+                             for line in open(TECHNOLOGY_LIST)
+                             if int(line.split('\t')[0]) >= 20]
+        self.technologies = [t for t in self.technologies if t[0].isalpha()]
+        self.first_names = []
+        for line in open(FIRST_NAMES):
+            if not line.startswith('#'):
+                fields = line.strip().split('\t')
+                self.first_names.extend([fields[1], fields[3]])
+        self.locations = []
+        for line in open(LOCATIONS):
+            if not line.startswith('#') and '\t' in line:
+                self.locations.append(line.split('\t')[1].strip())
+                if len(self.locations) == 1000:
+                    break
+
+
+class SyntheticDocument(object):
+
+    """The text and annotations of a synthetic document. Annotations are kept
+    as JSON objects, stages() turns them into a LIF object for each stage."""
+
+    def __init__(self, vocabulary, rng, pages, sentences, tokens):
+        self.vocabulary = vocabulary
+        self.rng = rng
+        self.count = 0
+        self.chunks = []
+        self.length = 0
+        self.pages = []
+        self.sentences = []
+        self.tokens = []
+        self.entities = []
+        self.technologies = []
+        for page in range(pages):
+            page_start = self.length
+            for sentence in range(sentences):
+                self._add_sentence(tokens)
+            self._add_text('\n\n')
+            self.pages.append(self._annotation('p', 'Page', page_start, self.length))
+        self.text = ''.join(self.chunks)
+
+    def _add_text(self, text):
+        self.chunks.append(text)
+        self.length += len(text)
+
+    def _add_sentence(self, length):
+        start = self.length
+        crap = self.rng.random() < CRAP
+        count = 0
+        while count < length:
+            if count:
+                self._add_text('\n' if count % LINE_LENGTH == 0 else ' ')
+            count += self._add_words(crap)
+        self._add_text('.')
+        self.tokens.append(self._token('.', self.length - 1, 'PUNCT'))
+        sentence = self._annotation('s', 'Sentence', start, self.length)
+        sentence['features']['type'] = 'crap' if crap else 'normal'
+        self.sentences.append(sentence)
+        self._add_text(' ')
+
+    def _add_words(self, crap):
+        """Add one or more words and their annotations, return the number of
+        tokens added."""
+        rng = self.rng
+        vocabulary = self.vocabulary
+        if crap:
+            return self._add_tokens(['%d' % rng.randint(0, 9999), '=', '%.2f' % rng.random()])
+        r = rng.random()
+        if r < TECHNOLOGY:
+            term = rng.choice(vocabulary.technologies)
+            start = self.length
+            count = self._add_tokens(term.split())
+            technology = self._annotation('t', 'Technology', start, self.length)
+            technology['features'] = {'term': term, 'type': 'technology'}
+            self.technologies.append(technology)
+            return count
+        r -= TECHNOLOGY
+        for probability, category, words in (
+                (PERSON, 'person', lambda: [rng.choice(vocabulary.first_names),
+                                            rng.choice(LAST_NAMES)]),
+                (LOCATION, 'location', lambda: rng.choice(vocabulary.locations).split()),
+                (ORGANIZATION, 'organization', lambda: rng.choice(ORGANIZATIONS).split())):
+            if r < probability:
+                start = self.length
+                count = self._add_tokens(words())
+                entity = self._annotation('ne', 'NamedEntity', start, self.length)
+                entity['features']['category'] = category
+                self.entities.append(entity)
+                return count
+            r -= probability
+        return self._add_tokens([rng.choice(FILLER)])
+
+    def _add_tokens(self, words):
+        for i, word in enumerate(words):
+            if i:
+                self._add_text(' ')
+            self.tokens.append(self._token(word, self.length, 'NN'))
+            self._add_text(word)
+        return len(words)
+
+    def _token(self, word, start, pos):
+        token = self._annotation('tok', 'Token', start, start + len(word))
+        token['features'] = {'word': word, 'pos': pos}
+        return token
+
+    def _annotation(self, prefix, atype, start, end):
+        self.count += 1
+        return {'id': '%s%d' % (prefix, self.count), '@type': VOCAB % atype,
+                'start': start, 'end': end, 'features': {}}
+
+    def lif(self, views, metadata=None):
+        lif = LIF()
+        lif.text.value = self.text
+        lif.metadata = metadata or {}
+        for identifier, annotations in views:
+            view = View()
+            view.id = identifier
+            view.annotations = [Annotation(a) for a in annotations]
+            lif.views.append(view)
+        return lif
+
+    def stages(self):
+        """Return a dictionary with the LIF object of each stage."""
+        rng = self.rng
+        topics = []
+        for topic in rng.sample(TOPICS, 3):
+            topics.append(self._annotation('top', 'SemanticTag', 0, 0))
+            topics[-1]['features']['topic_name'] = topic
+        authors = ["%s %s" % (rng.choice(self.vocabulary.first_names), rng.choice(LAST_NAMES))
+                   for i in range(rng.randint(1, 4))]
+        wikis = [{'title': t, 'score': 1.0 / (n + 1)}
+                 for n, t in enumerate(rng.sample(self.vocabulary.technologies, 10))]
+        return {
+            'lif': self.lif([('pages', self.pages)]),
+            'spl': self.lif([('v1', self.tokens), ('v2', self.sentences)]),
+            'pos': self.lif([('v1', self.sentences), ('v2', self.tokens)]),
+            'ner': self.lif([('v1', self.tokens), ('v2', self.entities)]),
+            'sen': self.lif([('sentences', self.sentences)]),
+            'tex': self.lif([('tex', self.technologies)]),
+            'top': self.lif([('topics', topics)]),
+            'mta': self.lif([], {'authors': authors, 'year': rng.randint(1950, 2000)}),
+            'wik': self.lif([], {'wikified_es': wikis})}
+
+
+def generate_corpus(data_dir, documents=10, pages=20, sentences=30, tokens=20, seed=1):
+    """Write a synthetic corpus to data_dir and return the file list."""
+    vocabulary = Vocabulary()
+    rng = random.Random(seed)
+    fnames = []
+    for n in range(documents):
+        fname = '%06d/tesseract-300dpi-20p.txt' % (n + 1)
+        document = SyntheticDocument(vocabulary, rng, pages, sentences, tokens)
+        write_document(data_dir, fname, document.stages())
+        fnames.append(fname)
+    filelist = os.path.join(data_dir, 'files.txt')
+    with open(filelist, 'w') as fh:
+        fh.write(''.join('%s\n' % fname for fname in fnames))
+    return filelist
+
+
+def write_document(data_dir, fname, stages):
+    """Write the stages of a document, the lif, spl, pos and ner stages are
+    containers with the text, like the files created by the LAPPS services."""
+    for stage in ('lif', 'spl', 'pos', 'ner'):
+        out_file = stage_file(data_dir, fname, stage)
+        ensure_directory(out_file)
+        container = {'discriminator': 'http://vocab.lappsgrid.org/ns/media/jsonld#lif',
+                     'parameters': {}, 'payload': stages[stage].as_json()}
+        write_file(out_file, json.dumps(container, indent=2))
+    for stage in ('sen', 'tex', 'top', 'mta', 'wik'):
+        write_lif(data_dir, fname, stage, stages[stage])
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], 'd:n:p:s:t:', ['seed='])
+    options = dict(opts)
+    filelist = generate_corpus(options['-d'], int(options.get('-n', 10)),
+                               int(options.get('-p', 20)), int(options.get('-s', 30)),
+                               int(options.get('-t', 20)), int(options.get('--seed', 1)))
+    print("Wrote %s" % filelist)
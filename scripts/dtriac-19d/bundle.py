@@ -0,0 +1,63 @@
+"""bundle.py
+
+Pack the results of the processing stages of documents into bundles or list the
+contents of bundles.
+
+Usage:
+
+$ python3 bundle.py -d DATA_DIR -f FILELIST (-b BEGIN) (-e END) (--crash)
+$ python3 bundle.py --list BUNDLE_FILE ...
+
+The first form creates DATA_DIR/bnd/DOCID.zip for each document in the given
+range of the file list, with the text and the LIF objects of all stages in
+utils.STAGE_FILES whose files exist. Stages already in the bundle are replaced.
+
+The second form prints the stages and the member sizes of bundles.
+
+Stages that use utils.read_lif() and utils.write_lif() read from and write to
+the bundle when they are given the --bundle option. See lif.Bundle for the
+layout of the bundle.
+
+"""
+
+import os
+import sys
+import getopt
+import zipfile
+
+from lif import Bundle
+from utils import process_list, ensure_directory
+from utils import STAGE_FILES, stage_file, bundle_file
+
+
+def pack(data_dir, fname):
+    bundle = Bundle(bundle_file(data_dir, fname))
+    ensure_directory(bundle.fname)
+    for stage in sorted(STAGE_FILES):
+        lif_file = stage_file(data_dir, fname, stage)
+        if os.path.exists(lif_file):
+            bundle.add_file(stage, lif_file)
+
+
+def list_bundle(fname):
+    bundle = Bundle(fname)
+    print(bundle)
+    with zipfile.ZipFile(fname) as zf:
+        for info in zf.infolist():
+            print("   %-12s %10d %10d" % (info.filename, info.file_size, info.compress_size))
+
+
+if __name__ == '__main__':
+
+    options, args = getopt.getopt(sys.argv[1:], 'd:f:b:e:', ['crash', 'list'])
+    options = dict(options)
+    if '--list' in options:
+        for fname in args:
+            list_bundle(fname)
+    else:
+        data_dir = options.get('-d')
+        filelist = options.get('-f', 'files-random.txt')
+        start = int(options.get('-b', 1))
+        end = int(options.get('-e', 1))
+        crash = True if '--crash' in options else False
+        process_list(data_dir, filelist, start, end, crash, pack)
@@ -4,23 +4,36 @@ Code to collect annotations of a particular kind. Takes some number of files in
 DIRECTORY and then prints the text of all instances of TAG to standard output,
 using the feat-value pair if one was given.
 
-$ python3 collect_annotations.py DIRECTORY N TAG (feat=val)
+$ python3 collect_annotations.py (-p PROCESSES) (--index INDEX_FILE) DIRECTORY N TAG (feat=val)
 
 For example:
 
 $ export DATA=/DATA/dtra/dtriac-19d-00100-processed/
 $ python3 show_annotations.py $DATA/ner 100 NamedEntity category=location
 
+Files are read by PROCESSES worker processes (default is the number of CPUs),
+see mapreduce.py. Annotations are matched on the JSON objects, without creating
+a LIF object. With --index the annotations are taken from an index created by
+annotation_index.py, which is much faster, DIRECTORY is then only used for the
+name of the stage and the list of documents. The index only has the features in
+annotation_index.FEATURES, for a restriction on another feature the files are
+read instead.
+
 """
 
 import os
 import sys
+import json
+import getopt
+from functools import partial
 from collections import Counter
 
-from lif import Container
+from lif import read_file
+from mapreduce import map_reduce, PROCESSES
+from annotation_index import AnnotationIndex, FEATURES
 
 
-def collect(path, n, tag, restriction=None):
+def collect(path, n, tag, restriction=None, processes=PROCESSES, index_file=None):
     print("# SCRIPT  =  %s" % 'scripts/dtriac-19d/collect_annotations.py')
     print("# PATH    =  %s" % path)
     print("# FILES   =  %s" % n)
@@ -32,36 +45,52 @@ def collect(path, n, tag, restriction=None):
     full_tag = "http://vocab.lappsgrid.org/%s" % tag
     processing_step = os.path.split(path)[1]
     subdirs = os.listdir(path)[:int(n)]
-    locations = []
-    for subdir in subdirs:
-        fname = os.path.join(path, subdir, "%s.%s.lif" % (subdir, processing_step))
-        lif = Container(fname).payload
-        for view in lif.views:
-            for annotation in view.annotations:
-                if annotation_matches(annotation, full_tag, feat, val):
-                    p1 = annotation.start
-                    p2 = annotation.end
-                    locations.append(annotation.features.get('word'))
-    locs = Counter(locations)
+    fnames = [os.path.join(path, subdir, "%s.%s.lif" % (subdir, processing_step))
+              for subdir in subdirs]
+    if index_file is not None and feat is not None and feat not in FEATURES:
+        print("# WARNING: %s is not in the index, reading the files instead" % feat)
+        index_file = None
+    if index_file is not None:
+        features = {feat: val} if feat is not None else None
+        annotations = AnnotationIndex(index_file).query(
+            tag, features, stage=processing_step, docids=subdirs)
+        locs = Counter(anno['features'].get('word') for anno in annotations)
+    else:
+        mapper = partial(collect_file, tagname=full_tag, feat=feat, val=val)
+        locs = map_reduce(mapper, fnames, processes=processes) or Counter()
     total_count = sum(locs.values())
     print("# HITS    =  %d" % total_count)
     for loc, count in locs.most_common():
         print("%d \t%s" % (count, loc))
 
 
+def collect_file(fname, tagname, feat, val):
+    """Return a Counter with the words of the matching annotations in fname."""
+    json_obj = json.loads(read_file(fname))
+    words = Counter()
+    for view in json_obj.get('payload', json_obj)['views']:
+        for annotation in view['annotations']:
+            if annotation_matches(annotation, tagname, feat, val):
+                words[annotation.get('features', {}).get('word')] += 1
+    return words
+
+
 def annotation_matches(annotation, tagname, feat, val):
-    if annotation.type != tagname:
+    if annotation['@type'] != tagname:
         return False
     if feat is not None:
-        return annotation.features.get(feat) == val
+        return annotation.get('features', {}).get(feat) == val
     else:
         return True
 
 
 if __name__ == '__main__':
 
-    path = sys.argv[1]
-    count = sys.argv[2]
-    tag = sys.argv[3]
-    restriction = sys.argv[4] if len(sys.argv) > 4 else None
-    collect(path, count, tag, restriction)
+    opts, args = getopt.getopt(sys.argv[1:], 'p:', ['index='])
+    processes = int(dict(opts).get('-p', PROCESSES))
+    index_file = dict(opts).get('--index')
+    path = args[0]
+    count = args[1]
+    tag = args[2]
+    restriction = args[3] if len(args) > 3 else None
+    collect(path, count, tag, restriction, processes, index_file)
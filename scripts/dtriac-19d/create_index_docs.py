@@ -5,7 +5,11 @@ into ElasticSearch.
 
 Usage:
 
-$ python create_index_docs.py -d DATA_DIR -f FILELIST (-b BEGIN) (-e END)
+$ python create_index_docs.py -d DATA_DIR -f FILELIST (-b BEGIN) (-e END) (--bundle)
+      (--metrics METRICS_FILE) (--profile DIRECTORY (--profile-every N))
+
+Person names that span several lines at the start of a line are split into one
+name per line and all person names are normalized, see resources.Names.
 
 Directories:
 lif   LIF files created from the OCR output
@@ -17,25 +21,22 @@ tex   technologies
 mta   metadata (year and author)
 wik   wiki grounding
 ela   output
-
-
-TODO: split multiple names if there is an intervening new line
+bnd   bundles with all of the above except for ela, used with --bundle
 
 """
 
-import os, sys, json
+import os, sys, json, copy
 from pprint import pformat
 from collections import Counter
 
 from lif import LIF, Container, Annotation
 from utils import time_elapsed, elements, ensure_directory, print_element, get_options
+from utils import has_lif, read_lif, process_element, start_metrics, start_profiling
+import metrics
 import resources
 
 TARSKI_URL = 'http://tarski.cs-i.brandeis.edu'
 
-NAMES = resources.Names()
-LOCATIONS = resources.Locations()
-
 
 # this file gets you to the number of pages
 PDFINFO_FILE_PATTERN = '/data/dtriac/dtriac-19d/all/%s/pdfinfo.txt'
@@ -47,49 +48,40 @@ def create_documents(data_dir, filelist, start, end, crash=False):
     ela_dir = os.path.join(data_dir, 'ela')
     if not os.path.exists(ela_dir):
         os.mkdir(ela_dir)
-    for n, fname in elements(filelist, start, end):
-        print_element(n, fname)
-        if crash:
-            create_document(data_dir, fname)
-        else:
-            try:
-                create_document(data_dir, fname)
-            except Exception as e:
-                print('ERROR:', Exception, e)
+    start_metrics()
+    start_profiling()
+    try:
+        for n, fname in elements(filelist, start, end):
+            print_element(n, fname)
+            process_element(data_dir, fname, crash, create_document)
+    finally:
+        metrics.close_metrics()
 
 
 def create_document(data_dir, fname):
-    # the subdir is really the document identifier
-    subdir = os.path.split(fname)[0]
-    lif_file = os.path.join(data_dir, 'lif', fname[:-3] + 'lif')
-    mta_file = os.path.join(data_dir, 'mta', subdir, '%s.mta.lif' % subdir)
-    top_file = os.path.join(data_dir, 'top', fname[:-3] + 'lif')
-    ner_file = os.path.join(data_dir, 'ner', subdir, '%s.ner.lif' % subdir)
-    sen_file = os.path.join(data_dir, 'sen', subdir, '%s.sen.lif' % subdir)
-    tex_file = os.path.join(data_dir, 'tex', subdir, '%s.lup.lif' % subdir)
-    wik_file = os.path.join(data_dir, 'wik', subdir, '%s.wik.lif' % subdir)
-    if not os.path.exists(lif_file):
+    if not has_lif(data_dir, fname, 'lif'):
         print('Skipping...  %s' % fname)
     else:
-        doc = Document(fname, data_dir, lif_file, mta_file, top_file,
-                       ner_file, sen_file, tex_file, wik_file)
-        doc.write(os.path.join(data_dir, 'ela'))
+        doc = Document(fname, data_dir)
+        with metrics.phase('write'):
+            doc.write(os.path.join(data_dir, 'ela'))
 
 
 class Document(object):
 
-    def __init__(self, fname, data_dir, lif_file, mta_file,
-                 top_file, ner_file, sen_file, tex_file, wik_file):
+    def __init__(self, fname, data_dir):
 
         """Build a single LIF object with all relevant annotations. The annotations
-        themselves are stored in the Annotations object in self.annotations."""
+        themselves are stored in the Annotations object in self.annotations. The
+        results of the processing stages are read from the stage files or, with
+        the --bundle option, from the bundle of the document."""
         self.id = int(os.path.split(fname)[0])
         self.fname = fname
         self.data_dir = data_dir
-        self.lif = Container(lif_file).payload
-        self.meta = LIF(mta_file)
-        self.wikis = LIF(wik_file).metadata['wikified_es']
-        self._add_views(ner_file, sen_file, tex_file, top_file)
+        self.lif = read_lif(data_dir, fname, 'lif')
+        self.meta = read_lif(data_dir, fname, 'mta', with_text=False)
+        self.wikis = read_lif(data_dir, fname, 'wik', with_text=False).metadata['wikified_es']
+        self._add_views()
         self.lif.metadata["filename"] = self.fname
         self.lif.metadata["year"] = self._get_year()
         self.annotations = Annotations(self.id, fname, doc=self,
@@ -98,23 +90,21 @@ class Document(object):
         self._collect_allowed_offsets()
         self._collect_annotations()
 
-    def _add_views(self, ner_file, sen_file, tex_file, top_file):
-        self._add_view("ner", ner_file, 1)
-        self._add_view("sen", sen_file, 0)
-        self._add_view("tex", tex_file, 0)
-        self._add_view("top", top_file, 0)
+    def _add_views(self):
+        self._add_view("ner", 1)
+        self._add_view("sen", 0)
+        self._add_view("tex", 0)
+        self._add_view("top", 0)
 
-    def _add_view(self, identifier, fname, view_rank):
-        """Load fname as either a LIF object or a Container object and select the
-        specified view, indicated by an index in the view list. Add the
+    def _add_view(self, identifier, view_rank):
+        """Load the LIF object of the stage with the given identifier and select
+        the specified view, indicated by an index in the view list. Add the
         identifier to this view and add it to the list of views. Note that some
-        files contain LIF objects and others contain Containers with LIF
-        embedded. The view we are looking for is the first or second, depending
-        on how the processor for those data was set up."""
-        try:
-            view = Container(fname).payload.views[view_rank]
-        except KeyError:
-            view = LIF(fname).views[view_rank]
+        stages write LIF objects and others write Containers with LIF embedded,
+        read_lif() takes care of that. The view we are looking for is the first
+        or second, depending on how the processor for those data was set up."""
+        lif = read_lif(self.data_dir, self.fname, identifier, with_text=False)
+        view = lif.views[view_rank]
         view.id = identifier
         self.lif.views.append(view)
 
@@ -171,24 +161,40 @@ class Document(object):
 
     def _collect_entities(self):
         view = self.get_view("ner")
+        names = resources.get('names')
+        locations = resources.get('locations')
+        persons = []
         for entity in view.annotations:
             entity.text = self.get_text(entity)
             category = entity.features.get('category')
             if category == 'person':
-                if NAMES.filter(entity.text):
-                    continue
-                # NAMES.normalize(entity.text)
-                self.annotations.persons.add(entity)
+                persons.extend(self._split_person(entity, names))
             elif category == 'location':
-                coordinates = LOCATIONS.get_coordinates(entity.text)
+                coordinates = locations.get_coordinates(entity.text)
                 entity.features['coordinates'] = coordinates
                 self.annotations.locations.add(entity)
             elif category == 'organization':
                 self.annotations.organizations.add(entity)
+        filtered = names.filter_all([person.text for person in persons])
+        for person in persons:
+            if person.text not in filtered:
+                self.annotations.persons.add(person)
         self.annotations.persons.finish()
         self.annotations.locations.finish()
         self.annotations.organizations.finish()
 
+    def _split_person(self, entity, names):
+        """Return the person annotations for a person entity, with normalized
+        names, there may be more than one if the entity spans several lines."""
+        spans = names.split(self.lif, entity)
+        persons = []
+        for start, end, name in spans:
+            person = entity if len(spans) == 1 else copy.copy(entity)
+            person.start, person.end = start, end
+            person.text = names.normalize(name)
+            persons.append(person)
+        return persons
+
     def _collect_technologies(self):
         view = self.get_view("tex")
         for tech in view.annotations:
@@ -197,8 +203,9 @@ class Document(object):
         self.annotations.technologies.finish()
 
     def write(self, dirname):
-        self.annotations.write(os.path.join(dirname, "%06d.json" % self.id),
-                               self.lif.metadata["year"])
+        fname = os.path.join(dirname, "%06d.json" % self.id)
+        self.annotations.write(fname, self.lif.metadata["year"])
+        metrics.count('bytes_out', metrics.file_size(fname))
 
     def pp(self, prefix=''):
         views = ["%s:%d" % (view.id, len(view)) for view in self.lif.views]
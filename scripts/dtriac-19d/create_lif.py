@@ -4,26 +4,48 @@ Create LIF files from the Tesseract output.
 
 Usage:
 
-$ python create_lif.py -s SOURCE_DIR -b DATA_DIR -f FILELIST -b BEGIN -e END
+$ python create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST -b BEGIN -e END
+$ python create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST -b BEGIN -e END -p PROCESSES
+$ python create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST --test
+$ python create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST --metrics METRICS_FILE
+$ python create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST --profile DIR (--profile-every N)
+$ python create_lif.py (-h | --help)
 
 The first directory is the one with files created by Tesseract, the second the
 target for LIF files.
 
+The LIF file is written as the pages come in, using the LIFWriter, so the text of
+a document is never held in memory in its entirety. With the -p option the files
+are processed by a pool of PROCESSES workers. In both cases the number of pages
+processed per second is printed at the end.
+
+With the --debug option the candidate headers and footers for all files are
+written to list-headers.txt and list-footers.txt, this is ignored when running
+with more than one process.
+
+With --metrics the time and the input and output sizes of each document are
+appended to METRICS_FILE, see metrics.py. Since pages are written as they are
+read, the time is not split in parsing and writing. With --profile every Nth
+document is profiled, see profiling.py.
+
 """
 
 
 import os
 import sys
+import time
 import getopt
-import json
 from io import StringIO
+from multiprocessing import Pool
 
-from lif import LIF, Container, View, Annotation
-from utils import time_elapsed, elements, ensure_directory, print_element
+from lif import LIF, Container, View, Annotation, LIFWriter, open_lif_file
+from utils import time_elapsed, elements, ensure_directory, print_element, LazyFile, docid
+import metrics
+import profiling
 
 
-HEADER_FILE = open("list-headers.txt", 'w')
-FOOTER_FILE = open("list-footers.txt", 'w')
+HEADER_FILE = LazyFile("list-headers.txt")
+FOOTER_FILE = LazyFile("list-footers.txt")
 
 PAGE_NUMBERS = { '1', '2', '3', '4', '5', '6', '7', '8', '9', '10',
                  '11', '12', '13', '14', '15', '16', '17', '18', '19', '20'}
@@ -31,58 +53,109 @@ PAGE_NUMBERS = { '1', '2', '3', '4', '5', '6', '7', '8', '9', '10',
 ROMAN_NUMERALS = {'i', 'ii', 'iii', 'iv', 'v', 'vi', 'vii', 'viii', 'ix', 'x',
                   'xi', 'xii', 'xii', 'xiv', 'xv', 'xvi', 'xvii', 'xvii', 'xix', 'xx'}
 
+PAGE_MARKER = u"\U0001F4C3"
+
 
 @time_elapsed
-def process_filelist(source_dir, data_dir, filelist, start, end, crash=False, test=False):
+def process_filelist(source_dir, data_dir, filelist, start, end,
+                     crash=False, test=False, debug=False):
     print("$ python3 %s\n" % ' '.join(sys.argv))
+    t0 = time.time()
+    documents, pages = 0, 0
     for n, fname in elements(filelist, start, end):
         print_element(n, fname)
+        try:
+            with metrics.document('create_lif', docid(fname)), profiling.document('create_lif'):
+                pages += process_list_element(source_dir, data_dir, fname, test=test, debug=debug)
+        except Exception as e:
+            if crash:
+                raise
+            print('ERROR:', Exception, e)
+            continue
+        documents += 1
+    print_throughput(documents, pages, time.time() - t0)
+
+
+@time_elapsed
+def process_filelist_parallel(source_dir, data_dir, filelist, start, end,
+                              processes, crash=False):
+    """Like process_filelist(), but hand the files to a pool of processes. Output
+    is printed in the order in which the files are finished."""
+    print("$ python3 %s\n" % ' '.join(sys.argv))
+    t0 = time.time()
+    documents, pages = 0, 0
+    jobs = [(source_dir, data_dir, n, fname, crash)
+            for n, fname in elements(filelist, start, end)]
+    pool = Pool(processes)
+    try:
+        for n, fname, page_count, error in pool.imap_unordered(_process_job, jobs, 4):
+            print_element(n, fname)
+            if error is not None:
+                print('ERROR:', Exception, error)
+            else:
+                documents += 1
+                pages += page_count
+    finally:
+        pool.close()
+        pool.join()
+    print_throughput(documents, pages, time.time() - t0)
+
+
+def _process_job(job):
+    source_dir, data_dir, n, fname, crash = job
+    try:
+        with metrics.document('create_lif', docid(fname)), profiling.document('create_lif'):
+            return n, fname, process_list_element(source_dir, data_dir, fname), None
+    except Exception as e:
         if crash:
-            process_list_element(source_dir, data_dir, fname, test=test)
-        else:
-            try:
-                process_list_element(source_dir, data_dir, fname, test=test)
-            except Exception as e:
-                print('ERROR:', Exception, e)
+            raise
+        return n, fname, 0, e
 
 
-def process_list_element(source_dir, data_dir, fname, test=False):
+def print_throughput(documents, pages, seconds):
+    print("\nProcessed %d documents with %d pages in %.2f seconds (%.2f pages/sec)"
+          % (documents, pages, seconds, pages / seconds if seconds else 0))
+
+
+def process_list_element(source_dir, data_dir, fname, test=False, debug=False):
+    """Create the LIF file for fname or, in test mode, print its pages. Returns
+    the number of pages."""
     src_file = os.path.join(source_dir, fname)
     lif_file = os.path.join(data_dir, 'lif', fname[:-4] + '.lif')
     if test:
-        test_lif_file(lif_file)
-    else:
-        ensure_directory(lif_file)
-        create_lif_file(src_file, lif_file)
-
-
-def create_lif_file(src_file, lif_file, test=False):
-    HEADER_FILE.write("\n%s\n\n" % src_file)
-    FOOTER_FILE.write("\n%s\n\n" % src_file)
+        return test_lif_file(lif_file)
+    ensure_directory(lif_file)
+    pages = create_lif_file(src_file, lif_file, debug=debug)
+    metrics.count('bytes_in', metrics.file_size(src_file))
+    metrics.count('bytes_out', metrics.file_size(lif_file))
+    return pages
+
+
+def create_lif_file(src_file, lif_file, test=False, debug=False):
+    """Create a LIF file from the Tesseract output, writing the text of each
+    page as soon as the end of the page is found. Returns the number of
+    pages."""
+    if debug:
+        HEADER_FILE.write("\n%s\n\n" % src_file)
+        FOOTER_FILE.write("\n%s\n\n" % src_file)
     with open(src_file, encoding='utf8') as fh_in, \
-         open(lif_file, 'w', encoding='utf8') as fh_out:
-        lif_obj = LIF()
+         open_lif_file(lif_file, 'w') as fh_out:
+        writer = LIFWriter(fh_out)
         page_view = create_page_view()
-        lif_obj.views.append(page_view)
-        text = StringIO()
-        offset = 0
-        page = Page(offset)
+        page = Page(writer.offset, debug=debug)
         for line in fh_in:
-            if line.startswith(u"\U0001F4C3"):
+            if line.startswith(PAGE_MARKER):
                 page.parse(line)
-                offset = page.end
-                text.write(page.text)
-                anno = page.as_annotation()
-                #print(anno.as_json())
-                page_view.annotations.append(anno)
-                page = Page(offset)
+                writer.write_text(page.text)
+                page_view.annotations.append(page.as_annotation())
+                page = Page(writer.offset, debug=debug)
             else:
                 page.add(line)
-        lif_obj.text.value = text.getvalue()
-        container = create_container(lif_obj)
-        fh_out.write(json.dumps(container.as_json(), indent=4))
+        writer.write_view(page_view)
+        writer.close()
     if test:
         test_lif_file(lif_file)
+    return len(page_view.annotations)
 
 
 def create_container(lif_object):
@@ -101,8 +174,9 @@ def create_page_view():
 
 class Page(object):
 
-    def __init__(self, offset):
+    def __init__(self, offset, debug=False):
         self.start = offset
+        self.debug = debug
         self.end = None
         self.buffer = StringIO()
         self.number = None
@@ -131,7 +205,7 @@ class Page(object):
         self.buffer.write(line)
 
     def parse(self, line):
-        self.number = line.strip().strip(u"\U0001F4C3").strip()
+        self.number = line.strip().strip(PAGE_MARKER).strip()
         self.text = self.buffer.getvalue()
         self.split_header()
         self.split_footer()
@@ -147,8 +221,9 @@ class Page(object):
                     #print('H', header)
                     self.text = text
                     self.header = header.strip()
-                    HEADER_FILE.write("+ %s\n" % header)
-                else:
+                    if self.debug:
+                        HEADER_FILE.write("+ %s\n" % header)
+                elif self.debug:
                     HEADER_FILE.write("- %s\n" % header)
 
     def split_footer(self):
@@ -161,8 +236,9 @@ class Page(object):
                     #print('F', footer)
                     self.text = text
                     self.footer = footer.strip()
-                    FOOTER_FILE.write("+ %s\n" % footer)
-                else:
+                    if self.debug:
+                        FOOTER_FILE.write("+ %s\n" % footer)
+                elif self.debug:
                     FOOTER_FILE.write("- %s\n" % footer)
 
     def as_annotation(self):
@@ -189,18 +265,30 @@ def test_lif_file(lif_file):
         page = text[anno.start:anno.end]
         print("<{}> {}".format(anno.id, ' '.join(page[:80].split())))
     print('')
+    return len(view.annotations)
 
 
 def vocab(annotation_type):
     return "http://vocab.lappsgrid.org/{}".format(annotation_type)
 
 
+def usage():
+    print("\nUsage:\n"
+          + "\n    $ python3 create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST -b BEGIN -e END"
+          + "\n    $ python3 create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST -b BEGIN -e END -p PROCESSES"
+          + "\n    $ python3 create_lif.py -s SOURCE_DIR -d DATA_DIR -f FILELIST --test"
+          + "\n    $ python3 create_lif.py (-h | --help)"
+          + "\n\nOptions: --crash, --debug, --metrics METRICS_FILE, --profile DIR, --profile-every N\n")
+
+
 if __name__ == '__main__':
 
     data_dir = '/DATA/dtra/dtriac/dtriac-19d/dtriac-19d-00100'
     filelist = 'files-random.txt'
 
-    options = dict(getopt.getopt(sys.argv[1:], 's:d:f:b:e:h', ['test', 'crash', 'help'])[0])
+    options = dict(getopt.getopt(sys.argv[1:], 's:d:f:b:e:p:h',
+                                 ['test', 'crash', 'debug', 'help', 'metrics=', 'profile=',
+                                  'profile-every='])[0])
     source_dir = options.get('-s', data_dir)
     data_dir = options.get('-d', data_dir)
     filelist = options.get('-f', filelist)
@@ -208,10 +296,23 @@ if __name__ == '__main__':
     end = int(options.get('-e', 1))
     crash = True if '--crash' in options else False
     test = True if '--test' in options else False
+    debug = True if '--debug' in options else False
+    processes = int(options.get('-p', 1))
     help_wanted = True if '-h' in options or '--help' in options else False
 
+    if '--metrics' in options:
+        metrics.open_metrics(options['--metrics'])
+    if '--profile' in options:
+        profiling.start_profiling(options['--profile'], int(options.get('--profile-every', 1)))
+
     if help_wanted:
         usage()
     else:
         print(source_dir, data_dir, filelist, start, end, crash, test)
-        process_filelist(source_dir, data_dir, filelist, start, end, crash=crash, test=test)
+        if processes > 1 and not test:
+            process_filelist_parallel(source_dir, data_dir, filelist, start, end,
+                                      processes, crash=crash)
+        else:
+            process_filelist(source_dir, data_dir, filelist, start, end,
+                             crash=crash, test=test, debug=debug)
+    metrics.close_metrics()
@@ -0,0 +1,206 @@
+"""gazetteer.py
+
+Offline gazetteer for geocoding locations, built from a GeoNames dump.
+
+Usage:
+
+$ python3 gazetteer.py --build GEONAMES_FILE (GAZETTEER_FILE)
+$ python3 gazetteer.py --lookup NAME ...
+
+GEONAMES_FILE is one of the tab-separated dumps from
+http://download.geonames.org/export/dump/, for example allCountries.txt or the
+much smaller cities15000.txt, it can be gzipped. The gazetteer is an SQLite
+database with a table of places and a table with an index from normalized names
+to places, which includes the alternate names of each place. GAZETTEER_FILE
+defaults to data/locations/geonames.db.
+
+Names are looked up in bulk, first on the normalized name (lower case, no
+accents, no punctuation), then on a few rewrites of the name (no leading "the",
+only the part before a comma, an alias from ALIASES) and finally with fuzzy
+matching against names with the same first three characters. Of all places with
+a name the one with the largest population is taken, countries and
+administrative regions are preferred over other places with the same name.
+
+Results have the form of the raw results of the Nominatim geocoder that are
+cached by locations.py, so the cache can be used with build_locations_index().
+
+"""
+
+import io
+import os
+import re
+import sys
+import gzip
+import sqlite3
+import difflib
+import unicodedata
+
+
+GAZETTEER_FILE = 'data/locations/geonames.db'
+
+# Aliases for names that GeoNames does not have as alternate names, after
+# normalization.
+ALIASES = {
+    'us': 'united states', 'usa': 'united states', 'u s': 'united states',
+    'u s a': 'united states', 'america': 'united states',
+    'uk': 'united kingdom', 'u k': 'united kingdom', 'britain': 'united kingdom',
+    'great britain': 'united kingdom',
+    'ussr': 'russia', 'soviet union': 'russia', 'u s s r': 'russia',
+    'dc': 'washington d c', 'd c': 'washington d c'}
+
+# Ranking of feature classes, used to break ties between places with the same
+# name: countries and regions, then populated places, then everything else.
+FEATURE_RANK = {'A': 2, 'P': 1}
+
+# Cutoff for difflib similarity in fuzzy matching and the minimum length of a
+# name for fuzzy matching to be used.
+FUZZY_CUTOFF = 0.88
+FUZZY_MIN_LENGTH = 5
+
+# Maximum number of variables in an SQLite query.
+BATCH_SIZE = 500
+
+# Columns in the GeoNames dump.
+GEONAMEID, NAME, ASCIINAME, ALTERNATENAMES, LATITUDE, LONGITUDE = 0, 1, 2, 3, 4, 5
+FEATURE_CLASS, FEATURE_CODE, COUNTRY_CODE, POPULATION = 6, 7, 8, 14
+
+
+def normalize(name):
+    """Lower case, remove accents and replace all non-alphanumeric characters
+    with a single space."""
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c))
+    return ' '.join(re.split(r'\W+', name.lower(), flags=re.UNICODE)).strip()
+
+
+def build_gazetteer(geonames_file, gazetteer_file=GAZETTEER_FILE):
+    if os.path.exists(gazetteer_file):
+        os.remove(gazetteer_file)
+    db = sqlite3.connect(gazetteer_file)
+    db.execute("CREATE TABLE places (id INTEGER PRIMARY KEY, name TEXT, lat TEXT,"
+               " lon TEXT, class TEXT, code TEXT, country TEXT, population INTEGER)")
+    db.execute("CREATE TABLE names (name TEXT, id INTEGER)")
+    opener = gzip.open if geonames_file.endswith('.gz') else io.open
+    places = 0
+    with opener(geonames_file, 'rt', encoding='utf8') as fh:
+        for line in fh:
+            fields = line.rstrip('\n').split('\t')
+            place_id = int(fields[GEONAMEID])
+            db.execute("INSERT INTO places VALUES (?,?,?,?,?,?,?,?)",
+                       (place_id, fields[NAME], fields[LATITUDE], fields[LONGITUDE],
+                        fields[FEATURE_CLASS], fields[FEATURE_CODE],
+                        fields[COUNTRY_CODE], int(fields[POPULATION] or 0)))
+            names = [fields[NAME], fields[ASCIINAME]] + fields[ALTERNATENAMES].split(',')
+            names = set(normalize(n) for n in names if n)
+            db.executemany("INSERT INTO names VALUES (?,?)",
+                           [(n, place_id) for n in names if n])
+            places += 1
+            if places % 100000 == 0:
+                print("%d places" % places)
+    db.execute("CREATE INDEX names_name ON names (name)")
+    db.commit()
+    db.close()
+    print("Added %d places to %s" % (places, gazetteer_file))
+
+
+class Gazetteer(object):
+
+    def __init__(self, gazetteer_file=GAZETTEER_FILE):
+        """Open the gazetteer read-only, connecting to a file that does not exist
+        would create an empty database that does not find anything."""
+        if not os.path.exists(gazetteer_file):
+            raise IOError("no gazetteer at %s, build it first with"
+                          " python3 gazetteer.py --build GEONAMES_FILE" % gazetteer_file)
+        self.fname = gazetteer_file
+        uri = 'file:%s?mode=ro' % os.path.abspath(gazetteer_file)
+        self.db = sqlite3.connect(uri, uri=True)
+
+    def __str__(self):
+        return "<Gazetteer %s>" % self.fname
+
+    def lookup(self, name):
+        return self.lookup_all([name])[name]
+
+    def lookup_all(self, names):
+        """Return a dictionary with a result for each name in names, None if the
+        name was not found."""
+        results = {}
+        variants = dict((name, self._variants(name)) for name in names)
+        places = self._best_places(sorted(set(v for vs in variants.values() for v in vs)))
+        for name in names:
+            results[name] = None
+            for variant in variants[name]:
+                if variant in places:
+                    results[name] = self._result(places[variant])
+                    break
+        for name in names:
+            if results[name] is None:
+                place = self._fuzzy_match(normalize(name))
+                if place is not None:
+                    results[name] = self._result(place)
+        return results
+
+    @staticmethod
+    def _variants(name):
+        """Return the normalized rewrites of a name, in order of preference."""
+        variants = []
+        for candidate in (name, name.split(',')[0]):
+            candidate = normalize(candidate)
+            if candidate.startswith('the '):
+                candidate = candidate[4:]
+            for variant in (candidate, ALIASES.get(candidate)):
+                if variant and variant not in variants:
+                    variants.append(variant)
+        return variants
+
+    def _best_places(self, normalized_names):
+        """Return a dictionary with the best place for each of the normalized names
+        that is in the gazetteer."""
+        best = {}
+        for i in range(0, len(normalized_names), BATCH_SIZE):
+            batch = normalized_names[i:i + BATCH_SIZE]
+            query = ("SELECT n.name, p.id, p.name, p.lat, p.lon, p.class, p.code,"
+                     " p.country, p.population FROM names n JOIN places p ON n.id = p.id"
+                     " WHERE n.name IN (%s)" % ','.join('?' * len(batch)))
+            for row in self.db.execute(query, batch):
+                if row[0] not in best or _rank(row[1:]) > _rank(best[row[0]]):
+                    best[row[0]] = row[1:]
+        return best
+
+    def _fuzzy_match(self, normalized_name):
+        if len(normalized_name) < FUZZY_MIN_LENGTH:
+            return None
+        prefix = normalized_name[:3]
+        candidates = [row[0] for row in self.db.execute(
+            "SELECT DISTINCT name FROM names WHERE name >= ? AND name < ?",
+            (prefix, prefix + u'\uffff'))]
+        matches = difflib.get_close_matches(normalized_name, candidates, 1, FUZZY_CUTOFF)
+        if not matches:
+            return None
+        return self._best_places(matches).get(matches[0])
+
+    @staticmethod
+    def _result(place):
+        """Return the place in the form of a Nominatim result."""
+        place_id, name, lat, lon, feature_class, feature_code, country, population = place
+        return {'place_id': place_id,
+                'display_name': "%s, %s" % (name, country),
+                'lat': lat, 'lon': lon,
+                'boundingbox': [lat, lat, lon, lon],
+                'class': feature_class, 'type': feature_code,
+                'source': 'geonames'}
+
+
+def _rank(place):
+    return (FEATURE_RANK.get(place[4], 0), place[7])
+
+
+if __name__ == '__main__':
+
+    mode = sys.argv[1]
+    if mode == '--build':
+        build_gazetteer(*sys.argv[2:4])
+    elif mode == '--lookup':
+        gazetteer = Gazetteer()
+        for name, result in sorted(gazetteer.lookup_all(sys.argv[2:]).items()):
+            print("%-30s  %s" % (name, result))
@@ -8,6 +8,10 @@ $ python generate_metadata.py -d DATA_DIR -f FILELIST -s START -e END
 
 Uses data in DATA_DIR/lif an DATA_DIR/ner and generates data in DATA_DIR/mta.
 
+Metadata are taken from the first pages only, so only the annotations in that
+window are read from the lif and ner files (see lif.read_window()), which makes
+the time needed for a document almost independent of its length.
+
 TODO:
 
 Now we take all names, after some filtering from the window. Do two things:
@@ -24,7 +28,7 @@ import os
 import re
 
 from lif import Container, LIF, View
-from utils import get_options, process_list, ensure_directory
+from utils import get_options, process_list, read_lif, read_lif_window, write_lif
 import resources
 
 
@@ -38,62 +42,75 @@ LATEST_DOC = 2020
 MONTHS = { 'january', 'february', 'march', 'april', 'may', 'june',
            'july', 'august', 'september', 'october', 'november', 'december' }
 
-# Allows you to filter out some kinds of names
-NAMES = resources.Names()
-
-
 def generate_metadata(data_dir, fname):
 
-    subdir = os.path.split(fname)[0]
-    lif_file = os.path.join(data_dir, 'lif', subdir, "tesseract-300dpi-20p.lif")
-    ner_file = os.path.join(data_dir, 'ner', subdir, "%s.ner.lif" % subdir)
-    mta_file = os.path.join(data_dir, 'mta', subdir, "%s.mta.lif" % subdir)
-    ensure_directory(mta_file)
-
-    lif = Container(lif_file).payload
-    lif_ner = Container(ner_file).payload
-    lif_mta = LIF(json_object=lif.as_json())
-    lif_mta.text.value = None
-    lif_mta.text.fname = lif_file
-    lif_mta.views = []
-    lif.metadata["authors"] = []
-    lif.metadata["year"] = None
-
-    page_view = lif.get_view("pages")
-    ner_view = lif_ner.get_view('v2')
-
+    # Only the start of the document is read, the pages view is the first view
+    # of the lif stage and named entities are in the second view of the ner stage
+    lif = read_lif_window(data_dir, fname, 'lif', METADATA_WINDOW_MAXIMUM, [0])
+    page_view = lif.views[0]
     window = _get_window(page_view)
-    lif.metadata["authors"] = _get_authors(lif, ner_view, window)
-    lif.metadata["year"] = _get_year(ner_view, window)
+    ner_view = _get_ner_view(data_dir, fname, window)
 
-    lif_mta.write(fname=mta_file, pretty=True)
+    lif_mta = lif.derive()
+    authors, year = _get_authors_and_year(lif, ner_view, window)
+    lif_mta.metadata["authors"] = authors
+    lif_mta.metadata["year"] = year
+
+    write_lif(data_dir, fname, 'mta', lif_mta)
 
 
 def _get_window(page_view):
     """Get the offset window in which we will be looking for metadata. This is
     window is from offset 0 to lesser of a) the last offset of the last page
-    considered for metadata and b) a preset maximum offset."""
-    return (0, min(METADATA_WINDOW_MAXIMUM, page_view.annotations[METADATA_PAGES].end))
-
-
-def _get_authors(lif, ner_view, window):
+    considered for metadata and b) a preset maximum offset. The page view may
+    have been cut off after the maximum offset, and then the maximum is used."""
+    pages = page_view.annotations
+    if len(pages) <= METADATA_PAGES:
+        return (0, METADATA_WINDOW_MAXIMUM)
+    return (0, min(METADATA_WINDOW_MAXIMUM, pages[METADATA_PAGES].end))
+
+
+def _get_ner_view(data_dir, fname, window):
+    """Return the named entity view, with at least the entities in the window.
+    The windowed read cannot see view identifiers, so if the second view does not
+    have named entities (which happens when the views are in another order, but
+    also when there are no entities) the whole ner stage is read and the view is
+    taken by its identifier."""
+    try:
+        views = read_lif_window(data_dir, fname, 'ner', window[1], [1]).views
+    except IndexError:
+        views = []
+    if views and views[0].annotations and all(
+            a.type.endswith('NamedEntity') for a in views[0].annotations):
+        return views[0]
+    return read_lif(data_dir, fname, 'ner', with_text=False).get_view('v2')
+
+
+def _get_authors_and_year(lif, ner_view, window):
+    """Collect authors and dates from the named entities in the window, in one
+    pass over the entities."""
+    names = resources.get('names')
     authors = []
+    dates = []
     for anno in ner_view.annotations:
-        if anno.features.get('category') == 'person':
-            if anno.end <= window[1]:
-                # NAMES.split(lif, anno)
-                authors.append(anno.features['word'])
+        if anno.end > window[1]:
+            continue
+        category = anno.features.get('category')
+        if category == 'person':
+            for start, end, name in names.split(lif, anno):
+                authors.append(names.normalize(name))
+        elif category == 'date':
+            dates.append(anno.features['word'])
+    return _get_authors(names, authors), _get_year(dates)
+
+
+def _get_authors(names, authors):
     authors = [a for a in authors if ' ' in a]
-    authors = [a for a in authors if not NAMES.filter(a)]
-    return authors
+    filtered = names.filter_all(authors)
+    return [a for a in authors if a not in filtered]
 
 
-def _get_year(ner_view, window):
-    dates = []
-    for anno in ner_view.annotations:
-        if anno.features.get('category') == 'date':
-            if anno.end <= window[1]:
-                dates.append(anno.features['word'])
+def _get_year(dates):
     dates = [d for d in dates if is_nice_date(d)]
     #print('   ', dates)
     if dates:
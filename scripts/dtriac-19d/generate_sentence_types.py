@@ -8,8 +8,9 @@ following characteristics:
 - minimum number of charaters is 20
 - minimum ratio of known words is 0.55
 
-Uses NLTK's words list, tokenizer and lemmatizer. Initializing those takes some
-time while processing the first file (about 3-5 seconds on a 2015 3.2GHz iMac).
+Uses NLTK's words list, tokenizer and lemmatizer. These are loaded from the
+resources registry when the first sentence is classified, initializing them
+takes some time (about 3-5 seconds on a 2015 3.2GHz iMac).
 
 Usage:
 
@@ -26,12 +27,9 @@ sents-bad.txt for inspection.
 
 import os, sys, codecs
 
-from nltk.corpus import words
-from nltk import word_tokenize
-from nltk.stem import WordNetLemmatizer
-
 from lif import Container, LIF, View
-from utils import get_options, process_list, ensure_directory
+from utils import get_options, process_list, read_lif, write_lif, LazyFile
+import resources
 
 
 DEBUG = False
@@ -42,28 +40,17 @@ MINIMUM_NUMBER_OF_CHARACTERS = 20
 MINIMUM_RATIO_OF_KNOWN_WORDS = 0.55
 
 
-LEMMATIZER = WordNetLemmatizer()
-WORDS = set(words.words())
-print("Loaded %s words\n" % len(WORDS))
-
-if DEBUG:
-    SENTS = codecs.open('sentences.txt', 'w', encoding='utf8')
+SENTS = LazyFile('sentences.txt')
 
 
 def generate_sentence_types(data_dir, fname):
 
-    subdir = os.path.split(fname)[0]
-    lif_file = os.path.join(data_dir, 'lif', subdir, "tesseract-300dpi-20p.lif")
-    spl_file = os.path.join(data_dir, 'spl', subdir, "%s.spl.lif" % subdir)
-    sen_file = os.path.join(data_dir, 'sen', subdir, "%s.sen.lif" % subdir)
-    ensure_directory(sen_file)
-
     if DEBUG:
         SENTS.write(">>> %s\n>>> %s\n>>> %s\n\n" % ('-' * 100, fname, '-' * 100))
 
-    lif = Container(lif_file).payload
-    lif_spl = Container(spl_file).payload
-    lif_sen = LIF(json_object=lif.as_json())
+    lif = read_lif(data_dir, fname, 'lif')
+    lif_spl = read_lif(data_dir, fname, 'spl')
+    lif_sen = lif.derive()
 
     spl_sentences_view = lif_spl.get_view('v2')
     new_sentences_view = _create_view()
@@ -74,7 +61,7 @@ def generate_sentence_types(data_dir, fname):
 
     for anno in spl_sentences_view.annotations:
         if anno.type.endswith('Sentence'):
-            sc = SentenceClassifier(lif, anno, WORDS)
+            sc = SentenceClassifier(lif, anno, resources.get('words'))
             if sc.is_crap():
                 if DEBUG:
                     SENTS.write("---- %f\n%s\n\n" % (sc.ratio, repr(sc.text)))
@@ -89,7 +76,7 @@ def generate_sentence_types(data_dir, fname):
     if DEBUG:
         SENTS.write("\nTOTAL GOOD = {:d}\nTOTAL BAD  = {:d}\n\n\n".format(good_sentences, bad_sentences))
 
-    lif_sen.write(fname=sen_file, pretty=True)
+    write_lif(data_dir, fname, 'sen', lif_sen)
 
 
 def _create_view():
@@ -109,9 +96,11 @@ class SentenceClassifier(object):
         self.words = words
         self.annotation = annotation
         self.text = lif.text.value[annotation.start:annotation.end]
-        self.tokens = [t.lower() for t in word_tokenize(self.text)]
+        tokenize = resources.get('tokenizer')
+        lemmatizer = resources.get('lemmatizer')
+        self.tokens = [t.lower() for t in tokenize(self.text)]
         self.length = len(self.tokens)
-        self.common = len([t for t in self.tokens if LEMMATIZER.lemmatize(t) in WORDS])
+        self.common = len([t for t in self.tokens if lemmatizer.lemmatize(t) in words])
         try:
             self.ratio = float(self.common) / self.length
         except ZeroDivisionError:
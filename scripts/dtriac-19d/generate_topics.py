@@ -5,11 +5,16 @@ Usage:
 $ python3 generate_topics.py -d DATA_DIR -f FILELIST
 $ python3 generate_topics.py -d DATA_DIR -f FILELIST -s START -e END
 $ python3 generate_topics.py -d DATA_DIR -f FILELIST --crash
+$ python3 generate_topics.py -d DATA_DIR -f FILELIST --bundle
+$ python3 generate_topics.py -d DATA_DIR -f FILELIST --max-size MB --max-memory MB
 $ python3 generate_topics.py --build -d DATA_DIR -f FILELIST -s START -e END
 $ python3 generate_topics.py (-h | --help)
 
-The topic model is written to topics/.
+The topic model is written to topics/. With --bundle the input and output are
+read from and written to the document bundles in DATA_DIR/bnd.
 
+Gensim and the NLTK resources are imported when they are first needed so that
+importing this module is cheap.
 
 """
 
@@ -20,14 +25,12 @@ import codecs
 import pickle
 import getopt
 
-import gensim
-
-import nltk
-from nltk import word_tokenize
-from nltk.corpus import wordnet as wn
-
 from lif import Container, LIF, View, Annotation
-from utils import elements, ensure_directory, time_elapsed, print_element
+from utils import elements, time_elapsed, print_element, read_lif, write_lif, docid
+import utils
+import metrics
+import profiling
+import resources
 
 
 TOPICS_DIR = "topics"
@@ -37,12 +40,11 @@ MODEL_FILE = os.path.join(TOPICS_DIR, 'model5.gensim')
 
 NUM_TOPICS = 100
 
-STOPWORDS = set(nltk.corpus.stopwords.words('english'))
-
 
 @time_elapsed
 def build_model(data_dir, filelist, start, end):
     """Build a model from scratch using the files as specified in the arguments."""
+    import gensim
     print("\nCollecting data")
     text_data = _collect_data(data_dir, filelist, start, end)
     print("\nLoading text data into dictionary")
@@ -65,8 +67,7 @@ def _collect_data(data_dir, filelist, start, end):
     words_to_ignore = {'title', 'abstract', 'result', 'study'}
     for n, fname in elements(filelist, start, end):
         print("%07d  %s" % (n, fname))
-        fpath = os.path.join(data_dir, 'lif', fname[:-4] + '.lif')
-        lif = Container(fpath).payload
+        lif = read_lif(data_dir, fname, 'lif')
         text_data = prepare_text_for_lda(lif.text.value)
         text_data = [w for w in text_data if w not in words_to_ignore]
         all_data.append(text_data)
@@ -85,10 +86,12 @@ def print_model(lda=None):
 
 
 def load_model():
+    import gensim
     return gensim.models.ldamodel.LdaModel.load(MODEL_FILE)
 
 
 def load_dictionary():
+    import gensim
     return gensim.corpora.Dictionary.load(DICTIONARY_FILE)
 
 
@@ -99,25 +102,30 @@ def generate_topics(data_dir, filelist, start, end, crash=False):
     topic_idx = {topic_id: topic for topic_id, topic
                  in lda.print_topics(num_topics=NUM_TOPICS)}
     dictionary = load_dictionary()
-    for n, fname in elements(filelist, start, end):
-        print_element(n, fname)
-        if crash:
-            generate_topics_for_file(data_dir, fname, lda, topic_idx, dictionary)
-        else:
+    utils.start_metrics()
+    utils.start_profiling()
+    try:
+        for n, fname in elements(filelist, start, end):
+            print_element(n, fname)
             try:
-                generate_topics_for_file(data_dir, fname, lda, topic_idx, dictionary)
+                with metrics.document('generate_topics', docid(fname)), \
+                     profiling.document('generate_topics'):
+                    utils.process_guarded(
+                        data_dir, fname,
+                        lambda d, f: generate_topics_for_file(d, f, lda, topic_idx, dictionary))
             except Exception as e:
+                if crash:
+                    raise
                 print('ERROR:', Exception, e)
                 sys.stderr.write("ERROR on %07d  %s\n" % (n, fname))
+    finally:
+        metrics.close_metrics()
 
 
 def generate_topics_for_file(data_dir, fname, lda, topic_idx, dictionary):
     topic_id = 0
-    fname_in = os.path.join(data_dir, 'lif', fname[:-4] + '.lif')
-    fname_out = os.path.join(data_dir, 'top', fname[:-4] + '.lif')
-    ensure_directory(fname_out)
-    lif_in = Container(fname_in).payload
-    lif_out = LIF(json_object=lif_in.as_json())
+    lif_in = read_lif(data_dir, fname, 'lif')
+    lif_out = lif_in.derive()
     # just to save some space, we get them from the lif file anyway
     lif_out.metadata = {}
     topics_view = _create_view()
@@ -132,13 +140,14 @@ def generate_topics_for_file(data_dir, fname, lda, topic_idx, dictionary):
         # print('   %3d  %.04f  %s' % (topic[0], topic[1], lemmas))
         topics_view.annotations.append(
             topic_annotation(topic, topic_id, lemmas))
-    lif_out.write(fname=fname_out, pretty=True)
+    write_lif(data_dir, fname, 'top', lif_out)
 
 
 def prepare_text_for_lda(text):
-    tokens = word_tokenize(text)
+    tokens = resources.get('tokenizer')(text)
+    stopwords = resources.get('stopwords')
     return [get_lemma(tok.lower()) for tok in tokens
-            if len(tok) > 4 and tok not in STOPWORDS]
+            if len(tok) > 4 and tok not in stopwords]
 
 
 def markable_annotation(lif_obj):
@@ -160,7 +169,7 @@ def topic_annotation(topic, topic_id, lemmas):
 
 
 def get_lemma(word):
-    lemma = wn.morphy(word)
+    lemma = resources.get('wordnet').morphy(word)
     return word if lemma is None else lemma
 
 
@@ -191,6 +200,10 @@ def usage():
           + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST"
           + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST -s START -e END"
           + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST --crash"
+          + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST --bundle"
+          + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST --metrics METRICS_FILE (--memory)"
+          + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST --max-size MB --max-memory MB"
+          + "\n    $ python3 generate_topics.py -d DATA_DIR -f FILELIST --profile DIR (--profile-every N)"
           + "\n    $ python3 generate_topics.py --build -d DATA_DIR -f FILELIST -s START -e END"
           + "\n    $ python3 generate_topics.py (-h | --help)\n")
 
@@ -200,7 +213,10 @@ if __name__ == '__main__':
     data_dir = '/DATA//sample-01000'
     filelist = 'files-random.txt'
 
-    options = dict(getopt.getopt(sys.argv[1:], 'd:f:s:e:bh', ['crash', 'help', 'build'])[0])
+    options = dict(getopt.getopt(sys.argv[1:], 'd:f:s:e:bh',
+                                 ['crash', 'help', 'build', 'bundle', 'metrics=',
+                                  'memory', 'max-size=', 'max-memory=',
+                                  'profile=', 'profile-every='])[0])
     data_dir = options.get('-d', data_dir)
     filelist = options.get('-f', filelist)
     start = int(options.get('-s', 1))
@@ -208,6 +224,13 @@ if __name__ == '__main__':
     crash = True if '--crash' in options else False
     help_wanted = True if '-h' in options or '--help' in options else False
     build = True if '-b' in options or '--build' in options else False
+    utils.OPTIONS['bundle'] = True if '--bundle' in options else False
+    utils.OPTIONS['metrics'] = options.get('--metrics')
+    utils.OPTIONS['memory'] = True if '--memory' in options else False
+    utils.OPTIONS['max_size'] = int(options['--max-size']) if '--max-size' in options else None
+    utils.OPTIONS['max_memory'] = int(options['--max-memory']) if '--max-memory' in options else None
+    utils.OPTIONS['profile'] = options.get('--profile')
+    utils.OPTIONS['profile_every'] = int(options.get('--profile-every', 1))
 
     if help_wanted:
         usage()
@@ -0,0 +1,232 @@
+"""geocoding.py
+
+Rate-limited geocoding with a persistent cache, used by locations.py.
+
+Every lookup is written to an SQLite cache (GeocodingCache) as soon as it is
+done, so an interrupted run loses at most the lookups in flight and a rerun
+skips all names that are already in the cache. Lookups are done by a few
+asyncio workers that share a token bucket (TokenBucket) which enforces the
+request rate of the usage policy of the geocoder, for Nominatim that is one
+request per second. Failed requests, for example because of throttling or time
+outs, are retried with exponential backoff and are not cached if they keep
+failing, so they are tried again on the next run. Names that the geocoder does
+not know are cached with None as the result.
+
+Geocoders are objects with a geocode(name) method that returns the raw result
+or None and that raises an exception if the request failed. NominatimGeocoder
+uses geopy and FakeGeocoder is a local stand-in for testing:
+
+>>> cache = GeocodingCache('/tmp/geocoding.db')
+>>> geocode_all(['Paris', 'Bali'], FakeGeocoder(failure_rate=0.2), cache, rate=20)
+>>> cache.get('Paris')
+
+"""
+
+import sys
+import time
+import json
+import random
+import sqlite3
+import asyncio
+import hashlib
+
+
+GEOCODING_CACHE = 'data/locations/geocoding.db'
+
+# Default request rate in requests per second and number of requests in flight,
+# these are the limits set by the Nominatim usage policy.
+RATE = 1.0
+CONCURRENCY = 1
+
+# Retrying failed requests, the delay in seconds starts at BACKOFF and doubles
+# after each attempt, with some jitter.
+MAX_ATTEMPTS = 5
+BACKOFF = 2.0
+MAX_BACKOFF = 60.0
+
+
+class GeocodingCache(object):
+
+    """Persistent cache of geocoding results, stored in SQLite and committed
+    after each addition."""
+
+    def __init__(self, fname=GEOCODING_CACHE):
+        self.fname = fname
+        self.db = sqlite3.connect(fname)
+        self.db.execute("CREATE TABLE IF NOT EXISTS locations (name TEXT PRIMARY KEY,"
+                        " source TEXT, result TEXT, time REAL)")
+        self.db.commit()
+
+    def __str__(self):
+        return "<GeocodingCache %s with %d names>" % (self.fname, len(self))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM locations").fetchone()[0]
+
+    def __contains__(self, name):
+        return self.db.execute("SELECT 1 FROM locations WHERE name = ?",
+                               (name,)).fetchone() is not None
+
+    def get(self, name):
+        row = self.db.execute("SELECT result FROM locations WHERE name = ?",
+                              (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def add(self, name, result, source):
+        self.db.execute("INSERT OR REPLACE INTO locations VALUES (?,?,?,?)",
+                        (name, source, json.dumps(result), time.time()))
+        self.db.commit()
+
+    def add_all(self, results, source):
+        """Add a dictionary of results in one transaction."""
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO locations VALUES (?,?,?,?)",
+                            [(name, source, json.dumps(result), now)
+                             for name, result in results.items()])
+        self.db.commit()
+
+    def missing(self, names):
+        """Return the names that are not in the cache, in their original order."""
+        cached = set(row[0] for row in self.db.execute("SELECT name FROM locations"))
+        return [name for name in names if name not in cached]
+
+    def results(self, names):
+        """Return a dictionary with the cached results for those names that are in
+        the cache."""
+        results = {}
+        for name in names:
+            row = self.db.execute("SELECT result FROM locations WHERE name = ?",
+                                  (name,)).fetchone()
+            if row is not None:
+                results[name] = json.loads(row[0])
+        return results
+
+
+class TokenBucket(object):
+
+    """Token bucket for rate limiting, with rate tokens added per second up to a
+    maximum of capacity tokens. The bucket starts with one token so the first
+    request does not wait, but there is no initial burst."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = 1.0
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    async def acquire(self):
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class NominatimGeocoder(object):
+
+    def __init__(self, user_agent='cache_locations.py', timeout=10):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=user_agent, timeout=timeout)
+
+    def geocode(self, name):
+        location = self.geolocator.geocode(name)
+        return None if location is None else location.raw
+
+
+class FakeGeocoderError(Exception):
+    pass
+
+
+class FakeGeocoder(object):
+
+    """Geocoder that does not go out on the network. Returns results in the form
+    of Nominatim results with coordinates computed from the name, names in
+    unknown are not found, and requests fail with probability failure_rate after
+    waiting latency seconds. The times of all requests are kept in calls."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, unknown=(), seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.unknown = set(unknown)
+        self.random = random.Random(seed)
+        self.calls = []
+
+    def geocode(self, name):
+        self.calls.append(time.time())
+        time.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise FakeGeocoderError("simulated failure for %s" % name)
+        if name in self.unknown:
+            return None
+        digest = int(hashlib.md5(name.encode('utf8')).hexdigest(), 16)
+        lat = "%.7f" % ((digest % 1800000) / 10000.0 - 90)
+        lon = "%.7f" % ((digest // 1800000 % 3600000) / 10000.0 - 180)
+        return {'display_name': "%s, Fakeland" % name, 'lat': lat, 'lon': lon,
+                'boundingbox': [lat, lat, lon, lon]}
+
+
+def geocode_all(names, geocoder, cache, rate=RATE, concurrency=CONCURRENCY,
+                source='nom', log=sys.stdout):
+    """Geocode all names that are not in the cache and add them to the cache.
+    Returns a pair of the number of names added and the number of names that
+    failed."""
+    names = cache.missing(names)
+    if not names:
+        return 0, 0
+    return asyncio.run(
+        _geocode_all(names, geocoder, cache, rate, concurrency, source, log))
+
+
+async def _geocode_all(names, geocoder, cache, rate, concurrency, source, log):
+    queue = asyncio.Queue()
+    for name in names:
+        queue.put_nowait(name)
+    bucket = TokenBucket(rate)
+    counts = {'added': 0, 'failed': 0}
+    workers = [_worker(queue, geocoder, cache, bucket, source, counts, log)
+               for _ in range(max(1, concurrency))]
+    await asyncio.gather(*workers)
+    return counts['added'], counts['failed']
+
+
+async def _worker(queue, geocoder, cache, bucket, source, counts, log):
+    loop = asyncio.get_event_loop()
+    while not queue.empty():
+        name = queue.get_nowait()
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await bucket.acquire()
+            try:
+                result = await loop.run_in_executor(None, geocoder.geocode, name)
+            except Exception as e:
+                delay = _backoff(attempt, e)
+                log.write("WARNING: %s on '%s' (attempt %d), %s\n"
+                          % (e.__class__.__name__, name, attempt,
+                             'giving up' if attempt == MAX_ATTEMPTS
+                             else 'retrying in %.1fs' % delay))
+                if attempt < MAX_ATTEMPTS:
+                    await asyncio.sleep(delay)
+                continue
+            cache.add(name, result, source)
+            counts['added'] += 1
+            log.write("%05d  %s  %s  %s\n" % (counts['added'], source,
+                                              '-' if result is None else '+', name))
+            break
+        else:
+            counts['failed'] += 1
+
+
+def _backoff(attempt, exception):
+    """Return the delay before the next attempt, which is the value of the
+    Retry-After header if the geocoder was throttled and gave one."""
+    retry_after = getattr(exception, 'retry_after', None)
+    if retry_after:
+        return float(retry_after)
+    delay = min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1))
+    return delay * (0.5 + random.random() / 2)
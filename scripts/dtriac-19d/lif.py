@@ -19,6 +19,52 @@ To read and write a LIF object:
 >>> lif = LIF(infile)
 >>> lif.write(outfile, pretty=True)
 
+To write a Container with a LIF object without first building it in memory use
+the LIFWriter:
+
+>>> writer = LIFWriter(fh)
+>>> writer.write_text(text)
+>>> writer.write_view(view)
+>>> writer.close()
+
+LIF files can be compressed. When reading, gzip and zstd compression are
+detected from the first bytes of the file, so file names do not need to change.
+When writing, files with a .gz or .zst extension are compressed with gzip or
+zstd and other files with the codec set by set_compression() or by the
+LIF_COMPRESSION environment variable, for example
+
+$ export LIF_COMPRESSION=gzip:6
+
+where the number is the compression level. By default files are not compressed.
+Use open_lif_file() to get a file handle that honors the same settings. Zstd
+requires the zstandard package.
+
+LIF objects created from another LIF object often have the same text. Instead
+of repeating it, the text can refer to the file it was taken from:
+
+>>> lif.text.refer_to(base_file)
+>>> lif.write(outfile)
+
+The written text has no value, but a file name, relative to the directory of
+outfile, and a SHA1 hash of the text. When outfile is read the text value is
+taken from the referenced file when it is first needed. Texts that were read are
+cached in TEXT_CACHE. Reading a referenced file is counted as parse time and its
+size as bytes in of the current document, see metrics.py.
+
+All processing results for a document can also be stored in one zip archive, a
+Bundle, which holds the text only once and the LIF object created by each
+processing stage minus the text:
+
+>>> bundle = Bundle(zipfile)
+>>> bundle.add('ner', lif)
+>>> view = bundle.get_view('ner', 1)
+>>> lif = bundle.get_lif('ner')
+
+To read only the start of a document use read_window(), which stops reading the
+file after the annotations that end beyond an offset:
+
+>>> lif = read_window(infile, 10000, [1])
+
 Normaly there would be some manipulation of the LIF object between reading and
 writing, most typically by adding views.
 
@@ -32,22 +78,170 @@ Example input files are in ../data/in/lif.
 """
 
 import os
+import io
+import re
 import sys
+import gzip
+import zipfile
+import hashlib
 import codecs
+import copy
 import json
+import tempfile
 import subprocess
+from collections import OrderedDict
+from contextlib import contextmanager
 
 from past.builtins import xrange
 
+import metrics
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, bundles are then written without a lock
+    fcntl = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# compression codec (None, 'gzip' or 'zstd') and level used when writing files
+COMPRESSION = None
+COMPRESSION_LEVEL = None
+
+
+def set_compression(codec, level=None):
+    """Set the codec and level used for writing files that do not have a .gz or
+    .zst extension. Use None or 'none' for the codec to switch off compression
+    and None for the level to use the default level of the codec."""
+    global COMPRESSION, COMPRESSION_LEVEL
+    codec = None if codec in (None, 'none') else codec
+    if codec not in (None, 'gzip', 'zstd'):
+        raise ValueError("unknown compression codec: %s" % codec)
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+    COMPRESSION = codec
+    COMPRESSION_LEVEL = None if level is None else int(level)
+
+
+def _write_codec(fname):
+    codec = EXTENSIONS.get(os.path.splitext(fname)[1])
+    if codec is not None:
+        return codec, DEFAULT_LEVELS[codec]
+    if COMPRESSION is not None:
+        level = COMPRESSION_LEVEL
+        return COMPRESSION, DEFAULT_LEVELS[COMPRESSION] if level is None else level
+    return None, None
+
+
+def _read_codec(fname):
+    with open(fname, 'rb') as fh:
+        magic = fh.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return EXTENSIONS.get(os.path.splitext(fname)[1])
+
+
+def _open_binary(fname, mode):
+    """Open a file in binary mode ('rb' or 'wb') with the codec determined by the
+    extension, the magic number or the compression settings."""
+    if mode == 'rb':
+        codec, level = _read_codec(fname), None
+    else:
+        codec, level = _write_codec(fname)
+    if codec == 'gzip':
+        if mode == 'rb':
+            return gzip.GzipFile(fname, mode)
+        return gzip.GzipFile(fname, mode, compresslevel=level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("reading %s requires the zstandard package" % fname)
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(open(fname, 'rb'))
+        return zstandard.ZstdCompressor(level=level).stream_writer(open(fname, 'wb'))
+    return io.open(fname, mode)
+
+
+def open_lif_file(fname, mode='r'):
+    """Return a file handle for reading ('r') or writing ('w') unicode text to a
+    possibly compressed file."""
+    if mode == 'r':
+        return codecs.getreader('utf8')(_open_binary(fname, 'rb'))
+    return codecs.getwriter('utf8')(_open_binary(fname, 'wb'))
+
+
+def read_file(fname):
+    """Return the contents of a possibly compressed file as a unicode string."""
+    with _open_binary(fname, 'rb') as fh:
+        return fh.read().decode('utf8')
+
+
+def write_file(fname, text):
+    """Write a unicode string to a file, compressing it if needed."""
+    with _open_binary(fname, 'wb') as fh:
+        fh.write(text.encode('utf8'))
+
+
+if os.environ.get('LIF_COMPRESSION'):
+    set_compression(*os.environ['LIF_COMPRESSION'].split(':'))
+
+
+# Texts read from referenced files, indexed on file name and hash. The size is
+# small since the referencing files of a document are usually read together.
+TEXT_CACHE = OrderedDict()
+TEXT_CACHE_SIZE = 16
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def load_text(fname):
+    """Return the text value from a file with a LIF object or a Container, it is
+    cached in the same way as the text of references."""
+    return _load_text(fname, None)
+
+
+def _load_text(fname, sha1):
+    """Return the text value from a file with a LIF object or a Container. The
+    referenced file can itself refer to another file."""
+    key = (os.path.abspath(fname), sha1)
+    if key in TEXT_CACHE:
+        TEXT_CACHE[key] = TEXT_CACHE.pop(key)
+        return TEXT_CACHE[key]
+    with metrics.phase('parse'):
+        metrics.count('bytes_in', metrics.file_size(fname))
+        json_obj = json.loads(read_file(fname))
+        json_obj = json_obj.get('payload', json_obj)
+        text = Text(json_obj['text'], os.path.dirname(fname)).value
+    if sha1 is not None and text_hash(text) != sha1:
+        raise ValueError("text in %s does not match hash %s" % (fname, sha1))
+    TEXT_CACHE[key] = text
+    if len(TEXT_CACHE) > TEXT_CACHE_SIZE:
+        TEXT_CACHE.popitem(last=False)
+    return text
+
 
 class LappsObject(object):
 
     def __init__(self, json_file, json_string, json_object):
         self.json_file = json_file
-        self.json_file = json_string
+        self.json_string = json_string
         self.json_object = json_object
         if json_file is not None:
-            self.json_string = codecs.open(json_file).read()
+            self.json_string = read_file(json_file)
             self.json_object = json.loads(self.json_string)
         elif json_string is not None:
             self.json_string = json_string
@@ -57,14 +251,20 @@ class LappsObject(object):
             self.json_object = json_object
 
     def write(self, fname=None, pretty=False):
-        # first update the json object for those case where it has been changed
-        json_obj = self.as_json()
+        # first update the json object for those case where it has been changed,
+        # text references are relative to the directory of the output file
+        json_obj = self.as_json(os.path.dirname(fname) if fname else None)
         if pretty:
             s = json.dumps(json_obj, sort_keys=True, indent=4, separators=(',', ': '))
         else:
             s = json.dumps(json_obj)
-        fh = sys.stdout if fname is None else codecs.open(fname, 'w')
-        fh.write(s + "\n")
+        if fname is None:
+            sys.stdout.write(s + "\n")
+        else:
+            write_file(fname, s + "\n")
+
+    def as_json_string(self):
+        return json.dumps(self.as_json(), sort_keys=True, indent=4, separators=(',', ': '))
 
 
 class Container(LappsObject):
@@ -76,28 +276,33 @@ class Container(LappsObject):
         self.parameters = {}
         if self.json_object is not None:
             self.discriminator = self.json_object['discriminator']
-            self.payload = LIF(json_object=self.json_object['payload'])
+            self.payload = LIF(json_object=self.json_object['payload'],
+                               base_dir=_base_dir(json_file))
             # print self.payload.metadata['authors']
             # print self.json_object['payload'].keys()
             self.parameters = self.json_object.get('parameters', {})
 
-    def as_json(self):
+    def as_json(self, base_dir=None):
         return {"discriminator": self.discriminator,
                 "parameters": self.parameters,
-                "payload": self.payload.as_json()}
+                "payload": self.payload.as_json(base_dir)}
 
 
 class LIF(LappsObject):
 
-    def __init__(self, json_file=None, json_string=None, json_object=None):
+    def __init__(self, json_file=None, json_string=None, json_object=None, base_dir=None):
+        """The base_dir is the directory that a text reference is relative to, it
+        defaults to the directory of json_file."""
         LappsObject.__init__(self, json_file, json_string, json_object)
         self.context = "http://vocab.lappsgrid.org/context-1.0.0.jsonld"
         self.metadata = {}
         self.text = Text()
         self.views = []
+        if json_file is not None:
+            base_dir = _base_dir(json_file)
         if self.json_object is not None:
             self.metadata = self.json_object['metadata']
-            self.text = Text(self.json_object['text'])
+            self.text = Text(self.json_object['text'], base_dir)
             for v in self.json_object['views']:
                 self.views.append(View(v))
 
@@ -111,16 +316,24 @@ class LIF(LappsObject):
                 return view
         return None
 
-    def as_json(self):
+    def derive(self):
+        """Return a new LIF object with the text and metadata of this one and no
+        views. The metadata dictionary is shared and the text is a shallow copy,
+        so this is much cheaper than LIF(json_object=lif.as_json()), which
+        creates all views and annotations again."""
+        lif = LIF()
+        lif.context = self.context
+        lif.metadata = self.metadata
+        lif.text = copy.copy(self.text)
+        return lif
+
+    def as_json(self, base_dir=None):
         d = {"@context": self.context,
              "metadata": self.metadata,
-             "text": self.text.as_json(),
+             "text": self.text.as_json(base_dir),
              "views": [v.as_json() for v in self.views]}
         return d
 
-    def as_json_string(self):
-        return json.dumps(self.as_json(), sort_keys=True, indent=4, separators=(',', ': '))
-
     def add_tarsqi_view(self, tarsqidoc):
         view = View()
         view.id = self._get_new_view_id()
@@ -153,6 +366,10 @@ class LIF(LappsObject):
                 return "v{}".format(i)
 
 
+def _base_dir(json_file):
+    return None if json_file is None else os.path.dirname(json_file)
+
+
 def _get_id(tag):
     identifier = tag.get_identifier()
     if identifier is not None:
@@ -175,19 +392,55 @@ def _get_type(tag):
 
 class Text(object):
 
-    def __init__(self, json_obj=None):
+    """The text of a LIF object. If fname is set the text is a reference to the
+    text in that file, with sha1 as the hash of the text, and the value is read
+    from the file when it is first used. In memory fname is relative to the
+    current directory (or absolute), in the JSON it is relative to the file that
+    contains the JSON, base_dir is the directory of that file."""
+
+    def __init__(self, json_obj=None, base_dir=None):
         self.language = 'en'
-        self.value = ''
+        self._value = ''
         self.fname = None
+        self.sha1 = None
         if json_obj is not None:
             self.language = json_obj.get('language')
-            self.value = json_obj.get('@value')
+            self._value = json_obj.get('@value')
+            self.fname = json_obj.get('fname')
+            self.sha1 = json_obj.get('sha1')
+            if self.fname is not None and base_dir:
+                self.fname = os.path.normpath(os.path.join(base_dir, self.fname))
 
     def __str__(self):
         return "<Text lang={} length={:d}>".format(self.language, len(self.value))
 
-    def as_json(self):
-        d = {"@value": self.value, "fname": self.fname}
+    @property
+    def value(self):
+        if self._value is None and self.fname is not None:
+            self._value = _load_text(self.fname, self.sha1)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+
+    def is_reference(self):
+        return self.fname is not None
+
+    def refer_to(self, fname):
+        """Make the text a reference to the text in fname, which should be the same
+        as the current value."""
+        self.sha1 = text_hash(self.value)
+        self.fname = fname
+
+    def as_json(self, base_dir=None):
+        if self.fname is None:
+            d = {"@value": self.value}
+        else:
+            fname = self.fname
+            if base_dir is not None:
+                fname = os.path.relpath(fname, base_dir or os.curdir)
+            d = {"@value": None, "fname": fname, "sha1": self.sha1}
         if self.language is not None:
             d["language"] = self.language
         return d
@@ -251,6 +504,371 @@ class Annotation(object):
         return d
 
 
+# Size of the pieces that the windowed reader reads from a file.
+WINDOW_CHUNK_SIZE = 65536
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+ANNOTATIONS_KEY = re.compile(r'"annotations"[ \t\n\r]*:')
+
+
+def read_window(fname, end, ranks):
+    """Return a LIF object with the text and the metadata of the LIF object or
+    Container in fname and with the views at the given ranks, but only with the
+    annotations up to and including the first annotation that ends after offset
+    end. This assumes that annotations are ordered on their offsets. Views that
+    are not needed and annotations after the window are skipped by searching for
+    the next annotations key, which is much faster than decoding them, and
+    reading stops after the window of the last view needed. The views only have
+    annotations, because the id of a view is often written after them, and they
+    are in the order of their ranks. If the text is written after the views the
+    whole file is read and the views are not cut off."""
+    lif = LIF()
+    lif.text = None
+    with open_lif_file(fname) as fh:
+        stream = _JSONStream(fh)
+        try:
+            _read_window(stream, lif, end, sorted(ranks), _base_dir(fname))
+        except _EndOfWindow:
+            pass
+    if lif.text is None:
+        json_obj = json.loads(read_file(fname))
+        lif = LIF(json_object=json_obj.get('payload', json_obj), base_dir=_base_dir(fname))
+        lif.views = [lif.views[rank] for rank in sorted(ranks)]
+    return lif
+
+
+class _EndOfWindow(Exception):
+    pass
+
+
+def _read_window(stream, lif, end, ranks, base_dir):
+    for key in stream.members():
+        if key == 'payload':
+            _read_window(stream, lif, end, ranks, base_dir)
+        elif key == 'metadata':
+            lif.metadata = stream.value()
+        elif key == 'text':
+            lif.text = Text(stream.value(), base_dir)
+        elif key == 'views':
+            # this assumes that there is one annotations key in each view and
+            # that there are no other annotations keys
+            rank = -1
+            for next_rank in ranks:
+                stream.skip(ANNOTATIONS_KEY, next_rank - rank)
+                rank = next_rank
+                lif.views.append(View())
+                _read_annotations(stream, lif.views[-1], end)
+            raise _EndOfWindow()
+        else:
+            stream.value()
+
+
+def _read_annotations(stream, view, end):
+    for _ in stream.elements():
+        annotation = Annotation(stream.value())
+        view.annotations.append(annotation)
+        if annotation.end is not None and annotation.end > end:
+            return
+
+
+class _JSONStream(object):
+
+    """Reads JSON from a file handle in pieces. Values are decoded with the json
+    module, but objects and arrays can also be walked member by member and
+    element by element, which makes it possible to stop reading halfway."""
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.buffer = u''
+        self.position = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self, size=WINDOW_CHUNK_SIZE):
+        data = self.fh.read(size)
+        if data:
+            self.buffer = self.buffer[self.position:] + data
+            self.position = 0
+        else:
+            self.eof = True
+
+    def _peek(self):
+        """Skip white space and return the next character."""
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if self.eof:
+                raise ValueError("unexpected end of JSON input")
+            self._read()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError("expected '%s' at character %d of the buffer"
+                             % (char, self.position))
+        self.position += 1
+
+    def value(self):
+        """Decode the next value. If the buffer has only part of the value then
+        more is read, as much as is in the buffer already, so that large values
+        are not decoded over and over again."""
+        self._peek()
+        while True:
+            try:
+                value, position = self.decoder.raw_decode(self.buffer, self.position)
+                # a number at the end of the buffer may continue in the file
+                if position < len(self.buffer) or self.eof:
+                    self.position = position
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._read(max(WINDOW_CHUNK_SIZE, len(self.buffer)))
+
+    def skip(self, pattern, count=1):
+        """Skip past the count-th match of a regular expression, without decoding
+        anything. The buffer keeps the last WINDOW_CHUNK_SIZE characters, so that
+        matches that straddle two reads are found."""
+        while count > 0:
+            match = pattern.search(self.buffer, self.position)
+            if match is not None:
+                self.position = match.end()
+                count -= 1
+                continue
+            if self.eof:
+                raise ValueError("no match for %s" % pattern.pattern)
+            self.position = max(self.position, len(self.buffer) - WINDOW_CHUNK_SIZE)
+            self._read()
+
+    def members(self):
+        """Walk an object and generate its keys, after each key the caller has to
+        read the value with value(), members() or elements()."""
+        self._expect('{')
+        if self._peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(':')
+            yield key
+            if self._peek() == ',':
+                self.position += 1
+            else:
+                self._expect('}')
+                return
+
+    def elements(self):
+        """Walk an array and generate the index of each element, the caller has to
+        read each element."""
+        self._expect('[')
+        if self._peek() == ']':
+            self.position += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            if self._peek() == ',':
+                self.position += 1
+            else:
+                self._expect(']')
+                return
+
+
+class LIFWriter(object):
+
+    """Writes a LIF object, by default embedded in a Container, to an open file
+    handle as the annotations come in. First all the text is written, in as
+    many pieces as needed, and then the views, either as complete views or
+    annotation by annotation with begin_view(), write_annotation() (or
+    write_annotations() for a batch) and end_view(). The output is compact
+    JSON. The offset attribute keeps track of how many characters of text were
+    written so far."""
+
+    DISCRIMINATOR = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
+    CONTEXT = "http://vocab.lappsgrid.org/context-1.0.0.jsonld"
+
+    def __init__(self, fh, metadata=None, language='en', container=True):
+        self.fh = fh
+        self.container = container
+        self.offset = 0
+        self.in_text = True
+        self.views_written = 0
+        self.annotations_written = 0
+        if container:
+            fh.write('{"discriminator": %s, "parameters": {}, "payload": '
+                     % json.dumps(self.DISCRIMINATOR))
+        fh.write('{"@context": %s, "metadata": %s, "text": {"language": %s, "@value": "'
+                 % (json.dumps(self.CONTEXT), json.dumps(metadata or {}),
+                    json.dumps(language)))
+
+    def write_text(self, text):
+        if not self.in_text:
+            raise Exception("LIFWriter: cannot add text after the views")
+        # strip the quotes of the JSON string
+        self.fh.write(json.dumps(text)[1:-1])
+        self.offset += len(text)
+
+    def write_view(self, view):
+        self.begin_view(view.id, view.metadata)
+        for annotation in view.annotations:
+            self.write_annotation(annotation)
+        self.end_view()
+
+    def begin_view(self, identifier, metadata):
+        self._end_text()
+        if self.views_written:
+            self.fh.write(', ')
+        self.fh.write('{"id": %s, "metadata": %s, "annotations": ['
+                      % (json.dumps(identifier), json.dumps(metadata)))
+        self.annotations_written = 0
+
+    def write_annotation(self, annotation):
+        """Write an annotation to the current view, annotation is an instance of
+        Annotation or a dictionary."""
+        if isinstance(annotation, Annotation):
+            annotation = annotation.as_json()
+        if self.annotations_written:
+            self.fh.write(', ')
+        self.fh.write(json.dumps(annotation))
+        self.annotations_written += 1
+
+    def write_annotations(self, annotations):
+        """Write a list of annotations to the current view, encoding them in one
+        go, which is faster than writing them one by one."""
+        annotations = [a.as_json() if isinstance(a, Annotation) else a for a in annotations]
+        if not annotations:
+            return
+        if self.annotations_written:
+            self.fh.write(', ')
+        # strip the brackets of the JSON list
+        self.fh.write(json.dumps(annotations)[1:-1])
+        self.annotations_written += len(annotations)
+
+    def end_view(self):
+        self.fh.write(']}')
+        self.views_written += 1
+
+    def close(self):
+        self._end_text()
+        self.fh.write(']}}\n' if self.container else ']}\n')
+
+    def _end_text(self):
+        if self.in_text:
+            self.fh.write('"}, "views": [')
+            self.in_text = False
+
+
+class Bundle(object):
+
+    """A zip archive with the results of all processing stages for a document.
+    The text is stored once, in a member named text.txt, and the LIF object of
+    each stage, with the text value set to None, is stored in a member named
+    after the stage (for example ner.lif). Containers are stored as the LIF
+    object they contain. Each stage can be read without reading any of the
+    others.
+
+    Adding a stage writes a new archive to a temporary file in the same
+    directory, which is then renamed over the old one, so a crash while adding
+    never damages the stages already in the bundle and readers always see a
+    complete archive. Writers take an exclusive lock on FNAME.lock, so stages
+    that add to the bundle of the same document at the same time do not lose
+    each other's output."""
+
+    TEXT = 'text.txt'
+
+    def __init__(self, fname):
+        self.fname = fname
+
+    def __str__(self):
+        return "<Bundle %s stages=%s>" % (self.fname, ':'.join(self.stages()))
+
+    def exists(self):
+        return os.path.exists(self.fname)
+
+    def stages(self):
+        if not self.exists():
+            return []
+        with zipfile.ZipFile(self.fname) as zf:
+            return [n[:-4] for n in zf.namelist() if n.endswith('.lif')]
+
+    def has_stage(self, stage):
+        return stage in self.stages()
+
+    def add(self, stage, lapps_object):
+        """Add the LIF object of a stage, the text is added if the bundle does not
+        have it yet."""
+        lif = lapps_object.payload if isinstance(lapps_object, Container) else lapps_object
+        json_obj = lif.as_json()
+        json_obj['text'] = {'@value': None, 'language': lif.text.language}
+        members = [(stage + '.lif', json.dumps(json_obj).encode('utf8'))]
+        if lif.text.value is not None:
+            members.append((self.TEXT, lif.text.value.encode('utf8')))
+        with self._lock():
+            self._write(members)
+
+    def add_file(self, stage, fname):
+        """Add a stage from a file with a LIF object or a Container."""
+        json_obj = json.loads(read_file(fname))
+        if 'payload' in json_obj:
+            json_obj = json_obj['payload']
+        self.add(stage, LIF(json_object=json_obj))
+
+    def get_text(self):
+        with zipfile.ZipFile(self.fname) as zf:
+            return zf.read(self.TEXT).decode('utf8')
+
+    def get_lif(self, stage, with_text=True):
+        with zipfile.ZipFile(self.fname) as zf:
+            lif = LIF(json_string=zf.read(stage + '.lif').decode('utf8'))
+        if with_text:
+            lif.text.value = self.get_text()
+        return lif
+
+    def get_view(self, stage, view_rank):
+        """Return a view of a stage, selected by its index in the view list."""
+        return self.get_lif(stage, with_text=False).views[view_rank]
+
+    @contextmanager
+    def _lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.fname + '.lock', 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _write(self, members):
+        """Write the archive again with the members, a list of pairs of a name
+        and bytes. The first member replaces the member with the same name, the
+        others are only added if the archive does not have them yet."""
+        directory = os.path.dirname(self.fname) or '.'
+        fd, tmp_file = tempfile.mkstemp(dir=directory, suffix='.tmp',
+                                        prefix=os.path.basename(self.fname) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf_out:
+                    names = set()
+                    if self.exists():
+                        with zipfile.ZipFile(self.fname) as zf_in:
+                            for item in zf_in.infolist():
+                                if item.filename != members[0][0]:
+                                    zf_out.writestr(item, zf_in.read(item.filename))
+                                    names.add(item.filename)
+                    for name, data in members:
+                        if name not in names:
+                            zf_out.writestr(name, data)
+            mode = os.stat(self.fname).st_mode if self.exists() else 0o644
+            os.chmod(tmp_file, mode & 0o777)
+            os.rename(tmp_file, self.fname)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+
 class IdentifierFactory(object):
 
     identifiers = {'docelement': 0, 's': 0, 'lex': 0, 'ng': 0, 'vg': 0}
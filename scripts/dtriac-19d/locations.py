@@ -8,6 +8,7 @@ Some utilities to manage locations.
 == Caching locations
 
 $ python3 locations.py --cache OUTPUT_FILE LIMIT
+$ python3 locations.py --cache OUTPUT_FILE LIMIT --gazetteer (--offline) (--min-count N)
 
 This looks up all locations that occur less or equal than MAX_COUNT times and
 more or equal than MIN_COUNT times. Use LIMIT when testing the script to avoid
@@ -21,6 +22,25 @@ forbids heavy use. Some nuggets from the policy:
 - Maximum of 1 request per second
 - Cache results locally (repeated queries are flagged)
 
+Results are first written to a persistent cache, one result at a time, and are
+copied to OUTPUT_FILE at the end. When the script is interrupted it can be run
+again and only the locations not yet in the cache are looked up. Requests are
+limited to the rate allowed by the usage policy, failed requests are retried
+with exponential backoff. See geocoding.py for details. Options:
+
+--db FILE          the cache, default is data/locations/geocoding.db
+--rate N           requests per second, default is 1
+--concurrency N    requests in flight, default is 1
+--fake             use a local fake geocoder instead of Nominatim, for testing,
+                   this requires --db so the fake results do not end up in
+                   the default cache
+
+With --gazetteer all locations are first looked up in bulk in the offline
+GeoNames gazetteer (see gazetteer.py) and only the locations that are not found
+there are looked up with Nominatim, with --offline Nominatim is not used at all.
+Since the gazetteer is fast --min-count can be used to also include the less
+frequent locations.
+
 Requires installation of geopy (https://geopy.readthedocs.io/en/stable/).
 
 >>> from geopy.geocoders import Nominatim
@@ -54,19 +74,28 @@ key:
 $ python3 locations.py --create CACHE_FILE INDEX_FILE
 
 Takes the file created in the --cache step and creates a much smaller version
-of it with just the data we need and saved as a pickle file.
+of it with just the data we need and saved as a pickle file. Also saves the
+locations that have coordinates in an SQLite database, with the name of the
+index file but with the .db extension instead of .pickle, which is what
+resources.Locations uses. The database can also be created from an existing
+pickle file:
+
+$ python3 locations.py --create-db INDEX_FILE DB_FILE
 
 """
 
+import os
 import sys
 import time
 import json
 import pickle
+import getopt
+import sqlite3
 
-from geopy.geocoders import Nominatim
-
-
-GEOLOCATOR = Nominatim(user_agent='cache_locations.py')
+from gazetteer import Gazetteer
+from geocoding import GeocodingCache, NominatimGeocoder, FakeGeocoder, geocode_all
+from geocoding import GEOCODING_CACHE, RATE, CONCURRENCY
+from resources import format_coordinates
 
 LOCATIONS_FILE = 'data/locations/locations.txt'
 
@@ -83,29 +112,37 @@ def get_locations():
         yield (count, location)
 
 
-def process_locations(outfile, limit):
+def process_locations(outfile, limit, gazetteer=None, offline=False,
+                      min_count=MIN_COUNT, cache_file=GEOCODING_CACHE,
+                      geocoder=None, rate=RATE, concurrency=CONCURRENCY):
+    """Look up locations and save the results in outfile. All results are first
+    added to the persistent cache in cache_file and locations already in the
+    cache are not looked up again. If a gazetteer is given then use it for all
+    locations and use the geocoder for those not found, unless offline is True.
+    The geocoder defaults to Nominatim."""
+    cache = GeocodingCache(cache_file)
+    selected = [location for count, location in get_locations()
+                if min_count <= count <= MAX_COUNT][:limit]
+    print("Selected %d locations, %d already in %s"
+          % (len(selected), len(selected) - len(cache.missing(selected)), cache_file))
+    if gazetteer is not None:
+        found = gazetteer.lookup_all(cache.missing(selected))
+        cache.add_all(dict((l, r) for l, r in found.items() if r is not None), 'gaz')
+        print("Found %d locations in %s" % (len([r for r in found.values() if r]), gazetteer))
+    if gazetteer is None or not offline:
+        geocoder = NominatimGeocoder() if geocoder is None else geocoder
+        added, failed = geocode_all(selected, geocoder, cache, rate, concurrency)
+        print("Geocoded %d locations, %d failed and will be retried on the next run"
+              % (added, failed))
     locations = {
         'time': time.time(),
         'producer': 'scripts/dtriac-19d/cache_locations.py',
         'maxcount': MAX_COUNT,
-        'mincount': MIN_COUNT,
+        'mincount': min_count,
         'limit': limit,
-        'locations': {}}
-    locations_processed = 0
-    for count, location in get_locations():
-        if MIN_COUNT <= count <= MAX_COUNT:
-            locations_processed += 1
-            if locations_processed > limit:
-                break
-            sys.stdout.write("%04d  %05d  %s\n" % (locations_processed, count, location))
-            try:
-                result = GEOLOCATOR.geocode(location)
-            except:
-                result = None
-            time.sleep(1)
-            if result is not None:
-                result = result.raw
-            locations['locations'][location] = result
+        'cache': cache_file,
+        'gazetteer': None if gazetteer is None else gazetteer.fname,
+        'locations': cache.results(selected)}
     json.dump(locations, open(outfile, 'w'), indent=4)
 
 
@@ -120,10 +157,12 @@ def build_locations_index(cached_locations_file, locations_index):
         if result is not None:
             # look up is quite liberal (for example, when you look up Bali you
             # may get Paris as the result) so require the found address to match
-            # the query in some form
+            # the query in some form, results from the gazetteer were already
+            # matched on the name or an alternate name
             address = result['display_name']
             address_parts = [p.strip() for p  in address.split(',')]
-            if location.lower() == address_parts[0].lower():
+            if (result.get('source') == 'geonames'
+                    or location.lower() == address_parts[0].lower()):
                 # print(location, '--', address)
                 locations_with_coordinates += 1
                 idx[location] = {
@@ -134,17 +173,55 @@ def build_locations_index(cached_locations_file, locations_index):
     print("Done building index containing non-null data for %d locations"
           % locations_with_coordinates)
     print("Index file: %s" % locations_index)
+    build_locations_db(locations_index, os.path.splitext(locations_index)[0] + '.db')
+
+
+def build_locations_db(locations_index, locations_db):
+    """Store the locations with coordinates from the pickled index in an SQLite
+    database, with the coordinates formatted as used in the index documents."""
+    idx = pickle.load(open(locations_index, 'rb'))
+    if os.path.exists(locations_db):
+        os.remove(locations_db)
+    db = sqlite3.connect(locations_db)
+    db.execute("CREATE TABLE locations (name TEXT PRIMARY KEY, coordinates TEXT,"
+               " lat TEXT, lon TEXT, box TEXT) WITHOUT ROWID")
+    db.executemany("INSERT INTO locations VALUES (?,?,?,?,?)",
+                   [(location, format_coordinates(result['lat'], result['lon']),
+                     result['lat'], result['lon'], json.dumps(result['box']))
+                    for location, result in sorted(idx.items()) if result is not None])
+    db.commit()
+    db.close()
+    print("Database file: %s" % locations_db)
 
 
 if __name__ == '__main__':
 
     mode = sys.argv[1]
     if mode == '--cache':
-        outfile = sys.argv[2]
-        limit = int(sys.argv[3])
-        process_locations(outfile, limit)
+        options, args = getopt.gnu_getopt(
+            sys.argv[2:], '', ['gazetteer', 'offline', 'min-count=', 'db=',
+                               'rate=', 'concurrency=', 'fake'])
+        options = dict(options)
+        outfile = args[0]
+        limit = int(args[1])
+        gazetteer = Gazetteer() if '--gazetteer' in options else None
+        offline = True if '--offline' in options else False
+        min_count = int(options.get('--min-count', MIN_COUNT))
+        if '--fake' in options and '--db' not in options:
+            sys.exit("ERROR: --fake requires --db, the fake results should not "
+                     "be written to %s" % GEOCODING_CACHE)
+        cache_file = options.get('--db', GEOCODING_CACHE)
+        geocoder = FakeGeocoder(latency=0.05, failure_rate=0.1) if '--fake' in options else None
+        rate = float(options.get('--rate', RATE))
+        concurrency = int(options.get('--concurrency', CONCURRENCY))
+        process_locations(outfile, limit, gazetteer, offline, min_count,
+                          cache_file, geocoder, rate, concurrency)
     elif mode == '--create':
         infile = sys.argv[2]
         outfile = sys.argv[3]
         build_locations_index(infile, outfile)
+    elif mode == '--create-db':
+        infile = sys.argv[2]
+        outfile = sys.argv[3]
+        build_locations_db(infile, outfile)
 
@@ -24,14 +24,22 @@ lines that are not technology terms. As of Jan 7th 2020 only the first 300 lines
 were annotated. The third file has all the wiki titles generated by the grounding
 component.
 
+The technologies, the technologies from the wiki titles and the mapping from
+plurals to singulars are compiled into a single mapping, see TechnologyOntology.
+With "python3 resources.py --build-tables" the mapping is written to the table
+in TECHNOLOGY_TABLE, which is then memory mapped instead of compiled again by
+each process.
+
 """
 
 import os
 import sys
 from collections import Counter
+from functools import lru_cache
 
 from lif import Container, LIF, View, Annotation
-from utils import get_options, process_list, ensure_directory, create_view
+from utils import get_options, process_list, read_lif, write_lif, create_view
+from sorted_table import SortedTable
 
 
 DEBUG = False
@@ -41,6 +49,7 @@ TECHNOLOGY_ANNOTATIONS = 'data/technologies/technologies-annotated.txt'
 TECHNOLOGY_HEADS = 'data/technologies/technologies-heads.txt'
 WIKI_TITLES = 'data/wiki/wiki-titles-uniq-nr.txt'
 WIKI_TITLES_ANNOTATIONS = 'data/wiki/wiki-titles-uniq-nr-anno.txt'
+TECHNOLOGY_TABLE = 'data/tables/technologies.tbl'
 
 TECHNOLOGIES = None
 
@@ -58,6 +67,9 @@ MIN_COUNT = 5
 # documents
 MIN_WIKI_TITLE_COUNT = 10
 
+# number of lookups cached by TechnologyOntology.lookup()
+LOOKUP_CACHE_SIZE = 65536
+
 
 if DEBUG:
     OUT = open('lists/list-technologies-found.txt', 'w')
@@ -135,37 +147,33 @@ def _technologies_from_wiki_terms_file():
 
 
 def lookup_technologies(data_dir, fname):
-    subdir = os.path.split(fname)[0]
-    pos_file = os.path.join(data_dir, 'pos', subdir, "%s.pos.lif" % subdir)
-    tex_file = os.path.join(data_dir, 'tex', subdir, "%s.lup.lif" % subdir)
-    ensure_directory(tex_file)
-    lif = Container(pos_file).payload
-    lif_tex = LIF(json_object=lif.as_json())
+    lif = read_lif(data_dir, fname, 'pos')
+    lif_tex = lif.derive()
     pos_view = lif.get_view('v2')
     tex_view = create_view('tex', 'Technology', 'dtriac-pipeline:lookup.py')
     lif_tex.views = [tex_view]
     tokens = [a for a in pos_view.annotations if a.type.endswith('Token')]
     _lookup_technologies_in_tokens(lif, tokens, tex_view)
-    lif_tex.write(fname=tex_file, pretty=True)
+    write_lif(data_dir, fname, 'tex', lif_tex)
 
 
 def _lookup_technologies_in_tokens(lif, tokens, tex_view):
+    """Add an annotation for each sequence of two to seven tokens that is a
+    technology. Sequences starting at a token are extended until they are not a
+    technology or the start of one."""
     TECHNOLOGIES.reset_next_id()
     for i in range(len(tokens)):
-        pairs = [(_get_text_from_tokens(tokens, i, i + j), j) for j in range(2,8)]
-        for w, length in pairs:
-            if w in TECHNOLOGIES.terms:
-                #if w in TECHNOLOGIES.word2lemma:
-                #    print(w)
-                term = TECHNOLOGIES.word2lemma.get(w, w)
-                anno = _create_annotation(lif, tokens, w, term, i, length, "technology")
-                tex_view.annotations.append(anno)
-            elif w in TECHNOLOGIES.wiki_terms:
-                #if w in TECHNOLOGIES.word2lemma:
-                #    print(w)
-                term = TECHNOLOGIES.word2lemma.get(w, w)
-                anno = _create_annotation(lif, tokens, w, term, i, length, "wiki_term")
+        for length in range(2, min(8, len(tokens) - i + 1)):
+            w = _get_text_from_tokens(tokens, i, i + length)
+            entry = TECHNOLOGIES.lookup(w)
+            if entry is None:
+                break
+            ttype, is_prefix, lemma = entry
+            if ttype:
+                anno = _create_annotation(lif, tokens, w, lemma or w, i, length, ttype)
                 tex_view.annotations.append(anno)
+            if not is_prefix:
+                break
 
 
 def _get_text_from_tokens(tokens, p1, p2):
@@ -195,11 +203,12 @@ def _get_match_information(lif, tokens, i, length):
 
 
 def longest_technology():
-    lengths = [len(t.split()) for t in TECHNOLOGIES.terms]
+    terms = [t for t in TECHNOLOGIES.entries.keys() if TECHNOLOGIES.lookup(t)[0]]
+    lengths = [len(t.split()) for t in terms]
     c = Counter(lengths)
     print(c)
     longest = 0
-    for t in TECHNOLOGIES.terms:
+    for t in terms:
         tokens = t.split()
         longest = max(longest, len(tokens))
     return longest
@@ -209,10 +218,21 @@ class TechnologyOntology(object):
 
     """TechnologyOntology is rather a big word for this since all this does at the
     moment is to keep a list of technologies and a stoplist of terms that are not
-    technologies."""
+    technologies.
+
+    The terms are compiled into entries, a mapping from strings to strings with
+    the type of the term ('technology', 'wiki_term' or empty), a plus sign if
+    the string is the start of a longer term, and the singular of the term if
+    it is a plural, separated by tabs. If table_file exists the entries are
+    read from that table instead and the term sets are not loaded."""
 
-    def __init__(self):
+    def __init__(self, table_file=TECHNOLOGY_TABLE):
         self.next_id = 0
+        self.lookup = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._lookup)
+        if table_file is not None and os.path.exists(table_file):
+            self.terms = self.stoplist = self.wiki_terms = self.word2lemma = None
+            self.entries = SortedTable(table_file)
+            return
         self.terms = set()
         self.stoplist = set()
         self.wiki_terms = _technologies_from_wiki_terms_file()
@@ -225,14 +245,49 @@ class TechnologyOntology(object):
             if not self.filter(term) and not term in self.stoplist:
                 self.terms.add(term)
         self.normalize()
+        self.entries = self.compile()
 
     def __len__(self):
-        return len(self.terms)
+        return len(self.entries)
 
     def __str__(self):
+        if self.terms is None:
+            return "<TechnologyOntology entries=%d from %s>" \
+                % (len(self.entries), self.entries.fname)
         return "<TechnologyOntology terms=%d wiki_terms=%d>" \
             % (len(self.terms), len(self.wiki_terms))
 
+    def compile(self):
+        """Return the entries for the terms. Terms are looked up before wiki
+        terms, so a string that is both is a technology."""
+        types = {}
+        for term in self.wiki_terms:
+            types[term] = 'wiki_term'
+        for term in self.terms:
+            types[term] = 'technology'
+        prefixes = set()
+        for term in types:
+            position = term.find(' ')
+            while position > -1:
+                prefixes.add(term[:position])
+                position = term.find(' ', position + 1)
+        entries = {}
+        for string in set(types) | prefixes:
+            entries[string] = "%s\t%s\t%s" % (types.get(string, ''),
+                                                '+' if string in prefixes else '',
+                                                self.word2lemma.get(string, ''))
+        return entries
+
+    def _lookup(self, string):
+        """Return a triple of the type, whether the string is the start of a
+        longer term and the singular, or None if the string is not in the
+        entries."""
+        entry = self.entries.get(string)
+        if entry is None:
+            return None
+        ttype, prefix, lemma = entry.split('\t')
+        return ttype, prefix == '+', lemma
+
     def get_next_id(self):
         self.next_id += 1
         return self.next_id
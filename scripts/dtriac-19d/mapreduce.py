@@ -0,0 +1,90 @@
+"""mapreduce.py
+
+Map-reduce over the files of a corpus with a pool of processes.
+
+>>> counts = map_reduce(count_words, fnames, processes=8)
+
+The mapper is applied to each item, typically a file name, in a worker process
+and returns a partial result. Workers take the items in chunks and merge the
+partial results of a chunk before sending them back, and those are merged in
+the main process, in the order of the items so that the result does not depend
+on the number of processes. By default partial results are merged with merge(),
+which adds numbers and Counters, extends lists, takes the union of sets and
+merges dictionaries recursively.
+
+Mappers and reducers have to be defined at the top level of a module so they
+can be pickled, use functools.partial to give them extra arguments. With one
+process everything runs in the main process, which is easier to debug.
+
+"""
+
+from collections import Counter
+from multiprocessing import Pool, cpu_count
+
+
+PROCESSES = cpu_count()
+
+# Number of items a worker handles before sending back its partial result.
+CHUNK_SIZE = 16
+
+
+def merge(result, partial):
+    """Merge a partial result into a result and return the result, which is
+    updated in place if it is a Counter, dictionary, list or set."""
+    if result is None:
+        return partial
+    if partial is None:
+        return result
+    if isinstance(result, Counter):
+        result.update(partial)
+    elif isinstance(result, dict):
+        for key, value in partial.items():
+            result[key] = merge(result.get(key), value)
+    elif isinstance(result, list):
+        result.extend(partial)
+    elif isinstance(result, set):
+        result.update(partial)
+    else:
+        result = result + partial
+    return result
+
+
+def map_reduce(mapper, items, reducer=merge, processes=PROCESSES, chunk_size=CHUNK_SIZE):
+    """Apply mapper to all items and return the reduction of the results, None if
+    there were no items."""
+    jobs = ((mapper, reducer, chunk) for chunk in _chunks(items, chunk_size))
+    result = None
+    if processes <= 1:
+        for job in jobs:
+            result = reducer(result, _map_chunk(job))
+        return result
+    pool = Pool(processes)
+    try:
+        for partial in pool.imap(_map_chunk, jobs):
+            result = reducer(result, partial)
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return result
+
+
+def _map_chunk(job):
+    mapper, reducer, chunk = job
+    result = None
+    for item in chunk:
+        result = reducer(result, mapper(item))
+    return result
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
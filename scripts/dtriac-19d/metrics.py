@@ -0,0 +1,218 @@
+"""metrics.py
+
+Per-document metrics for the processing stages. When a metrics file is given
+(with the --metrics option of utils.get_options() and run_tarsqi.py) a JSON
+line is appended to it for each document that a stage processes:
+
+{"stage": "lookup_technologies", "doc": "128404", "total": 0.84,
+ "parse": 0.31, "compute": 0.42, "write": 0.11, "bytes_in": 1803457,
+ "bytes_out": 402115, "peak_rss": 93184000, "error": false}
+
+Times are in seconds. Parse and write time are the time spent in reading and
+writing LIF files (see utils.read_lif() and utils.write_lif()), including the
+lif files that the text of other stages refers to, compute time is the rest.
+Bytes in are the sizes of the files read whole, files read in part with
+utils.read_lif_window() and bundle members are not counted. The peak RSS
+is the high water mark of the process in bytes after the document was
+processed, so it goes up with the first document that needs more memory than
+the ones before it. Lines are written with one write each to a file opened for
+appending, so worker processes can share a metrics file.
+
+With --memory, tracemalloc is started and the records also have the peak of
+the memory allocated by Python while processing the document (traced_peak) and
+the resident set size of the process after it (rss), both in bytes. Tracing
+allocations makes processing a few times slower, so use it on a sample.
+Documents that were skipped by the guards in utils.process_element() have a
+record with the reason in the skipped field.
+
+Use metrics_report.py for latency percentiles, the slowest documents of each
+stage and Prometheus output.
+
+"""
+
+import os
+import sys
+import time
+import json
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is then not recorded
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    # not available in Python 2
+    tracemalloc = None
+
+
+# The open metrics file, None if metrics are not recorded.
+METRICS_FILE = None
+
+# Whether the memory allocated for each document is traced.
+TRACE_MEMORY = False
+
+# The metrics of the document that is being processed.
+_CURRENT = None
+
+# The phase that is being timed, None if there is none.
+_PHASE = None
+
+PHASES = ('parse', 'compute', 'write')
+
+
+def open_metrics(fname):
+    global METRICS_FILE
+    directory = os.path.dirname(fname)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    METRICS_FILE = open(fname, 'a')
+
+
+def trace_memory():
+    global TRACE_MEMORY
+    if tracemalloc is None:
+        print("WARNING: memory tracing needs tracemalloc, which is not available")
+        return
+    tracemalloc.start()
+    TRACE_MEMORY = True
+
+
+def close_metrics():
+    global METRICS_FILE
+    if METRICS_FILE is not None:
+        METRICS_FILE.close()
+        METRICS_FILE = None
+
+
+@contextmanager
+def document(stage, doc):
+    """Record the metrics of processing a document in a stage, this does nothing
+    when there is no metrics file."""
+    global _CURRENT
+    if METRICS_FILE is None:
+        yield
+        return
+    _CURRENT = {'stage': stage, 'doc': doc, 'parse': 0.0, 'write': 0.0,
+                'bytes_in': 0, 'bytes_out': 0, 'error': True}
+    if TRACE_MEMORY:
+        _reset_traced_peak()
+    t0 = time.time()
+    try:
+        yield
+        _CURRENT['error'] = False
+    finally:
+        record = _CURRENT
+        _CURRENT = None
+        record['total'] = time.time() - t0
+        record['compute'] = max(0.0, record['total'] - record['parse'] - record['write'])
+        record['peak_rss'] = peak_rss()
+        if TRACE_MEMORY:
+            record['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            record['rss'] = current_rss()
+        METRICS_FILE.write(json.dumps(record, sort_keys=True) + '\n')
+        METRICS_FILE.flush()
+
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the body to the parse or write time of the current
+    document. A phase inside another phase is counted as part of the outer one,
+    for example a referenced text that is read while writing."""
+    global _PHASE
+    if _PHASE is not None:
+        yield
+        return
+    _PHASE = name
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        _PHASE = None
+        if _CURRENT is not None:
+            _CURRENT[name] += time.time() - t0
+
+
+def mark(name, value):
+    """Set a field in the record of the current document."""
+    if _CURRENT is not None:
+        _CURRENT[name] = value
+
+
+def count(name, size):
+    """Add to the bytes_in or bytes_out of the current document."""
+    if _CURRENT is not None:
+        _CURRENT[name] += size
+
+
+def file_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return 0
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes, None if it
+    cannot be determined."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Return the resident set size of the process in bytes, None if it cannot
+    be determined (it is read from /proc)."""
+    statm = _statm()
+    return None if statm is None else statm[1]
+
+
+def virtual_size():
+    """Return the size of the address space of the process in bytes, None if it
+    cannot be determined."""
+    statm = _statm()
+    return None if statm is None else statm[0]
+
+
+def _statm():
+    try:
+        with open('/proc/self/statm') as fh:
+            fields = fh.read().split()
+    except (IOError, OSError):
+        return None
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return int(fields[0]) * page_size, int(fields[1]) * page_size
+
+
+def _reset_traced_peak():
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # before Python 3.9 the peak can only be reset with the traces
+        tracemalloc.clear_traces()
+
+
+def read_metrics(fnames):
+    """Return the records in a list of metrics files."""
+    records = []
+    for fname in fnames:
+        with open(fname) as fh:
+            for line in fh:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    return records
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a list of numbers, using the nearest rank."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(1, int(round(p / 100.0 * len(values) + 0.4999)))
+    return values[min(rank, len(values)) - 1]
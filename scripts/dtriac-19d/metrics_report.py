@@ -0,0 +1,132 @@
+"""metrics_report.py
+
+Summarize the metrics files written by the stages with the --metrics option,
+see metrics.py.
+
+Usage:
+
+$ python3 metrics_report.py (--slowest N) METRICS_FILE ...
+$ python3 metrics_report.py --prometheus METRICS_FILE ... > metrics.prom
+
+The first form prints for each stage the number of documents, errors and
+skipped documents, the 50th, 95th and 99th percentile and the maximum of the
+total, parse, compute and write time per document, the bytes read and written,
+the peak RSS, and the N slowest documents (5 by default). For metrics recorded
+with --memory it also prints the percentiles of the memory allocated per
+document and the N documents that needed the most memory.
+
+The second form prints the same numbers in the Prometheus text format, which
+can be picked up by the textfile collector of the node exporter.
+
+"""
+
+import sys
+import getopt
+from collections import OrderedDict
+
+from metrics import read_metrics, percentile, PHASES
+
+
+PERCENTILES = (50, 95, 99)
+
+SLOWEST = 5
+
+PREFIX = 'dtriac'
+
+
+def group_by_stage(records):
+    stages = OrderedDict()
+    for record in records:
+        stages.setdefault(record['stage'], []).append(record)
+    return stages
+
+
+def print_report(records, slowest=SLOWEST):
+    for stage, stage_records in group_by_stage(records).items():
+        errors = sum(1 for r in stage_records if r['error'])
+        skipped = sum(1 for r in stage_records if r.get('skipped'))
+        print("\n%s  documents=%d  errors=%d  skipped=%d"
+              % (stage, len(stage_records), errors, skipped))
+        print("\n    %-8s %9s %9s %9s %9s %11s" % ('seconds', 'p50', 'p95', 'p99', 'max', 'total'))
+        for phase in ('total',) + PHASES:
+            values = [r[phase] for r in stage_records]
+            print("    %-8s %s %9.3f %11.2f"
+                  % (phase, ' '.join("%9.3f" % percentile(values, p) for p in PERCENTILES),
+                     max(values), sum(values)))
+        bytes_in = sum(r['bytes_in'] for r in stage_records)
+        bytes_out = sum(r['bytes_out'] for r in stage_records)
+        rss = [r['peak_rss'] for r in stage_records if r.get('peak_rss') is not None]
+        print("\n    bytes in %s  bytes out %s  peak RSS %s"
+              % (_megabytes(bytes_in), _megabytes(bytes_out),
+                 _megabytes(max(rss)) if rss else '-'))
+        print("\n    slowest documents:")
+        for r in sorted(stage_records, key=lambda r: r['total'], reverse=True)[:slowest]:
+            print("    %9.3f  %-12s  parse=%.3f compute=%.3f write=%.3f  in=%s%s"
+                  % (r['total'], r['doc'], r['parse'], r['compute'], r['write'],
+                     _megabytes(r['bytes_in']), '  ERROR' if r['error'] else ''))
+        traced = [r for r in stage_records if r.get('traced_peak') is not None]
+        if traced:
+            values = [r['traced_peak'] for r in traced]
+            print("\n    allocated  p50=%s  p95=%s  p99=%s  max=%s"
+                  % tuple([_megabytes(percentile(values, p)) for p in PERCENTILES]
+                          + [_megabytes(max(values))]))
+            print("\n    most memory:")
+            for r in sorted(traced, key=lambda r: r['traced_peak'], reverse=True)[:slowest]:
+                print("    %9s  %-12s  rss=%s  in=%s"
+                      % (_megabytes(r['traced_peak']), r['doc'],
+                         _megabytes(r['rss']) if r.get('rss') else '-',
+                         _megabytes(r['bytes_in'])))
+    print('')
+
+
+def print_prometheus(records):
+    stages = group_by_stage(records)
+    name = '%s_document_seconds' % PREFIX
+    print("# HELP %s Time spent on a document in a phase of a stage." % name)
+    print("# TYPE %s summary" % name)
+    for stage, stage_records in stages.items():
+        for phase in ('total',) + PHASES:
+            values = [r[phase] for r in stage_records]
+            labels = 'stage="%s",phase="%s"' % (stage, phase)
+            for p in PERCENTILES:
+                print('%s{%s,quantile="%s"} %f' % (name, labels, p / 100.0, percentile(values, p)))
+            print('%s_sum{%s} %f' % (name, labels, sum(values)))
+            print('%s_count{%s} %d' % (name, labels, len(values)))
+    for field, help_text in (('bytes_in', 'Bytes read'), ('bytes_out', 'Bytes written')):
+        name = '%s_%s_total' % (PREFIX, field)
+        print("# HELP %s %s by a stage." % (name, help_text))
+        print("# TYPE %s counter" % name)
+        for stage, stage_records in stages.items():
+            print('%s{stage="%s"} %d' % (name, stage, sum(r[field] for r in stage_records)))
+    name = '%s_document_errors_total' % PREFIX
+    print("# HELP %s Documents that failed in a stage." % name)
+    print("# TYPE %s counter" % name)
+    for stage, stage_records in stages.items():
+        print('%s{stage="%s"} %d' % (name, stage, sum(1 for r in stage_records if r['error'])))
+    name = '%s_documents_skipped_total' % PREFIX
+    print("# HELP %s Documents that were skipped by a stage because of their size or memory use." % name)
+    print("# TYPE %s counter" % name)
+    for stage, stage_records in stages.items():
+        print('%s{stage="%s"} %d' % (name, stage, sum(1 for r in stage_records if r.get('skipped'))))
+    name = '%s_peak_rss_bytes' % PREFIX
+    print("# HELP %s Peak resident set size of the processes of a stage." % name)
+    print("# TYPE %s gauge" % name)
+    for stage, stage_records in stages.items():
+        rss = [r['peak_rss'] for r in stage_records if r.get('peak_rss') is not None]
+        if rss:
+            print('%s{stage="%s"} %d' % (name, stage, max(rss)))
+
+
+def _megabytes(size):
+    return "%.1fMB" % (size / 1000000.0)
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], '', ['slowest=', 'prometheus'])
+    options = dict(opts)
+    records = read_metrics(args)
+    if '--prometheus' in options:
+        print_prometheus(records)
+    else:
+        print_report(records, int(options.get('--slowest', SLOWEST)))
@@ -4,34 +4,62 @@ Print statistics from the json files that will be imported into ES.
 
 Best way to use:
 
-$ python3 index_statistics.py -d <DATA_DIR> -e <INT> | grep -v 2020
+$ python3 print_index_statistics.py -d <DATA_DIR> -e <INT> (-p PROCESSES)
 
-The grep filters out the regular file-by-file printing (assuming it is still
-2020 when you do this).
+This prints a line with counts for each file and the totals for all files. The
+files are read by PROCESSES worker processes, by default one for each CPU, see
+mapreduce.py.
 
 """
 
 import os
+import sys
 import json
+from functools import partial
+from collections import Counter
 
-from utils import get_options, process_list, ensure_directory
+from utils import get_options, elements, time_elapsed, OPTIONS
+from mapreduce import map_reduce, PROCESSES
 
 
-def show_statistics(data_dir, fname):
-    subdir = int(os.path.split(fname)[0])
-    ela_file = os.path.join(data_dir, 'ela', "%06d.json" % subdir)
-    json_obj = json.load(open(ela_file))
-    authors = len(json_obj.get('author', []))
-    wikis = len(json_obj.get('ground_more', []))
-    locations = len(json_obj.get('location', []))
-    organizations = len(json_obj.get('organization', []))
-    persons = len(json_obj.get('person', []))
-    topics = len(json_obj.get('topic', []))
-    print("%06d    a:%d\tt:%d\tw:%d\tl:%d\to:%s\tp:%d"
-          % (subdir, authors, topics, wikis, locations, organizations, persons))
+FIELDS = (('a', 'author'), ('t', 'topic'), ('w', 'ground_more'),
+          ('l', 'location'), ('o', 'organization'), ('p', 'person'))
+
+
+@time_elapsed
+def show_statistics(data_dir, filelist, start, end, crash, processes=PROCESSES):
+    print("$ python3 %s\n" % ' '.join(sys.argv))
+    fnames = [fname for n, fname in elements(filelist, start, end)]
+    mapper = partial(file_statistics, data_dir, crash=crash)
+    stats = map_reduce(mapper, fnames, processes=processes) or {}
+    for line in stats.get('lines', []):
+        print(line)
+    totals = stats.get('totals', Counter())
+    print("\nTOTAL     a:%d\tt:%d\tw:%d\tl:%d\to:%d\tp:%d"
+          % tuple(totals[field] for abbrev, field in FIELDS))
+    print("documents: %d, errors: %d" % (totals['documents'], totals['errors']))
+
+
+def file_statistics(data_dir, fname, crash=False):
+    """Return the line to print for a file and the counts for each field."""
+    try:
+        subdir = int(os.path.split(fname)[0])
+        ela_file = os.path.join(data_dir, 'ela', "%06d.json" % subdir)
+        with open(ela_file) as fh:
+            json_obj = json.load(fh)
+    except Exception as e:
+        if crash:
+            raise
+        return {'lines': ['ERROR: %s %s' % (fname, e)], 'totals': Counter(errors=1)}
+    counts = Counter(dict((field, len(json_obj.get(field, []))) for abbrev, field in FIELDS))
+    line = "%06d    %s" % (subdir, '\t'.join("%s:%d" % (abbrev, counts[field])
+                                             for abbrev, field in FIELDS))
+    counts['documents'] = 1
+    return {'lines': [line], 'totals': counts}
 
 
 if __name__ == '__main__':
 
     data_dir, filelist, start, end, crash = get_options()
-    process_list(data_dir, filelist, start, end, crash, show_statistics)
+    show_statistics(data_dir, filelist, start, end, crash,
+                    OPTIONS['processes'] or PROCESSES)
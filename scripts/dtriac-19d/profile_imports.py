@@ -0,0 +1,81 @@
+"""profile_imports.py
+
+Report how long it takes to import the modules of the pipeline.
+
+Usage:
+
+$ python3 profile_imports.py (-n TOP) (MODULE ...)
+
+Without arguments all Python modules in this directory are profiled. Each module
+is imported in a fresh interpreter with "python3 -X importtime" so there is no
+sharing of already imported modules between measurements. For each module this
+prints the total import time and the TOP most expensive modules that were
+imported along the way (default is 5).
+
+Modules that fail to import, typically because a dependency is not installed,
+are reported with the last line of the error message.
+
+"""
+
+import os
+import sys
+import glob
+import getopt
+import subprocess
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def pipeline_modules():
+    fnames = glob.glob(os.path.join(SCRIPT_DIR, '*.py'))
+    return sorted(os.path.basename(fname)[:-3] for fname in fnames)
+
+
+def profile_module(module):
+    """Import module in a new interpreter and return a pair of the total import
+    time in seconds and a list of (seconds, module) pairs for all modules
+    imported, ordered on decreasing cumulative time. Returns the error message
+    instead of the list if the import failed."""
+    command = [sys.executable, '-X', 'importtime', '-c', 'import %s' % module]
+    result = subprocess.run(command, cwd=SCRIPT_DIR, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    timings = []
+    errors = []
+    for line in result.stderr.split('\n'):
+        if line.startswith('import time:'):
+            fields = line[len('import time:'):].split('|')
+            if fields[0].strip().isdigit():
+                timings.append((int(fields[1]) / 1000000, fields[2].strip()))
+        elif line.strip():
+            errors.append(line.strip())
+    if result.returncode != 0:
+        return None, errors[-1] if errors else 'unknown error'
+    total = sum(t for t, name in timings if name == module)
+    return total, sorted(timings, reverse=True)
+
+
+def profile_modules(modules, top):
+    results = []
+    for module in modules:
+        total, timings = profile_module(module)
+        results.append((module, total, timings))
+    results.sort(key=lambda r: -1 if r[1] is None else r[1], reverse=True)
+    print("\n%-30s  %8s\n" % ('module', 'seconds'))
+    for module, total, timings in results:
+        if total is None:
+            print("%-30s  %8s  %s" % (module, 'ERROR', timings))
+            continue
+        print("%-30s  %8.3f" % (module, total))
+        for seconds, name in [t for t in timings if t[1] != module][:top]:
+            print("    %-26s  %8.3f" % (name, seconds))
+    print('')
+
+
+if __name__ == '__main__':
+
+    options, args = getopt.getopt(sys.argv[1:], 'n:')
+    top = int(dict(options).get('-n', 5))
+    modules = args if args else pipeline_modules()
+    modules = [m for m in modules if m != 'profile_imports']
+    profile_modules(modules, top)
@@ -0,0 +1,88 @@
+"""profiling.py
+
+Profiling a sample of the documents of a stage with cProfile. Stages that take
+the --profile DIRECTORY option (those that use utils.get_options(), and also
+generate_topics.py, create_lif.py and run_tarsqi.py) profile every Nth document,
+where N is given by --profile-every and defaults to 1, and write the statistics
+of all profiled documents to DIRECTORY/STAGE.pstats. Worker processes write to
+DIRECTORY/STAGE-PID.pstats. Statistics are written after each profiled document
+so they are there even if the run is interrupted.
+
+$ python3 lookup.py -d $DATA -f files-random.txt -e 1000 --profile prof --profile-every 50
+$ python3 profiling.py prof/lookup_technologies*.pstats
+
+The second command merges the files and prints the functions with the highest
+cumulative time, with -o the merged statistics are also written to a file. The
+files can also be read with the pstats module, with snakeviz, or turned into a
+flame graph with flameprof.
+
+"""
+
+import os
+import sys
+import getopt
+import pstats
+import cProfile
+import multiprocessing
+from collections import Counter
+from contextlib import contextmanager
+
+
+# The directory that statistics are written to, None if not profiling.
+PROFILE_DIR = None
+
+# Only every PROFILE_EVERY-th document of a stage is profiled.
+PROFILE_EVERY = 1
+
+# Number of functions printed when merging statistics.
+PRINT_LIMIT = 40
+
+_PROFILERS = {}
+_DOCUMENTS = Counter()
+
+
+def start_profiling(directory, every=1):
+    global PROFILE_DIR, PROFILE_EVERY
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    PROFILE_DIR = directory
+    PROFILE_EVERY = max(1, every)
+
+
+@contextmanager
+def document(stage):
+    """Profile the body if profiling is on and the document is in the sample."""
+    if PROFILE_DIR is None:
+        yield
+        return
+    _DOCUMENTS[stage] += 1
+    if (_DOCUMENTS[stage] - 1) % PROFILE_EVERY != 0:
+        yield
+        return
+    profiler = _PROFILERS.setdefault(stage, cProfile.Profile())
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(stats_file(stage))
+
+
+def stats_file(stage):
+    if multiprocessing.current_process().name == 'MainProcess':
+        return os.path.join(PROFILE_DIR, '%s.pstats' % stage)
+    return os.path.join(PROFILE_DIR, '%s-%d.pstats' % (stage, os.getpid()))
+
+
+def merge_stats(fnames, out_file=None, limit=PRINT_LIMIT):
+    stats = pstats.Stats(*fnames)
+    if out_file is not None:
+        stats.dump_stats(out_file)
+    stats.sort_stats('cumulative').print_stats(limit)
+
+
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], 'o:n:')
+    options = dict(opts)
+    merge_stats(args, options.get('-o'), int(options.get('-n', PRINT_LIMIT)))
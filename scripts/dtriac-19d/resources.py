@@ -1,67 +1,146 @@
+"""resources.py
+
+Resources that are shared by several processing stages. Most of these take a
+while to load (the NLTK word list, the pickled locations index) and not all
+stages need all of them, so they are loaded lazily through a small registry:
+
+>>> import resources
+>>> names = resources.get('names')
+
+The first call to get() loads the resource, later calls return the cached
+object. Use register() to add a resource and is_loaded() to check whether a
+resource was already loaded.
+
+The technology ontology, the NLTK word list and the locations can be compiled
+into read-only tables in data/tables:
+
+$ python3 resources.py --build-tables
+
+The tables are memory mapped (see sorted_table.py), so loading them takes no
+time and all processes that use them share one copy in the page cache instead
+of each building their own sets and dictionaries. When a table exists it is
+used instead of the source it was built from, so build the tables again after
+changing the technology lists or the locations index.
+
+"""
+
+import os
+import re
+import sys
 import pickle
+import sqlite3
+from functools import lru_cache
+
+from sorted_table import SortedTable, write_table
 
 
-# pickled locations with coordinates, created by locations.py
+# pickled locations with coordinates and the same locations in an SQLite
+# database with formatted coordinates, both created by locations.py
 LOCATIONS_INDEX = 'data/locations/locations.idx.pickle'
+LOCATIONS_DB = 'data/locations/locations.idx.db'
+
+# read-only tables compiled by build_tables()
+TABLES_DIR = 'data/tables'
+LOCATIONS_TABLE = 'data/tables/locations.tbl'
+WORDS_TABLE = 'data/tables/words.tbl'
+
+# number of locations kept in the in-process cache of Locations
+LOCATIONS_CACHE_SIZE = 32768
+
+# number of membership tests kept in the in-process cache of Words
+WORDS_CACHE_SIZE = 65536
 
 # list of common first names
 FIRST_NAMES = 'data/names/common-first-names.txt'
 
+# maximum number of verdicts cached by Names.filter()
+NAMES_CACHE_SIZE = 100000
+
 
 class Names(object):
 
+    """Filtering and cleaning up of person names. All filter rules are compiled
+    into two sets and one regular expression when the names are loaded, and the
+    verdict for each name is cached, since the same names occur over and over
+    again in a document and in the corpus."""
+
+    # names that are filtered as is
+    FILTERED = ('Jr', 'Jr.', 'Sr', 'Sr.')
+
+    # names that are filtered after lower casing, added to the first names;
+    # these are a hack to deal with 'John J. Kingman Road' spillovers, should
+    # use a more global approach and collect prefixes of names with roads
+    FILTERED_LOWER = ('john j.', 'john j. kingman')
+
+    # names that end with "Road" are not names, and all initials is either a
+    # location or a part of a name
+    FILTER_PATTERN = re.compile(r' Road\Z|\A\s*(?:\S\.(?:\s+|\Z))*\Z')
+
     def __init__(self):
-        self.names_to_filter = set()
+        self.names_to_filter = set(self.FILTERED_LOWER)
         for line in open(FIRST_NAMES):
             if line.startswith('#'):
                 continue
             (rank, male, count1, female, count2) = line.strip().split('\t')
             self.names_to_filter.add(male.lower())
             self.names_to_filter.add(female.lower())
+        self.verdicts = {}
+
+    def filter(self, name):
+        """Return True if name is not a name that we want to keep."""
+        verdict = self.verdicts.get(name)
+        if verdict is None:
+            if len(self.verdicts) >= NAMES_CACHE_SIZE:
+                self.verdicts.clear()
+            verdict = self._filter(name)
+            self.verdicts[name] = verdict
+        return verdict
+
+    def filter_all(self, names):
+        """Return the set of names from a list of names that should be filtered."""
+        return set(name for name in set(names) if self.filter(name))
+
+    def _filter(self, name):
+        # no names shorter than three characters
+        # no names with a period and shorter than five characters
+        return (len(name) < 3
+                or ('.' in name and len(name) < 5)
+                or name in self.FILTERED
+                or name.lower() in self.names_to_filter
+                or self.FILTER_PATTERN.search(name) is not None)
 
     @staticmethod
     def normalize(name):
+        """Normalize white space, capitalize parts that are all upper case and
+        strip trailing punctuation."""
         normalized = []
         for part in name.split():
             if part.isupper() and '.' not in part:
                 normalized.append(part.capitalize())
             else:
                 normalized.append(part)
-        normalized = ' '.join(normalized)
-        if name.replace('\n', '') != normalized:
-            print("'%s' ==> '%s'" % (name, normalized))
-        return normalized
+        return ' '.join(normalized).rstrip(',;:')
 
     @staticmethod
     def split(lif, annotation):
-        name = lif.text.value[annotation.start:annotation.end]
-        if ('\n' in name
-            and lif.text.value[annotation.start-1] == '\n'):
-            #print('=', lif.text.value[annotation.end+1])
-            for part in name.split('\n'):
-                print('>', part)
-
-    def filter(self, name):
-        # common first names and Jr and Sr are filtered
-        if (name.lower() in self.names_to_filter
-            or name in ('Jr', 'Jr.', 'Sr', 'Sr.')):
-            return True
-        # names that end with "Road" are not names
-        if name.endswith(' Road'):
-            return True
-        # hack to deal with 'John J. Kingman Road' spillovers, should use a more
-        # global approach and collect prefixes of names with roads
-        if name.lower() in ('john j.', 'john j. kingman'):
-            # print(name)
-            return True
-        # all initials is either a location or a part of a name
-        if self.initials_only(name):
-            return True
-        # no names shorter than three characters
-        # no names with a period and shorter than five characters
-        if len(name) < 3 or ('.' in name and len(name) < 5):
-            return True
-        return False
+        """Return a list of (start, end, name) triples for the names in a person
+        annotation. Annotations that start at the beginning of a line and span
+        more than one line are typically lists of names from the first page, for
+        those each line is taken to be a name."""
+        text = lif.text.value
+        name = text[annotation.start:annotation.end]
+        if ('\n' not in name
+                or (annotation.start > 0 and text[annotation.start - 1] != '\n')):
+            return [(annotation.start, annotation.end, name)]
+        names = []
+        start = annotation.start
+        for line in name.split('\n'):
+            stripped = line.strip()
+            if stripped:
+                offset = start + line.index(stripped)
+                names.append((offset, offset + len(stripped), stripped))
+            start += len(line) + 1
+        return names
 
     @staticmethod
     def initials_only(name):
@@ -73,11 +152,159 @@ class Names(object):
 
 class Locations(object):
 
-    def __init__(self):
-        self.data = pickle.load(open(LOCATIONS_INDEX, 'rb'))
+    """Coordinates of locations, as strings formatted by format_coordinates().
+    Uses the table in LOCATIONS_TABLE or the read-only SQLite database in
+    LOCATIONS_DB if they exist, so that worker processes share the data through
+    the page cache instead of each having their own copy, and falls back to
+    loading the pickled index. Results are kept in an LRU cache."""
+
+    def __init__(self, db_file=LOCATIONS_DB, index_file=LOCATIONS_INDEX,
+                 table_file=LOCATIONS_TABLE):
+        self.db_file = db_file
+        self.db = None
+        self.pid = None
+        self.data = None
+        if os.path.exists(table_file):
+            self.data = SortedTable(table_file)
+        elif not os.path.exists(db_file):
+            self.data = load_locations_index(index_file)
+        self.get_coordinates = lru_cache(maxsize=LOCATIONS_CACHE_SIZE)(self._get_coordinates)
+
+    def _get_coordinates(self, location):
+        if self.data is not None:
+            return self.data.get(location)
+        row = self._connection().execute(
+            "SELECT coordinates FROM locations WHERE name = ?", (location,)).fetchone()
+        return None if row is None else row[0]
+
+    def _connection(self):
+        """Return the database connection, a forked process opens its own."""
+        if self.pid != os.getpid():
+            uri = 'file:%s?mode=ro' % os.path.abspath(self.db_file)
+            self.db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self.pid = os.getpid()
+        return self.db
+
+
+class Words(object):
+
+    """The NLTK word list in WORDS_TABLE. A membership test on the table is a
+    binary search over the memory mapped file, which is about 80 times slower
+    than on a set, and the same tokens are tested over and over again, so the
+    results are kept in an LRU cache."""
+
+    def __init__(self, table_file=WORDS_TABLE):
+        self.table = SortedTable(table_file)
+        self.contains = lru_cache(maxsize=WORDS_CACHE_SIZE)(self.table.__contains__)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, word):
+        return self.contains(word)
+
+
+def load_locations_index(index_file=LOCATIONS_INDEX):
+    """Return a dictionary with the formatted coordinates of the locations in the
+    pickled index."""
+    index = pickle.load(open(index_file, 'rb'))
+    return dict((location, format_coordinates(result['lat'], result['lon']))
+                for location, result in index.items() if result is not None)
+
+
+def format_coordinates(lat, lon):
+    return "%.2f,%.2f" % (float(lat), float(lon))
+
+
+def build_tables():
+    """Compile the technology ontology, the locations index and the NLTK word
+    list into tables. The word list is skipped if NLTK or its words corpus is
+    not installed."""
+    from lookup import TechnologyOntology, TECHNOLOGY_TABLE
+    if not os.path.exists(TABLES_DIR):
+        os.makedirs(TABLES_DIR)
+    tables = [(TECHNOLOGY_TABLE, lambda: TechnologyOntology(table_file=None).entries),
+              (LOCATIONS_TABLE, load_locations_index),
+              (WORDS_TABLE, lambda: dict.fromkeys(_load_nltk_words(), ''))]
+    for table_file, load in tables:
+        try:
+            mapping = load()
+        except (ImportError, LookupError) as e:
+            print("Skipped %s: %s" % (table_file, e))
+            continue
+        write_table(table_file, mapping)
+        print("Wrote %s with %d entries" % (table_file, len(mapping)))
+
+
+_LOADERS = {}
+_RESOURCES = {}
+
+
+def register(name, loader):
+    """Register a function without arguments that loads the resource name."""
+    _LOADERS[name] = loader
+
+
+def get(name):
+    """Return the resource with the given name, loading it on first use."""
+    if name not in _RESOURCES:
+        _RESOURCES[name] = _LOADERS[name]()
+    return _RESOURCES[name]
+
+
+def is_loaded(name):
+    return name in _RESOURCES
+
+
+def _load_technologies():
+    from lookup import TechnologyOntology
+    return TechnologyOntology()
+
+
+def _load_words():
+    if os.path.exists(WORDS_TABLE):
+        return Words()
+    return _load_nltk_words()
+
+
+def _load_nltk_words():
+    from nltk.corpus import words
+    return set(words.words())
+
+
+def _load_stopwords():
+    from nltk.corpus import stopwords
+    return set(stopwords.words('english'))
+
+
+def _load_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+
+def _load_tokenizer():
+    from nltk import word_tokenize
+    return word_tokenize
+
+
+def _load_wordnet():
+    from nltk.corpus import wordnet
+    return wordnet
+
+
+register('names', Names)
+register('locations', Locations)
+register('technologies', _load_technologies)
+register('words', _load_words)
+register('stopwords', _load_stopwords)
+register('lemmatizer', _load_lemmatizer)
+register('tokenizer', _load_tokenizer)
+register('wordnet', _load_wordnet)
+
+
+if __name__ == '__main__':
 
-    def get_coordinates(self, location):
-        result = self.data.get(location)
-        if result is None:
-            return None
-        return "%.2f,%.2f" % (float(result['lat']), float(result['lon']))
+    if sys.argv[1:] == ['--build-tables']:
+        build_tables()
+    else:
+        print("Usage: python3 resources.py --build-tables")
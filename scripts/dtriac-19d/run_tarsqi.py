@@ -16,51 +16,260 @@ Translated to 2M documents:
 Saving files as gz files reduces diskspace use by a factor 15 with no difference
 in processing time.
 
+Usage:
+
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END -p PROCESSES
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END --resume
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END --metrics METRICS_FILE
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END --profile DIR (--profile-every N)
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END (--max-size MB) (--max-memory MB)
+$ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END --chunked --chunk-processes N
+
+With -p the file list is handed to PROCESSES worker processes through a shared
+queue. Each worker initializes the TTK pipeline once by running it on a short
+text and then keeps taking documents from the queue, writing output files
+independently and regularly reporting its own throughput. With --crash a worker
+exits on its first error, the other workers are then stopped and the script
+exits with status 1.
+
+Output files are first written to a temporary file that is renamed when it is
+complete, so an interrupted run never leaves partial output behind. With the
+--resume option documents that already have output are skipped, which makes it
+safe to simply rerun an interrupted job.
+
+With the --chunked option the text is not handed to TTK in one go. Instead it
+is split into chunks of at most CHUNK_SIZE characters, using the page
+boundaries from the pages view and splitting pages at paragraph breaks when
+needed. TTK runs on each chunk separately and the resulting views are merged
+into one view with offsets relative to the full text and identifiers prefixed
+with the chunk number. The output is a container with the metadata and views
+of the input LIF object and the merged view, in the same shape as the output of
+the normal mode. This keeps TTK memory use bounded on long and noisy documents.
+Chunks are independent of each other, with --chunk-processes N the
+chunks of a document are handed to a pool of N processes. This is only used
+without -p, with -p the parallelism comes from running documents side by side.
+
+With --metrics the time spent reading, parsing and writing each document and
+the sizes of its input and output are appended to METRICS_FILE, see metrics.py.
+With --profile every Nth document is profiled and the statistics are written to
+DIR, with one file per worker process, see profiling.py.
+
+Long documents can make TTK use a lot of memory. With --max-size MB documents
+whose LIF file is larger than MB megabytes are run in chunked mode, and with
+--max-memory MB documents that need more than MB megabytes are skipped and
+logged (see utils.memory_limit()). With --memory and --metrics the memory used
+for each document is recorded, this needs tracemalloc, which is not in Python 2.
+
 """
 
 
 import os
 import sys
+import time
 import getopt
 import gzip
+from multiprocessing import Process, Queue, Pool
+
+try:
+    from queue import Full
+except ImportError:
+    # Python 2
+    from Queue import Full
 
 import tarsqi
 from utilities import lif
 
-from utils import time_elapsed, elements, ensure_directory, print_element
-from lif import Container
+from utils import time_elapsed, elements, ensure_directory, print_element, docid
+from utils import OPTIONS, MEGABYTE, memory_limit, skip_document, start_metrics
+import metrics
+import profiling
+from lif import Container, View
 
 
 COMPRESS = True
 
+# the worker processes report throughput after every this many documents
+LOG_INTERVAL = 100
+
+# text used to initialize the TTK pipeline in each worker
+WARMUP_TEXT = "We walked home on Monday."
+
+# seconds to wait for room in the queue before checking whether the workers
+# are still alive
+QUEUE_TIMEOUT = 1
+
+# maximum number of characters in a chunk when running in chunked mode
+CHUNK_SIZE = 10000
+
+# the discriminator of the containers written by TTK
+LIF_DISCRIMINATOR = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
+
 
 @time_elapsed
-def run_tarsqi(data_dir, filelist, start, end, crash=False):
+def run_tarsqi(data_dir, filelist, start, end, crash=False, resume=False, chunked=False,
+               mapper=map):
     print("$ python3 %s" % ' '.join(sys.argv))
     for n, fname in elements(filelist, start, end):
         print_element(n, fname)
-        if crash:
-            run_tarsqi_for_file(data_dir, fname)
-        else:
-            try:
-                run_tarsqi_for_file(data_dir, fname)
-            except Exception as e:
-                print('ERROR:', Exception, e)
+        if resume and os.path.exists(ttk_output_file(data_dir, fname)):
+            continue
+        try:
+            process_document(data_dir, fname, chunked, mapper)
+        except Exception as e:
+            if crash:
+                raise
+            print('ERROR:', Exception, e)
 
 
-def run_tarsqi_for_file(data_dir, fname):
-    lif_file = os.path.join(data_dir, 'lif', fname[:-4] + '.lif')
+@time_elapsed
+def run_tarsqi_parallel(data_dir, filelist, start, end, processes,
+                        crash=False, resume=False, chunked=False):
+    """Run TTK on the files using a pool of worker processes that take their
+    work from a shared queue. The queue is bounded so the file list is never
+    loaded in its entirety. If a worker dies (with --crash on the first error)
+    the other workers are stopped. Returns True if all workers finished."""
+    print("$ python3 %s" % ' '.join(sys.argv))
+    queue = Queue(maxsize=processes * 10)
+    workers = [Process(target=_worker, args=(i, queue, data_dir, crash, resume, chunked))
+               for i in range(1, processes + 1)]
+    for worker in workers:
+        worker.start()
+    try:
+        for n, fname in elements(filelist, start, end):
+            _put(queue, (n, fname), workers)
+        for worker in workers:
+            _put(queue, None, workers)
+        for worker in workers:
+            worker.join()
+    except WorkerFailed:
+        pass
+    failed = _failed_workers(workers)
+    if failed:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        print("ERROR: worker %s exited with status %s, stopped all workers"
+              % (failed[0].name, failed[0].exitcode))
+        return False
+    return True
+
+
+class WorkerFailed(Exception):
+    pass
+
+
+def _put(queue, job, workers):
+    """Put a job on the queue, waiting for room as long as all workers are
+    alive. Raises WorkerFailed if a worker died."""
+    while True:
+        if _failed_workers(workers):
+            raise WorkerFailed()
+        try:
+            queue.put(job, timeout=QUEUE_TIMEOUT)
+            return
+        except Full:
+            pass
+
+
+def _failed_workers(workers):
+    return [w for w in workers if not w.is_alive() and w.exitcode not in (None, 0)]
+
+
+def _worker(worker_id, queue, data_dir, crash, resume, chunked):
+    t0 = time.time()
+    parse_text(WARMUP_TEXT)
+    _log(worker_id, "initialized TTK in %.2f seconds" % (time.time() - t0))
+    t0 = time.time()
+    processed, skipped, errors = 0, 0, 0
+    while True:
+        job = queue.get()
+        if job is None:
+            break
+        n, fname = job
+        if resume and os.path.exists(ttk_output_file(data_dir, fname)):
+            skipped += 1
+            continue
+        try:
+            process_document(data_dir, fname, chunked)
+        except Exception as e:
+            if crash:
+                raise
+            errors += 1
+            _log(worker_id, "ERROR on %07d %s: %s" % (n, fname, e))
+            continue
+        processed += 1
+        if processed % LOG_INTERVAL == 0:
+            _log(worker_id, _throughput(processed, skipped, errors, time.time() - t0))
+    _log(worker_id, "done, %s" % _throughput(processed, skipped, errors, time.time() - t0))
+
+
+def _throughput(processed, skipped, errors, seconds):
+    return ("%d documents in %.2f seconds (%.2f docs/sec), %d skipped, %d errors"
+            % (processed, seconds, processed / max(seconds, 0.001), skipped, errors))
+
+
+def _log(worker_id, message):
+    sys.stdout.write("%s  worker-%02d  %s\n" % (time.strftime("%Y%m%d:%H%M%S"), worker_id, message))
+    sys.stdout.flush()
+
+
+def ttk_output_file(data_dir, fname):
     ttk_file = os.path.join(data_dir, 'ttk', fname[:-4] + '.lif')
+    return ttk_file + '.gz' if COMPRESS else ttk_file
+
+
+def process_document(data_dir, fname, chunked=False, mapper=map):
+    """Run TTK on a document, recording its metrics and profile. With a memory
+    limit the document is skipped if it needs more memory. The mapper is used
+    for the chunks in chunked mode, see parse_text_in_chunks()."""
+    with metrics.document('run_tarsqi', docid(fname)), profiling.document('run_tarsqi'):
+        try:
+            with memory_limit(OPTIONS['max_memory']):
+                run_tarsqi_for_file(data_dir, fname, chunked, mapper)
+        except MemoryError:
+            if OPTIONS['max_memory'] is None:
+                raise
+            skip_document(fname, 'memory', "needs more than %dMB" % OPTIONS['max_memory'])
+
+
+def run_tarsqi_for_file(data_dir, fname, chunked=False, mapper=map):
+    lif_file = os.path.join(data_dir, 'lif', fname[:-4] + '.lif')
+    ttk_file = ttk_output_file(data_dir, fname)
+    if (not chunked and OPTIONS['max_size'] is not None
+            and metrics.file_size(lif_file) > OPTIONS['max_size'] * MEGABYTE):
+        print('CHUNKED: %s is larger than %dMB' % (fname, OPTIONS['max_size']))
+        metrics.mark('chunked', True)
+        chunked = True
     ensure_directory(ttk_file)
-    lif = Container(lif_file).payload
-    text = lif.text.value
-    doc = parse_text(text)
-    if COMPRESS:
-        with gzip.open(ttk_file + '.gz', 'wb') as fh:
-            doc.print_all_lif(fh)
+    metrics.count('bytes_in', metrics.file_size(lif_file))
+    with metrics.phase('parse'):
+        lif = Container(lif_file).payload
+    if chunked:
+        container = parse_text_in_chunks(lif, mapper=mapper)
+        def write_output(fh):
+            fh.write(container.as_json_string().encode('utf8'))
     else:
-        with open(ttk_file, 'w') as out:
-            doc.print_all_lif(out)
+        doc = parse_text(lif.text.value)
+        write_output = doc.print_all_lif
+    # write to a temporary file first so there are never any partial results
+    tmp_file = ttk_file + '.tmp'
+    with metrics.phase('write'):
+        try:
+            if COMPRESS:
+                with gzip.open(tmp_file, 'wb') as fh:
+                    write_output(fh)
+            else:
+                with open(tmp_file, 'wb') as out:
+                    write_output(out)
+        except Exception:
+            # the temporary file does not exist if opening it failed
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+        os.rename(tmp_file, ttk_file)
+    metrics.count('bytes_out', metrics.file_size(ttk_file))
 
 
 def parse_text(text):
@@ -71,13 +280,111 @@ def parse_text(text):
     return doc
 
 
+def parse_text_in_chunks(lif_in, max_size=CHUNK_SIZE, mapper=map):
+    """Run TTK over the text of lif_in chunk by chunk and return a Container, like
+    the one written by print_all_lif(), with a LIF object that has the text,
+    metadata and views of lif_in and a view with the merged TTK annotations.
+    The mapper is used to apply parse_chunk() to the chunks, use the map method
+    of a process pool to process chunks in parallel."""
+    view = merge_chunk_views(mapper(parse_chunk, get_chunks(lif_in, max_size)))
+    lif_out = lif_in.derive()
+    lif_out.views = list(lif_in.views) + [View(view)]
+    container = Container()
+    container.discriminator = LIF_DISCRIMINATOR
+    container.payload = lif_out
+    return container
+
+
+def get_chunks(lif_in, max_size=CHUNK_SIZE):
+    """Return a list of (offset, text) pairs that together make up the text of the
+    LIF object. Consecutive pages are merged as long as the result is not
+    bigger than max_size, longer pages are split. Without a pages view the
+    entire text is split."""
+    text = lif_in.text.value
+    pages = lif_in.get_view('pages')
+    if pages is None or not pages.annotations:
+        spans = [(0, len(text))]
+    else:
+        spans = [(anno.start, anno.end) for anno in pages.annotations]
+        # add the text after the last page if there is any
+        if spans[-1][1] < len(text):
+            spans.append((spans[-1][1], len(text)))
+    chunks = []
+    for start, end in spans:
+        for p1, p2 in split_span(text, start, end, max_size):
+            if chunks and p2 - chunks[-1][0] <= max_size and p1 == chunks[-1][1]:
+                chunks[-1] = (chunks[-1][0], p2)
+            else:
+                chunks.append((p1, p2))
+    return [(p1, text[p1:p2]) for p1, p2 in chunks]
+
+
+def split_span(text, start, end, max_size):
+    """Split the span from start to end into spans of at most max_size characters,
+    splitting at a paragraph break if possible, at a newline otherwise."""
+    spans = []
+    while end - start > max_size:
+        limit = start + max_size
+        cut = text.rfind('\n\n', start, limit)
+        if cut > start:
+            cut += 2
+        else:
+            cut = text.rfind('\n', start, limit) + 1
+            if cut <= start:
+                cut = limit
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, end))
+    return spans
+
+
+def parse_chunk(chunk):
+    """Run TTK on a chunk, which is an offset and a text, and return the offset and
+    the JSON representation of the TTK view, with offsets relative to the
+    chunk."""
+    offset, text = chunk
+    doc = parse_text(text)
+    return offset, doc.sourcedoc.lif.views[0].as_json()
+
+
+def merge_chunk_views(chunk_views):
+    """Merge the JSON representations of the TTK views of all chunks into one view.
+    Offsets are made relative to the full text and identifiers are prefixed
+    with the chunk number, this includes identifiers used as feature values."""
+    view = {"id": "v1", "metadata": None, "annotations": []}
+    for n, (offset, chunk_view) in enumerate(chunk_views, 1):
+        if view["metadata"] is None:
+            view["metadata"] = chunk_view["metadata"]
+        prefix = "c%d-" % n
+        ids = dict((anno["id"], prefix + anno["id"])
+                   for anno in chunk_view["annotations"])
+        for anno in chunk_view["annotations"]:
+            anno["id"] = ids[anno["id"]]
+            for position in ("start", "end"):
+                if anno.get(position) is not None:
+                    anno[position] += offset
+            for feat, val in anno.get("features", {}).items():
+                if not isinstance(val, (list, dict)) and val in ids:
+                    anno["features"][feat] = ids[val]
+            view["annotations"].append(anno)
+    if view["metadata"] is None:
+        view["metadata"] = {}
+    return view
+
+
 def purge_metadata(metadata):
     for key in ["http://vocab.lappsgrid.org/TemporalRelation"]:
         metadata['contains'].pop(key, None)
 
 
 def usage():
-    pass
+    print("\nUsage:\n"
+          + "\n    $ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END"
+          + "\n    $ python run_tarsqi.py -d DATA_DIR -f FILELIST -s START -e END -p PROCESSES"
+          + "\n    $ python run_tarsqi.py (-h | --help)"
+          + "\n\nOptions: --crash, --resume, --chunked, --metrics METRICS_FILE,"
+          + "\n         --profile DIR, --profile-every N, --memory, --max-size MB,"
+          + "\n         --max-memory MB, --chunk-processes N\n")
 
 
 if __name__ == '__main__':
@@ -88,16 +395,47 @@ if __name__ == '__main__':
     data_dir = '/DATA/eager/sample-01000'
     filelist = '../../data/files-random-01000.txt'
 
-    options = dict(getopt.getopt(sys.argv[1:], 'd:f:s:e:h', ['crash', 'help'])[0])
+    options = dict(getopt.getopt(sys.argv[1:], 'd:f:s:e:p:h',
+                                 ['crash', 'resume', 'chunked', 'help', 'metrics=',
+                                  'profile=', 'profile-every=', 'memory', 'max-size=',
+                                  'max-memory=', 'chunk-processes='])[0])
     data_dir = options.get('-d', data_dir)
     filelist = options.get('-f', filelist)
     start = int(options.get('-s', 1))
     end = int(options.get('-e', 1))
     crash = True if '--crash' in options else False
+    resume = True if '--resume' in options else False
+    chunked = True if '--chunked' in options else False
+    processes = int(options.get('-p', 1))
+    chunk_processes = int(options.get('--chunk-processes', 1))
     help_wanted = True if '-h' in options or '--help' in options else False
 
+    OPTIONS['metrics'] = options.get('--metrics')
+    OPTIONS['memory'] = True if '--memory' in options else False
+    OPTIONS['max_size'] = int(options['--max-size']) if '--max-size' in options else None
+    OPTIONS['max_memory'] = int(options['--max-memory']) if '--max-memory' in options else None
+    start_metrics()
+    if '--profile' in options:
+        profiling.start_profiling(options['--profile'], int(options.get('--profile-every', 1)))
+
     if help_wanted:
         usage()
+    elif processes > 1:
+        finished = run_tarsqi_parallel(data_dir, filelist, start, end, processes,
+                                       crash=crash, resume=resume, chunked=chunked)
+        metrics.close_metrics()
+        if not finished:
+            sys.exit(1)
+    elif chunk_processes > 1:
+        pool = Pool(chunk_processes)
+        try:
+            run_tarsqi(data_dir, filelist, start, end, crash=crash, resume=resume,
+                       chunked=chunked, mapper=pool.map)
+        finally:
+            pool.close()
+            pool.join()
     else:
-        run_tarsqi(data_dir, filelist, start, end, crash=crash)
+        run_tarsqi(data_dir, filelist, start, end, crash=crash, resume=resume,
+                   chunked=chunked)
+    metrics.close_metrics()
 
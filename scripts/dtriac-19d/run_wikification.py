@@ -2,30 +2,182 @@
 Using ES-based wikification method (see https://github.com/brandeis-llc/dtriac-wikification/issues/8),
 this script reads in a directory of LIF files and writes wikified LIF files.
 (up-to) 10-best wikification is written in .payload.metadata.wikified_es.
+
+LIF files are read and parsed by a pool of worker processes (-p) and documents
+are handed to the wikifier in batches (-b). Backends that have a wikify_batch()
+method get the whole batch in one call, for other backends, including the ES
+backend, the documents in a batch are sent concurrently. Results are cached in
+an SQLite database (--cache, default is DATA/wik/wikification.db) on the hash of
+the text and the name of the backend, so documents that were wikified before
+are not sent to the backend again.
+
+For testing, --local INDEX_FILE uses a local stand-in for the ES index, with a
+JSON object with "title" and "text" properties on each line of INDEX_FILE.
+
+With --bundle the output is added to the document bundles, see bundle.py.
 """
 import os
-
-from wikification.wikify import by_es
+import sys
+import json
+import time
+import math
+import sqlite3
+import hashlib
+from collections import Counter
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join as pjoin
 
 from lif import LIF, Container
+import utils
+from utils import read_lif, write_lif
+
+BATCH_SIZE = 20
+MAX_RESULTS = 10
+
+
+class WikificationCache(object):
+
+    """Wikification results indexed on the SHA1 hash of the text and the name
+    of the backend."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.db = sqlite3.connect(fname)
+        self.db.execute("CREATE TABLE IF NOT EXISTS wikification"
+                        " (sha1 TEXT, backend TEXT, result TEXT, PRIMARY KEY (sha1, backend))")
+        self.db.commit()
+
+    def get_all(self, hashes, backend):
+        results = {}
+        for sha1 in hashes:
+            row = self.db.execute("SELECT result FROM wikification WHERE sha1 = ? AND backend = ?",
+                                  (sha1, backend)).fetchone()
+            if row is not None:
+                results[sha1] = json.loads(row[0])
+        return results
+
+    def add_all(self, results, backend):
+        self.db.executemany("INSERT OR REPLACE INTO wikification VALUES (?,?,?)",
+                            [(sha1, backend, json.dumps(result)) for sha1, result in results.items()])
+        self.db.commit()
+
+
+class LocalWikifier(object):
+
+    """Local stand-in for the ES index of wikipedia articles. Scores articles by
+    the tf-idf weighted overlap of their terms with the terms of the text."""
+
+    def __init__(self, index_file):
+        self.name = f'local:{os.path.abspath(index_file)}'
+        self.titles = []
+        self.postings = {}
+        with open(index_file, encoding='utf8') as fh:
+            for line in fh:
+                article = json.loads(line)
+                article_id = len(self.titles)
+                self.titles.append(article['title'])
+                for term, count in Counter(_terms(article['text'])).items():
+                    self.postings.setdefault(term, []).append((article_id, count))
+        self.idf = {term: math.log(len(self.titles) / len(postings))
+                    for term, postings in self.postings.items()}
+
+    def wikify(self, text):
+        scores = Counter()
+        for term, count in Counter(_terms(text)).items():
+            for article_id, article_count in self.postings.get(term, []):
+                scores[article_id] += count * article_count * self.idf[term]
+        return [{'title': self.titles[article_id], 'score': score}
+                for article_id, score in scores.most_common(MAX_RESULTS) if score > 0]
+
+    def wikify_batch(self, texts):
+        return [self.wikify(text) for text in texts]
+
+
+def _terms(text):
+    return [t for t in ''.join(c if c.isalnum() else ' ' for c in text.lower()).split()
+            if len(t) > 2]
+
+
+def wikify_batch(texts, wikifier, executor):
+    """Return the wikification results for a list of texts, in one round trip
+    if the backend supports it."""
+    if hasattr(wikifier, 'wikify_batch'):
+        return wikifier.wikify_batch(texts)
+    return list(executor.map(wikifier.wikify, texts))
+
 
+def find_documents(lif_d):
+    """Generate the names of the document directories in the lif directory."""
+    for entry in os.scandir(lif_d):
+        if entry.name.isnumeric() and entry.is_dir():
+            yield entry.name
 
-def wikify_dir(in_d, wikifier):
+
+def _read_document(job):
+    """Read a LIF file in a worker process and return the document identifier,
+    a LIF object without views (so it is cheap to send back) and the hash of
+    the text."""
+    data_dir, node = job
+    lif = read_lif(data_dir, _fname(node), 'lif').derive()
+    return node, lif, hashlib.sha1(lif.text.value.encode('utf8')).hexdigest()
+
+
+def _fname(node):
+    return pjoin(node, 'tesseract-300dpi-20p.txt')
+
+
+def wikify_dir(in_d, wikifier, processes=1, batch_size=BATCH_SIZE, cache_file=None,
+               backend=None):
+    """Wikify all documents in the lif directory of in_d. The backend is the name
+    used for the wikifier in the cache, it defaults to the name attribute of the
+    wikifier or the name of its class."""
     lif_d = pjoin(in_d, 'lif')
-    wik_d = pjoin(in_d, 'wik')
-    for node in os.listdir(lif_d):
-        if node.isnumeric() and os.path.isdir(pjoin(lif_d, node)):
-            out_d = pjoin(wik_d, node)
-            os.makedirs(out_d, exist_ok=True)
-            out_f = pjoin(out_d, f'{node}.wik.lif')
-            wikify_lif(pjoin(lif_d, node, "tesseract-300dpi-20p.lif"), wikifier).write(fname=out_f, pretty=True)
+    os.makedirs(pjoin(in_d, 'wik'), exist_ok=True)
+    cache = WikificationCache(cache_file or pjoin(in_d, 'wik', 'wikification.db'))
+    if backend is None:
+        backend = getattr(wikifier, 'name', wikifier.__class__.__name__)
+    jobs = ((in_d, node) for node in find_documents(lif_d))
+    counts = Counter()
+    t0 = time.time()
+    with Pool(processes) as pool, ThreadPoolExecutor(batch_size) as executor:
+        batch = []
+        for document in pool.imap_unordered(_read_document, jobs, 4):
+            batch.append(document)
+            if len(batch) == batch_size:
+                _wikify_documents(in_d, batch, wikifier, backend, cache, executor, counts)
+                _log_progress(counts, t0)
+                batch = []
+        if batch:
+            _wikify_documents(in_d, batch, wikifier, backend, cache, executor, counts)
+    _log_progress(counts, t0)
+
+
+def _wikify_documents(in_d, batch, wikifier, backend, cache, executor, counts):
+    cached = cache.get_all([sha1 for node, lif, sha1 in batch], backend)
+    missing = {sha1: lif.text.value for node, lif, sha1 in batch if sha1 not in cached}
+    hashes = list(missing)
+    results = wikify_batch([missing[sha1] for sha1 in hashes], wikifier, executor)
+    cache.add_all(dict(zip(hashes, results)), backend)
+    cached.update(zip(hashes, results))
+    for node, lif, sha1 in batch:
+        out_lif = lif.derive()
+        out_lif.metadata["wikified_es"] = cached[sha1]
+        write_lif(in_d, _fname(node), 'wik', out_lif)
+    counts['documents'] += len(batch)
+    counts['cached'] += len(batch) - len(hashes)
+
+
+def _log_progress(counts, t0):
+    seconds = max(time.time() - t0, 0.000001)
+    print(f"Wikified {counts['documents']} documents, {counts['cached']} from the cache,"
+          f" in {seconds:.2f} seconds ({counts['documents'] / seconds:.2f} documents/sec)")
+    sys.stdout.flush()
 
 
 def wikify_lif(in_f, wikifier):
     in_lif = Container(in_f).payload
-    out_lif = LIF(json_object=in_lif.as_json())
-    out_lif.views = []
+    out_lif = in_lif.derive()
     out_lif.metadata["wikified_es"] = wikifier.wikify(out_lif.text.value)
     return out_lif
 
@@ -49,6 +201,33 @@ if __name__ == '__main__':
         nargs='?',
         help='Directory name where input LIF data live under `lif` subdir. '
     )
+    parser.add_argument(
+        '-p', '--processes',
+        default=1,
+        type=int,
+        help='Number of processes that read LIF files'
+    )
+    parser.add_argument(
+        '-b', '--batch-size',
+        default=BATCH_SIZE,
+        type=int,
+        help='Number of documents sent to the wikifier at once'
+    )
+    parser.add_argument(
+        '--cache',
+        action='store',
+        help='Cache of wikification results, default is INDIR/wik/wikification.db'
+    )
+    parser.add_argument(
+        '--local',
+        action='store',
+        help='Use a local index file instead of Elasticsearch, for testing'
+    )
+    parser.add_argument(
+        '--bundle',
+        action='store_true',
+        help='Add the output to the document bundles'
+    )
     # for testing
     parser.add_argument(
         '-f', '--file',
@@ -58,9 +237,17 @@ if __name__ == '__main__':
         help=''
     )
     args = parser.parse_args()
-    wikifier = by_es.WikifyByES(args.wikiindex)
+    utils.OPTIONS['bundle'] = args.bundle
+    if args.local:
+        wikifier = LocalWikifier(args.local)
+        backend = wikifier.name
+    else:
+        from wikification.wikify import by_es
+        wikifier = by_es.WikifyByES(args.wikiindex)
+        backend = f'es:{args.wikiindex}'
     # test with a single file
     if len(args.file) > 0:
         print(wikify_lif(args.file, wikifier))
     else:
-        wikify_dir(args.indir, wikifier)
+        wikify_dir(args.indir, wikifier, args.processes, args.batch_size, args.cache,
+                   backend)
@@ -1,17 +1,61 @@
 import os
 import sys
 import time
+import json
 import getopt
+import codecs
+from contextlib import contextmanager
 
-from lif import View
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from lif import LIF, View, Bundle, read_file, read_window, load_text
+import metrics
+import profiling
+
+
+# Locations of the results of all processing stages, relative to the data
+# directory, the document identifier is the name of the directory of the file.
+STAGE_FILES = {
+    'lif': 'lif/%(doc)s/tesseract-300dpi-20p.lif',
+    'top': 'top/%(doc)s/tesseract-300dpi-20p.lif',
+    'ttk': 'ttk/%(doc)s/tesseract-300dpi-20p.lif.gz',
+    'spl': 'spl/%(doc)s/%(doc)s.spl.lif',
+    'pos': 'pos/%(doc)s/%(doc)s.pos.lif',
+    'ner': 'ner/%(doc)s/%(doc)s.ner.lif',
+    'sen': 'sen/%(doc)s/%(doc)s.sen.lif',
+    'tex': 'tex/%(doc)s/%(doc)s.lup.lif',
+    'mta': 'mta/%(doc)s/%(doc)s.mta.lif',
+    'wik': 'wik/%(doc)s/%(doc)s.wik.lif'}
+
+# Bundles with the results of all stages, see lif.Bundle.
+BUNDLE_FILE = 'bnd/%(doc)s.zip'
+
+# Options shared by all stages that use get_options(). With --bundle, stages
+# read their input from and write their output to the bundle of a document.
+# With -p, scripts that use mapreduce.py use that number of processes. With
+# --metrics, per-document metrics are appended to that file, see metrics.py.
+# With --profile, every profile_every-th document is profiled, see profiling.py.
+# With --memory, the metrics include the memory used, and --max-size and
+# --max-memory (in megabytes) make process_element() skip documents that are
+# too big or need too much memory.
+OPTIONS = {'bundle': False, 'processes': None, 'metrics': None,
+           'profile': None, 'profile_every': 1,
+           'memory': False, 'max_size': None, 'max_memory': None}
+
+MEGABYTE = 1024 * 1024
 
 
 def time_elapsed(fun):
-    """Function to be used as a decorator for measuring time elapsed."""
+    """Function to be used as a decorator for measuring time elapsed. The wrapper
+    returns what the wrapped function returns."""
     def wrapper(*args, **kwargs):
         t0 = time.time()
-        fun(*args, **kwargs)
+        result = fun(*args, **kwargs)
         print("\nTime elapsed = %s" % (time.time() - t0))
+        return result
     return wrapper
 
 
@@ -22,15 +66,103 @@ def process_list(data_dir, filelist, start, end, crash, fun):
     that list, and a function to be applied to the data directory and a relative
     path from the list."""
     print("$ python3 %s\n" % ' '.join(sys.argv))
-    for n, fname in elements(filelist, start, end):
-        print_element(n, fname)
+    start_metrics()
+    start_profiling()
+    try:
+        for n, fname in elements(filelist, start, end):
+            print_element(n, fname)
+            process_element(data_dir, fname, crash, fun)
+    finally:
+        metrics.close_metrics()
+
+
+def process_element(data_dir, fname, crash, fun, stage=None):
+    """Apply fun to the data directory and fname, recording the metrics and the
+    profile of the document for stage, which defaults to the name of fun. Errors
+    are printed unless crash is True. Documents bigger than the --max-size are
+    skipped, and so are documents that need more than --max-memory, these are
+    not errors, they are logged and the metrics record why they were skipped."""
+    stage = stage or fun.__name__
+    try:
+        with metrics.document(stage, docid(fname)), profiling.document(stage):
+            process_guarded(data_dir, fname, fun)
+    except Exception as e:
         if crash:
+            raise
+        print('ERROR:', Exception, e)
+
+
+def process_guarded(data_dir, fname, fun):
+    """Apply fun to the data directory and fname, unless the document is bigger
+    than --max-size, and with the memory limit of --max-memory."""
+    if is_oversized(data_dir, fname):
+        skip_document(fname, 'size', "is larger than %dMB" % OPTIONS['max_size'])
+        return
+    try:
+        with memory_limit(OPTIONS['max_memory']):
             fun(data_dir, fname)
+    except MemoryError:
+        if OPTIONS['max_memory'] is None:
+            raise
+        skip_document(fname, 'memory', "needs more than %dMB" % OPTIONS['max_memory'])
+
+
+def skip_document(fname, reason, message):
+    print('SKIPPED: %s %s' % (fname, message))
+    metrics.mark('skipped', reason)
+
+
+def document_size(data_dir, fname):
+    """Return the size of the lif file of a document in bytes, or the size of its
+    bundle in bundle mode."""
+    if OPTIONS['bundle']:
+        return metrics.file_size(bundle_file(data_dir, fname))
+    return metrics.file_size(stage_file(data_dir, fname, 'lif'))
+
+
+def is_oversized(data_dir, fname):
+    return (OPTIONS['max_size'] is not None
+            and document_size(data_dir, fname) > OPTIONS['max_size'] * MEGABYTE)
+
+
+@contextmanager
+def memory_limit(megabytes):
+    """Limit the memory that can be allocated in the body to this many megabytes
+    more than what the process uses now, exceeding it raises a MemoryError. What
+    is limited is the address space (RLIMIT_AS), which is the only memory limit
+    that Linux enforces, it is larger than the RSS. Does nothing if megabytes is
+    None or the limit cannot be set."""
+    size = metrics.virtual_size()
+    if megabytes is None or resource is None or size is None:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = size + megabytes * MEGABYTE
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def start_metrics():
+    """Open the metrics file if one was given with --metrics and start tracing
+    memory if --memory was given."""
+    if OPTIONS['metrics'] is not None:
+        metrics.open_metrics(OPTIONS['metrics'])
+    if OPTIONS['memory']:
+        if OPTIONS['metrics'] is None:
+            print("WARNING: --memory is ignored without --metrics")
         else:
-            try:
-                fun(data_dir, fname)
-            except Exception as e:
-                print('ERROR:', Exception, e)
+            metrics.trace_memory()
+
+
+def start_profiling():
+    """Start profiling if a directory was given with --profile."""
+    if OPTIONS['profile'] is not None:
+        profiling.start_profiling(OPTIONS['profile'], OPTIONS['profile_every'])
 
 
 def elements(filelist, start, end):
@@ -63,16 +195,118 @@ def ensure_directory(*fnames):
 
 
 def get_options():
-    """Default method for getting options."""
-    options = dict(getopt.getopt(sys.argv[1:], 'd:f:b:e:', ['crash'])[0])
+    """Default method for getting options. Options that are not returned are
+    stored in OPTIONS."""
+    options = dict(getopt.getopt(sys.argv[1:], 'd:f:b:e:p:',
+                                 ['crash', 'bundle', 'metrics=', 'profile=',
+                                  'profile-every=', 'memory', 'max-size=',
+                                  'max-memory='])[0])
     data_dir = options.get('-d')
     filelist = options.get('-f', 'files-random.txt')
     start = int(options.get('-b', 1))
     end = int(options.get('-e', 1))
     crash = True if '--crash' in options else False
+    OPTIONS['bundle'] = True if '--bundle' in options else False
+    OPTIONS['processes'] = int(options['-p']) if '-p' in options else None
+    OPTIONS['metrics'] = options.get('--metrics')
+    OPTIONS['profile'] = options.get('--profile')
+    OPTIONS['profile_every'] = int(options.get('--profile-every', 1))
+    OPTIONS['memory'] = True if '--memory' in options else False
+    OPTIONS['max_size'] = int(options['--max-size']) if '--max-size' in options else None
+    OPTIONS['max_memory'] = int(options['--max-memory']) if '--max-memory' in options else None
     return data_dir, filelist, start, end, crash
 
 
+def docid(fname):
+    """Return the document identifier of a file name from the file list."""
+    return os.path.split(fname)[0]
+
+
+def stage_file(data_dir, fname, stage):
+    """Return the path to the output of a processing stage for a file name from the
+    file list."""
+    return os.path.join(data_dir, STAGE_FILES[stage] % {'doc': docid(fname)})
+
+
+def bundle_file(data_dir, fname):
+    return os.path.join(data_dir, BUNDLE_FILE % {'doc': docid(fname)})
+
+
+def read_lif(data_dir, fname, stage, with_text=True):
+    """Return the LIF object for a stage. In bundle mode this is taken from the
+    bundle if the bundle has the stage, otherwise it is taken from the stage
+    file, which may contain a LIF object or a Container. The with_text flag is
+    only used for bundles, where not adding the text saves reading it."""
+    with metrics.phase('parse'):
+        if OPTIONS['bundle']:
+            bundle = Bundle(bundle_file(data_dir, fname))
+            if bundle.has_stage(stage):
+                return bundle.get_lif(stage, with_text=with_text)
+        lif_file = stage_file(data_dir, fname, stage)
+        metrics.count('bytes_in', metrics.file_size(lif_file))
+        json_obj = json.loads(read_file(lif_file))
+        return LIF(json_object=json_obj.get('payload', json_obj),
+                   base_dir=os.path.dirname(lif_file))
+
+
+def read_lif_window(data_dir, fname, stage, end, ranks):
+    """Return the LIF object for a stage with only the views at the given ranks
+    and only with the annotations up to the first one that ends after end, see
+    lif.read_window(). In bundle mode the whole LIF object is read from the
+    bundle and the views are selected from it."""
+    with metrics.phase('parse'):
+        if OPTIONS['bundle']:
+            bundle = Bundle(bundle_file(data_dir, fname))
+            if bundle.has_stage(stage):
+                lif = bundle.get_lif(stage)
+                lif.views = [lif.views[rank] for rank in sorted(ranks)]
+                return lif
+        return read_window(stage_file(data_dir, fname, stage), end, ranks)
+
+
+def has_lif(data_dir, fname, stage):
+    if OPTIONS['bundle'] and Bundle(bundle_file(data_dir, fname)).has_stage(stage):
+        return True
+    return os.path.exists(stage_file(data_dir, fname, stage))
+
+
+def write_lif(data_dir, fname, stage, lif_obj):
+    """Write the LIF object for a stage, either to the stage file or, in bundle
+    mode, to the bundle. Stages other than the lif stage normally have the same
+    text as the lif stage, their text is then written as a reference to the lif
+    file, otherwise it is kept inline."""
+    with metrics.phase('write'):
+        if OPTIONS['bundle']:
+            bundle = Bundle(bundle_file(data_dir, fname))
+            ensure_directory(bundle.fname)
+            bundle.add(stage, lif_obj)
+        else:
+            out_file = stage_file(data_dir, fname, stage)
+            ensure_directory(out_file)
+            if stage != 'lif' and not lif_obj.text.is_reference():
+                lif_file = stage_file(data_dir, fname, 'lif')
+                if os.path.exists(lif_file) and lif_obj.text.value == load_text(lif_file):
+                    lif_obj.text.refer_to(lif_file)
+            lif_obj.write(fname=out_file, pretty=True)
+            metrics.count('bytes_out', metrics.file_size(out_file))
+
+
+class LazyFile(object):
+
+    """A file that is opened for writing when something is first written to it,
+    used for debugging output so that importing a module does not create or
+    truncate files."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.fh = None
+
+    def write(self, text):
+        if self.fh is None:
+            self.fh = codecs.open(self.fname, 'w', encoding='utf8')
+        self.fh.write(text)
+
+
 def create_view(identifier, tag, producer):
     vocab_url = 'http://vocab.lappsgrid.org/%s' % tag
     view_spec = {
@@ -0,0 +1,171 @@
+"""bench_vnc_to_lif.py
+
+Throughput of vnc_to_lif.py.
+
+Usage:
+
+$ python3 benchmarks/bench_vnc_to_lif.py (-n FILES) (-k KILOBYTES) (-p PROCESSES)
+
+Run this from the dtriac-534 directory. Creates FILES pairs of a text file of
+about KILOBYTES kilobytes and clearwsd output for it in a temporary directory,
+then converts them with generate_lif() as it was before it was made to stream,
+with the current generate_lif() and with convert_dir() using PROCESSES worker
+processes, and checks that all create the same LIF objects.
+
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import random
+import getopt
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lif import LIF, Annotation, View, Container
+from vnc_to_lif import generate_lif, convert_dir, vocab
+
+
+def old_generate_lif(txt, vnc):
+    """generate_lif() as it was before it was made to stream."""
+    t = open(txt, encoding="utf-8")
+    v = open(vnc, encoding="utf-8")
+    lif_obj = LIF()
+    cont_obj = Container()
+    cont_obj.discriminator = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
+    cont_obj.payload = lif_obj
+    raw_text = t.read()
+    t.close()
+    lif_obj.text.value = raw_text
+    vnc_view = View()
+    lif_obj.views.append(vnc_view)
+    vnc_view.id = "verbnettag"
+    vnc_view.metadata['contains'] = { vocab('SemanticTag'): {}}
+    annotations = [line for line in v if line.startswith('#')]
+    v.close()
+    for annotation in annotations:
+        splitted = annotation.split('\t')[0].split()
+        oid = splitted[1]
+        otoken =  splitted[3]
+        olemma =  " ".join(splitted[4:-1])
+        olabel = splitted[-1]
+        properly_annotated = re.match(r'\d+\[(\d+),(\d+)\]', otoken)
+        if properly_annotated is None:
+            continue
+        s, e = map(int, properly_annotated.groups())
+        ann = {"id": "vnc_" + oid, "start": s, "end": e, "@type": vocab("SemanticTag"),
+               "features": { "tags": [olabel], "type": "VerbNetClass",
+                             "lemma": olemma, "text": raw_text[s:e]}}
+        vnc_view.annotations.append(Annotation(ann))
+    cont_obj.write()
+
+
+VERBS = [('runs', 'run', 'run-51.3.2'), ('ate', 'eat', 'eat-39.1'),
+         ('went', 'go', 'escape-51.1'), ('picked', 'pick up', 'get-13.5.1')]
+WORDS = ['the', 'army', 'report', 'test', 'été', 'facility']
+
+
+def create_data(directory, files, kilobytes):
+    rnd = random.Random(42)
+    os.makedirs(os.path.join(directory, 'vnc'))
+    for n in range(files):
+        text = io.StringIO()
+        lines = []
+        offset = 0
+        token = 0
+        while offset < kilobytes * 1000:
+            sentence = []
+            for i in range(rnd.randint(5, 25)):
+                if rnd.random() < 0.15:
+                    word, lemma, label = rnd.choice(VERBS)
+                    lines.append("# %d %d %d[%d,%d] %s %s\tV\n"
+                                 % (token, len(sentence), token, offset, offset + len(word),
+                                    lemma, label))
+                else:
+                    word = rnd.choice(WORDS)
+                lines.append("%d\t%s\t_\tNN\n" % (token, word))
+                text.write(word + ' ')
+                offset += len(word) + 1
+                token += 1
+            lines.append("\n")
+        name = "%04d.txt" % n
+        with open(os.path.join(directory, name), 'w', encoding='utf8') as fh:
+            fh.write(text.getvalue())
+        with open(os.path.join(directory, 'vnc', name), 'w', encoding='utf8') as fh:
+            fh.write(''.join(lines))
+
+
+def run_old(directory, names):
+    stdout = sys.stdout
+    outputs = []
+    try:
+        for name in names:
+            sys.stdout = io.StringIO()
+            old_generate_lif(os.path.join(directory, name), os.path.join(directory, 'vnc', name))
+            outputs.append(sys.stdout.getvalue())
+    finally:
+        sys.stdout = stdout
+    return outputs
+
+
+def run_new(directory, names):
+    outputs = []
+    for name in names:
+        out = io.StringIO()
+        generate_lif(os.path.join(directory, name), os.path.join(directory, 'vnc', name), out)
+        outputs.append(out.getvalue())
+    return outputs
+
+
+def run_batch(directory, names, processes):
+    convert_dir(directory, os.path.join(directory, 'vnc'), os.path.join(directory, 'lif'),
+                processes)
+    return [os.path.join(directory, 'lif', name + '.lif') for name in names]
+
+
+def read_batch(lif_files):
+    outputs = []
+    for lif_file in lif_files:
+        with open(lif_file, encoding='utf8') as fh:
+            outputs.append(fh.read())
+    return outputs
+
+
+def measure(label, fun, megabytes):
+    t0 = time.time()
+    outputs = fun()
+    seconds = time.time() - t0
+    print("%-22s  %8.2fs  %8.1f MB/sec" % (label, seconds, megabytes / seconds))
+    return outputs
+
+
+def same(outputs1, outputs2):
+    return [json.loads(o) for o in outputs1] == [json.loads(o) for o in outputs2]
+
+
+if __name__ == '__main__':
+
+    options = dict(getopt.getopt(sys.argv[1:], 'n:k:p:')[0])
+    files = int(options.get('-n', 40))
+    kilobytes = int(options.get('-k', 500))
+    processes = int(options.get('-p', 4))
+    directory = tempfile.mkdtemp()
+    try:
+        create_data(directory, files, kilobytes)
+        names = sorted(n for n in os.listdir(directory) if n.endswith('.txt'))
+        megabytes = sum(os.path.getsize(os.path.join(directory, 'vnc', n))
+                        for n in names) / 1000000.0
+        print("\n%d files with %.1f MB of clearwsd output\n" % (files, megabytes))
+        expected = measure('before', lambda: run_old(directory, names), megabytes)
+        outputs = measure('streaming', lambda: run_new(directory, names), megabytes)
+        batch = measure('batch, %d processes' % processes,
+                        lambda: run_batch(directory, names, processes), megabytes)
+        print("\nSame LIF objects: %s\n"
+              % (same(expected, outputs) and same(expected, read_batch(batch))))
+    finally:
+        shutil.rmtree(directory)
@@ -1,16 +1,45 @@
 #! /usr/bin/env python
+"""build_vnc_dict.py
+
+Build the verbnet class dictionary used for query expansion.
+
+Usage:
+
+$ python build_vnc_dict.py (-p PROCESSES) (-o TABLE) (--update) (--json) LIF_DIR ...
+
+Reads the LIF files in all LIF_DIRs (for example one directory per shard of the
+corpus) with PROCESSES worker processes and writes the dictionary to TABLE, by
+default vnc_dict.tbl, a sorted table that can be memory mapped (see
+sorted_table.py and load_dict()). With --update the classes found are added to
+those already in TABLE, so the dictionary can be updated from new files only,
+adding files that were added before does not change the dictionary. With --json
+the dictionary is also written to standard output as a JSON object.
+
+"""
+
 import os
 import sys
 import json
-import lif
+import getopt
+
+from lif import read_file
+from mapreduce import map_reduce, PROCESSES
+from sorted_table import SortedTable, write_table
+
+
+VNC_TABLE = 'vnc_dict.tbl'
+
+# Separator of the classes of a verb in the table.
+CLASS_SEPARATOR = ' '
 
 
-def create_dict(lif_dir):
+def create_dict(lif_dirs, processes=PROCESSES, verbnettags=None):
     """
-    Create a verbnet class dictionary, given a directory of LIF json files
+    Create a verbnet class dictionary, given directories of LIF json files
     The dictionary will record all verb instances annotated with
-    "SemanticTag (type: VerbNetClass)" in *.lif files inside the directory.
-    The dictionary will be printed out as a JSON string ito STDOUT.
+    "SemanticTag (type: VerbNetClass)" in *.lif files inside the directories.
+    Files are read by a pool of processes, see mapreduce.py, and the classes
+    are added to the sets in verbnettags if it is given.
     It is supposed to be used as an external resource for query expansion
     in the flask web app that interacts with elastic indices."
     """
@@ -20,26 +49,65 @@ def create_dict(lif_dir):
     # In most cases, only a single class is associated with a verb.
     # Also don't forget to add the lemma of a verb even the lemma form was never found in the corpus
     # so that a search query with the lemma form can refer to the verbnet class dict.
+    fnames = [os.path.join(lif_dir, f)
+              for lif_dir in lif_dirs for f in os.listdir(lif_dir) if f.endswith(".lif")]
+    found = map_reduce(file_tags, fnames, processes=processes) or {}
+    if verbnettags is None:
+        return found
+    for key, tags in found.items():
+        verbnettags.setdefault(key, set()).update(tags)
+    return verbnettags
+
+
+def file_tags(lif_filename):
+    """Return a dictionary with the set of verbnet classes of each verb and lemma
+    in a LIF file, reading the JSON without creating a LIF object."""
     verbnettags = {}
+    lif_obj = json.loads(read_file(lif_filename))['payload']
+    for view in lif_obj['views']:
+        if view['id'].startswith("verbnet") and "http://vocab.lappsgrid.org/SemanticTag" in view['metadata']['contains']:
+            for annotation in view['annotations']:
+                text = annotation['features']['text']
+                lemma = annotation['features']['lemma']
+                vnc = annotation['features']['tags'][0]
+                if vnc != "None":
+                    for key in (text, lemma):
+                        verbnettags.setdefault(key, set()).add(vnc)
+    return verbnettags
+
+
+def write_dict(verbnettags, table_file=VNC_TABLE):
+    write_table(table_file, dict((key, CLASS_SEPARATOR.join(sorted(tags)))
+                                 for key, tags in verbnettags.items()))
+
 
-    for lif_filename in (f for f in os.listdir(lif_dir) if f.endswith(".lif")):
-        cont = lif.Container(os.path.join(lif_dir, lif_filename), None, None)
-        lif_obj = cont.payload
-        for view in lif_obj.views:
-            if view.id.startswith("verbnet") and "http://vocab.lappsgrid.org/SemanticTag" in view.metadata['contains']:
-                for annotation in view.annotations:
-                    text = annotation.features['text']
-                    lemma = annotation.features['lemma']
-                    vnc = annotation.features['tags'][0]
-                    if vnc != "None":
-                        for key in (text, lemma):
-                            tags = verbnettags.get(key, [])
-                            if vnc not in tags:
-                                tags.append(vnc)
-                            verbnettags[key] = tags
-    sys.stdout.write(json.dumps(verbnettags, indent=2))
+def read_dict(table_file=VNC_TABLE):
+    """Return the dictionary in a table as a dictionary of sets."""
+    return dict((key, set(value.split(CLASS_SEPARATOR)))
+                for key, value in SortedTable(table_file).items())
+
+
+def load_dict(table_file=VNC_TABLE):
+    """Return the table for lookups with lookup(), without reading it."""
+    return SortedTable(table_file)
+
+
+def lookup(table, verb):
+    """Return the sorted list of verbnet classes of a verb or lemma."""
+    value = table.get(verb)
+    return [] if value is None else value.split(CLASS_SEPARATOR)
 
 
 if __name__ == "__main__":
-    lif_dir = sys.argv[1]
-    create_dict(lif_dir)
\ No newline at end of file
+
+    opts, args = getopt.getopt(sys.argv[1:], 'p:o:', ['update', 'json'])
+    options = dict(opts)
+    table_file = options.get('-o', VNC_TABLE)
+    verbnettags = None
+    if '--update' in options and os.path.exists(table_file):
+        verbnettags = read_dict(table_file)
+    verbnettags = create_dict(args, int(options.get('-p', PROCESSES)), verbnettags)
+    write_dict(verbnettags, table_file)
+    if '--json' in options:
+        sys.stdout.write(json.dumps(dict((key, sorted(tags)) for key, tags in verbnettags.items()),
+                                    indent=2, sort_keys=True))
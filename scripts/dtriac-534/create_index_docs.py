@@ -5,7 +5,9 @@ into ElasticSearch.
 
 Usage:
 
-$ python create_index_docs.py LIF NER TEX TTK SEN REL VNC TOP ELA
+$ python create_index_docs.py (--sentences) (-p PROCESSES)
+      (--metrics METRICS_FILE (--memory)) (--profile DIRECTORY (--profile-every N))
+      (--max-size MB) (--max-memory MB) LIF NER TEX TTK SEN REL VNC TOP ELA
 
 The first eight arguments are all the input directories with the following
 content:
@@ -19,30 +21,51 @@ REL - Result of adding ReVerb analysis to LIF
 VNC - Result of adding verbnet classes to LIF
 TOP - Result of adding topics to LIF
 
-The ELA argument refers to the output directory.
+The ELA argument refers to the output directory. Documents are written to
+ELA/documents, one JSON file per document. With --sentences a document is also
+created for each sentence, these are written to ELA/sentences in NDJSON files in
+the format of the Elasticsearch bulk API, with SHARD_SIZE sentences per file,
+which can be loaded with load_index.py. Documents are created by PROCESSES
+worker processes, the default is one process. With --metrics the time spent on
+each document and the sizes of its input and output are appended to
+METRICS_FILE, with --memory also the memory it allocated, see metrics.py. With
+--profile every Nth document is profiled and the statistics are written to
+DIRECTORY, see profiling.py. Documents whose LIF file is larger than --max-size
+or that need more memory than --max-memory are skipped, see guards.py.
 
 See create_index_docs.sh for example invocations.
 
 """
 
-import os, sys, re, codecs, json, pickle, time, datetime
+import os, sys, re, codecs, json, pickle, time, datetime, getopt
 import traceback
+from multiprocessing import Pool
 from pprint import pformat
 from collections import Counter
 
 from lif import LIF, Container, Annotation
+import metrics
+import profiling
+import guards
 
 
 TECHNOLOGY_LIST = 'technologies.txt'
 
+# Maximum number of sentences in an NDJSON file with sentence documents.
+SHARD_SIZE = 10000
 
-def create_documents(lif, ner, tex, ttk, sen, rel, vnc, top, ela):
+# The annotation types that are added to the index of each document element.
+INDEXED_FIELDS = ('technologies', 'persons', 'locations', 'organizations', 'events', 'times')
+
+
+def create_documents(lif, ner, tex, ttk, sen, rel, vnc, top, ela,
+                     sentences=False, processes=1):
 
     """Read all the lif files generate for a document and create JSON files for
-    documents, sections and sentences."""
+    documents and, if sentences is True, sentences."""
 
-    ontology = TechnologyOntology()
     fnames = [fname for fname in os.listdir(lif)]
+    jobs = []
 
     for fname in sorted(fnames):
 
@@ -50,38 +73,108 @@ def create_documents(lif, ner, tex, ttk, sen, rel, vnc, top, ela):
         #if fname.startswith('9'): break
         #if fname.startswith('D'): break
 
-        try:
-            lif_file = os.path.join(lif, fname)
-            ner_file = os.path.join(ner, fname)
-            tex_file = os.path.join(tex, fname)
-            ttk_file = os.path.join(ttk, fname)
-            sen_file = os.path.join(sen, fname)
-            rel_file = os.path.join(rel, fname)
-            vnc_file = os.path.join(vnc, fname)
-            top_file = os.path.join(top, fname)
-
-            if not (os.path.exists(ner_file) and os.path.exists(tex_file)
-                    and os.path.exists(ttk_file) and os.path.exists(sen_file)
-                    and os.path.exists(rel_file) and os.path.exists(vnc_file)
-                    and os.path.exists(top_file)):
-                print('Skipping...  %s' % fname)
-                continue
-
-            Sentence.ID = 0
-            doc = Document(fname, lif_file, ner_file, tex_file, ttk_file,
-                           sen_file, rel_file,vnc_file, top_file, ontology)
-            print("%04d  %s" % (doc.id, doc.fname))
-            doc.write(os.path.join(ela, 'documents'))
-            #sentences_dir = os.path.join(ela, 'sentences', "%04d" % doc.id)
-            #if not os.path.exists(sentences_dir):
-            #    os.makedirs(sentences_dir)
-            #for sentence in doc.get_sentences():
-            #    sentence.write(sentences_dir)
-
-        except Exception as e:
+        files = [os.path.join(directory, fname)
+                 for directory in (lif, ner, tex, ttk, sen, rel, vnc, top)]
+        if not all(os.path.exists(f) for f in files[1:]):
+            print('Skipping...  %s' % fname)
+            continue
+        # document identifiers are handed out here so that they do not depend on
+        # the order in which the workers finish
+        jobs.append([Document.new_id(), fname] + files + [ela, sentences])
+
+    shards = SentenceShards(os.path.join(ela, 'sentences')) if sentences else None
+    pool = Pool(processes) if processes > 1 else None
+    results = pool.imap(_create_document, jobs) if pool else map(_create_document, jobs)
+    for docid, fname, bulk_lines, error in results:
+        print("%04d  %s" % (docid, fname))
+        if error is not None:
             print("\nERROR on '%s'" % fname)
-            traceback.print_exc()
-            print('')
+            print(error)
+        elif shards is not None:
+            shards.add(bulk_lines)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if shards is not None:
+        shards.close()
+
+
+_ONTOLOGY = None
+
+
+def _create_document(job):
+    """Create and write the document for a file and return its identifier, the
+    file name, the sentences in the format of the bulk API and the error, if
+    there was one. This runs in a worker process if there is more than one."""
+    global _ONTOLOGY
+    docid, fname, lif_file = job[:3]
+    try:
+        if _ONTOLOGY is None:
+            _ONTOLOGY = TechnologyOntology()
+        with metrics.document('create_index_docs', fname), \
+             profiling.document('create_index_docs'):
+            bulk_lines = guards.process_guarded(fname, lif_file, _write_document, job)
+        return docid, fname, bulk_lines or [], None
+    except Exception:
+        return docid, fname, [], traceback.format_exc()
+
+
+def _write_document(job):
+    """Create the document for a job, write it to ELA/documents and return the
+    sentences in the format of the bulk API."""
+    docid, fname = job[:2]
+    lif_file, ner_file, tex_file, ttk_file, sen_file, rel_file, vnc_file, top_file = job[2:10]
+    ela, sentences = job[10:]
+    for input_file in job[2:10]:
+        metrics.count('bytes_in', metrics.file_size(input_file))
+    Sentence.ID = 0
+    doc = Document(fname, lif_file, ner_file, tex_file, ttk_file,
+                   sen_file, rel_file, vnc_file, top_file, _ONTOLOGY, docid)
+    documents_dir = os.path.join(ela, 'documents')
+    with metrics.phase('write'):
+        doc.write(documents_dir)
+    metrics.count('bytes_out', metrics.file_size(doc.json_file(documents_dir)))
+    return [s.bulk_lines() for s in doc.get_sentences()] if sentences else []
+
+
+class SentenceShards(object):
+
+    """Writes sentence documents to NDJSON files in the format of the bulk API
+    of Elasticsearch, named sentences-0001.ndjson, sentences-0002.ndjson and so
+    on, with at most shard_size sentences in each file. Shards left in the
+    directory by an earlier run are removed, otherwise load_index.py would also
+    load them."""
+
+    def __init__(self, directory, shard_size=SHARD_SIZE):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for fname in os.listdir(directory):
+            if fname.startswith('sentences-') and fname.endswith('.ndjson'):
+                os.remove(os.path.join(directory, fname))
+        self.directory = directory
+        self.shard_size = shard_size
+        self.shards = 0
+        self.count = 0
+        self.fh = None
+
+    def add(self, bulk_lines):
+        for lines in bulk_lines:
+            if self.fh is None or self.count == self.shard_size:
+                self._next_shard()
+            self.fh.write(lines)
+            self.count += 1
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def _next_shard(self):
+        self.close()
+        self.shards += 1
+        self.count = 0
+        fname = os.path.join(self.directory, "sentences-%04d.ndjson" % self.shards)
+        self.fh = codecs.open(fname, 'w', encoding='utf8')
 
 
 class TechnologyOntology(object):
@@ -116,15 +209,16 @@ class Document(object):
     def __init__(self,
                  fname, lif_file, ner_file, tex_file,
                  ttk_file, sen_file, rel_file, vnc_file, top_file,
-                 ontology):
+                 ontology, docid=None):
         """Build a single LIF object with all relevant annotations. The annotations
         themselves are stored in the Annotations object in self.annotations."""
-        self.id = Document.new_id()
+        self.id = Document.new_id() if docid is None else docid
         self.fname = fname
         self.ontology = ontology
-        self.lif = Container(lif_file).payload
-        self._add_views(ner_file, tex_file, ttk_file, sen_file, rel_file,
-                        vnc_file, top_file)
+        with metrics.phase('parse'):
+            self.lif = Container(lif_file).payload
+            self._add_views(ner_file, tex_file, ttk_file, sen_file, rel_file,
+                            vnc_file, top_file)
         self.lif.metadata["filename"] = self.fname
         self.lif.metadata["title"] = self._get_title()
         self.lif.metadata["year"] = self._get_year()
@@ -357,12 +451,22 @@ class Document(object):
         # take the sentences view, it has the sentences copied from the ttk
         # view, but with the type (normal vs crap) added
         view = self.get_view("sen")
-        sentences = [a for a in view.annotations if a.type.endswith('Sentence')]
-        return [Sentence(self, s) for s in sentences
-                if s.features.get('type') == 'normal']
+        sentences = [a for a in view.annotations if a.type.endswith('Sentence')
+                     and a.features.get('type') == 'normal']
+        # hand out the annotations to the sentences in one go instead of having
+        # each sentence filter all annotations
+        idx = self.annotations
+        assigned = dict((field, assign(sentences, getattr(idx, field).annotations))
+                        for field in INDEXED_FIELDS)
+        assigned['relations'] = assign(sentences, idx.relations)
+        return [Sentence(self, s, dict((field, assigned[field][i]) for field in assigned))
+                for i, s in enumerate(sentences)]
+
+    def json_file(self, dirname):
+        return os.path.join(dirname, "%04d.json" % self.id)
 
     def write(self, dirname):
-        self.annotations.write(os.path.join(dirname, "%04d.json" % self.id),
+        self.annotations.write(self.json_file(dirname),
                                self.lif.metadata["title"],
                                self.lif.metadata["year"],
                                self.lif.metadata["abstract"])
@@ -438,18 +542,25 @@ class Relation(object):
 
 class DocumentElement(object):
 
-    def create_index(self):
+    def create_index(self, annotations=None):
+        """Create the index for the element. The annotations are a dictionary with
+        the annotations in the element for each of the INDEXED_FIELDS and for the
+        relations, if not given they are selected from the document index."""
         idx = self.document.annotations
+        if annotations is None:
+            annotations = self.select(idx)
         self.annotations = Annotations(self.document.fname, self.document, self.docid, self.id)
         self.annotations.text = idx.text[self.start:self.end]
         self.annotations.authors = idx.authors
-        self.annotations.technologies.add_all(self.filter(idx.technologies.annotations))
-        self.annotations.persons.add_all(self.filter(idx.persons.annotations))
-        self.annotations.locations.add_all(self.filter(idx.locations.annotations))
-        self.annotations.organizations.add_all(self.filter(idx.organizations.annotations))
-        self.annotations.events.add_all(self.filter(idx.events.annotations))
-        self.annotations.times.add_all(self.filter(idx.times.annotations))
-        self.annotations.relations = self.filter(idx.relations)
+        for field in INDEXED_FIELDS:
+            getattr(self.annotations, field).add_all(annotations[field])
+        self.annotations.relations = annotations['relations']
+
+    def select(self, idx):
+        annotations = dict((field, self.filter(getattr(idx, field).annotations))
+                           for field in INDEXED_FIELDS)
+        annotations['relations'] = self.filter(idx.relations)
+        return annotations
 
     def filter(self, annotations):
         answer = []
@@ -468,7 +579,7 @@ class Sentence(DocumentElement):
 
     ID = 0
 
-    def __init__(self, document, sentence):
+    def __init__(self, document, sentence, annotations=None):
         Sentence.ID += 1
         self.id = Sentence.ID
         self.docid = document.id
@@ -476,7 +587,7 @@ class Sentence(DocumentElement):
         self.start = sentence.start
         self.end = sentence.end
         self.tag = sentence
-        self.create_index()
+        self.create_index(annotations)
 
     def __str__(self):
         return "<Sentence %04d:%04d %d-%d %s>" % \
@@ -486,6 +597,12 @@ class Sentence(DocumentElement):
         output_file = os.path.join(output_dir, "%04d-%04d.json" % (self.docid, self.id))
         self.annotations.write_sentence(output_file)
 
+    def bulk_lines(self):
+        """Return the action and the document for the bulk API, as two lines."""
+        json_object = self.annotations.sentence_json()
+        return "%s\n%s\n" % (json.dumps({"index": {"_id": json_object["docid"]}}),
+                               json.dumps(json_object, sort_keys=True))
+
     def pp(self):
         print(self)
 
@@ -553,6 +670,10 @@ class Annotations(object):
 
     def write_sentence(self, fname):
         """Writes the sentence document with the search fields to a json file."""
+        with codecs.open(fname, 'w', encoding='utf8') as fh:
+            fh.write(json.dumps(self.sentence_json(), sort_keys=True, indent=4))
+
+    def sentence_json(self):
         json_object = { "text": self.text, "docid": self.docid }
         for (field, value) in [
                 ("technology", self.technologies.get_condensed_annotations()),
@@ -563,8 +684,7 @@ class Annotations(object):
                 ("time", self.times.get_condensed_annotations()),
                 ("relation", [self.relation_dict(r) for r in self.relations])]:
             _add_value(json_object, field, value)
-        with codecs.open(fname, 'w', encoding='utf8') as fh:
-            fh.write(json.dumps(json_object, sort_keys=True, indent=4))
+        return json_object
 
     def write_index(self, fname):
         """Writes the text, the offset index and the lemma index to a pickle
@@ -698,6 +818,30 @@ class IndexedAnnotations(object):
         return True
 
 
+def assign(elements, annotations):
+    """Return for each element the list of annotations that it contains, in the
+    order of the annotations. Annotations and elements both have start and end
+    offsets. This takes one sweep over the annotations sorted on their start
+    offsets, where for each annotation only the elements that start before it
+    and do not end before it are looked at, which for elements that do not
+    overlap, like sentences, are at most a few."""
+    elements_order = sorted(range(len(elements)), key=lambda i: elements[i].start)
+    buckets = [[] for element in elements]
+    first = 0
+    for i in sorted(range(len(annotations)), key=lambda i: annotations[i].start):
+        annotation = annotations[i]
+        while (first < len(elements_order)
+               and elements[elements_order[first]].end < annotation.start):
+            first += 1
+        j = first
+        while (j < len(elements_order)
+               and elements[elements_order[j]].start <= annotation.start):
+            if annotation.end <= elements[elements_order[j]].end:
+                buckets[elements_order[j]].append(i)
+            j += 1
+    return [[annotations[i] for i in sorted(bucket)] for bucket in buckets]
+
+
 def _add_value(json_object, field, value):
     """Add a value to a json object (implemented as a Python dictionary), but only
     if that value is not empty."""
@@ -707,5 +851,20 @@ def _add_value(json_object, field, value):
 
 if __name__ == '__main__':
 
-    lif, ner, tex, ttk, sen, rel, vnc, top, ela = sys.argv[1:10]
-    create_documents(lif, ner, tex, ttk, sen, rel, vnc, top, ela)
+    opts, args = getopt.getopt(sys.argv[1:], 'p:',
+                               ['sentences', 'metrics=', 'memory', 'profile=',
+                                'profile-every=', 'max-size=', 'max-memory='])
+    options = dict(opts)
+    lif, ner, tex, ttk, sen, rel, vnc, top, ela = args[:9]
+    if '--metrics' in options:
+        metrics.open_metrics(options['--metrics'])
+        if '--memory' in options:
+            metrics.trace_memory()
+    guards.set_limits(options.get('--max-size'), options.get('--max-memory'))
+    if '--profile' in options:
+        profiling.start_profiling(options['--profile'], int(options.get('--profile-every', 1)))
+    try:
+        create_documents(lif, ner, tex, ttk, sen, rel, vnc, top, ela,
+                         '--sentences' in options, int(options.get('-p', 1)))
+    finally:
+        metrics.close_metrics()
@@ -27,5 +27,5 @@ else
     ela=$repo/samples/small-25-ela
 fi
 
-echo $ python3 create_index_docs.py $lif $ner $tex $ttk $sen $rel $vnc $top $ela
-python3 create_index_docs.py $lif $ner $tex $ttk $sen $rel $vnc $top $ela
+echo $ python3 create_index_docs.py --sentences $lif $ner $tex $ttk $sen $rel $vnc $top $ela
+python3 create_index_docs.py --sentences $lif $ner $tex $ttk $sen $rel $vnc $top $ela
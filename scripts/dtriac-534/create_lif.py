@@ -5,9 +5,27 @@ Create LIF files from the Science Parse output.
 Usage:
 
 $ python create_lif.py JSON_DIR LIF_DIR TXT_DIR
+$ python create_lif.py -p PROCESSES JSON_DIR LIF_DIR TXT_DIR
+$ python create_lif.py --metrics METRICS_FILE JSON_DIR LIF_DIR TXT_DIR
+$ python create_lif.py --profile DIR (--profile-every N) JSON_DIR LIF_DIR TXT_DIR
+$ python create_lif.py --max-size MB --max-memory MB JSON_DIR LIF_DIR TXT_DIR
 
 The first directory is the one with JSON files created by science parse, the
-second the target for LIF files and the third the target for TXT files.
+second the target for LIF files and the third the target for TXT files. With
+the -p option the files are distributed over a pool of PROCESSES workers. At
+the end the number of documents and megabytes of JSON processed per second is
+printed. With --metrics the time and the input and output sizes of each
+document are appended to METRICS_FILE, see metrics.py. Since the text is
+written as it is read, the time is not split in parsing and writing. With
+--memory the memory allocated for each document is added to the metrics. With
+--profile every Nth document is profiled, see profiling.py. Documents whose JSON
+file is larger than --max-size or that need more memory than --max-memory are
+skipped, see guards.py.
+
+Identifiers are generated per document so the output for a file does not
+depend on what other files were processed before it or on how files were
+divided over workers. The text is written to the LIF and TXT files section by
+section.
 
 Should work for both Python2 and Python3.
 
@@ -16,19 +34,20 @@ Should work for both Python2 and Python3.
 
 import os
 import sys
+import time
+import getopt
 import shutil
 import codecs
 import json
 import pprint
 
 from collections import Counter
+from multiprocessing import Pool
 
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-
-from lif import LIF, Container, View, Annotation
+from lif import LIF, Container, View, Annotation, LIFWriter, open_lif_file
+import metrics
+import profiling
+import guards
 
 
 def read_sample(fname):
@@ -59,84 +78,119 @@ def copy_files_to_sample(json_files, target_dir):
         shutil.copyfile(json_file, target_file)
 
 
-def create_lif_files(science_parse_dir, lif_dir, txt_dir, test=False):
-    for fname in os.listdir(science_parse_dir):
-        create_lif_file(os.path.join(science_parse_dir, fname),
-                        os.path.join(lif_dir, fname[:-5] + '.lif'),
-                        os.path.join(txt_dir, fname[:-5] + '.txt'),
-                        test)
+def create_lif_files(science_parse_dir, lif_dir, txt_dir, test=False, processes=1):
+    t0 = time.time()
+    jobs = [(os.path.join(science_parse_dir, fname),
+             os.path.join(lif_dir, fname[:-5] + '.lif'),
+             os.path.join(txt_dir, fname[:-5] + '.txt'),
+             test)
+            for fname in sorted(os.listdir(science_parse_dir))]
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            sizes = pool.map(_create_lif_file, jobs, 4)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sizes = [_create_lif_file(job) for job in jobs]
+    print_throughput(len(jobs), sum(sizes), time.time() - t0)
+
+
+def _create_lif_file(job):
+    json_file, lif_file, txt_file, test = job
+    fname = os.path.basename(json_file)
+    with metrics.document('create_lif', fname), profiling.document('create_lif'):
+        size = guards.process_guarded(fname, json_file, _create_lif_file_guarded, job)
+    return size or 0
+
+
+def _create_lif_file_guarded(job):
+    json_file, lif_file, txt_file, test = job
+    create_lif_file(json_file, lif_file, txt_file, test)
+    metrics.count('bytes_in', metrics.file_size(json_file))
+    metrics.count('bytes_out', metrics.file_size(lif_file) + metrics.file_size(txt_file))
+    return os.path.getsize(json_file)
+
+
+def print_throughput(documents, size, seconds):
+    seconds = max(seconds, 0.000001)
+    print("\nProcessed {:d} documents ({:.2f}MB) in {:.2f} seconds"
+          " ({:.2f} documents/sec, {:.2f} MB/sec)".format(
+              documents, size / 1000000.0, seconds,
+              documents / seconds, size / 1000000.0 / seconds))
 
 
 def create_lif_file(json_file, lif_file, txt_file, test=False):
     print("Creating {}".format(lif_file))
-    with codecs.open(json_file, encoding='utf8') as fh_in, \
-         codecs.open(lif_file, 'w', encoding='utf8') as fh_out_lif, \
+    with codecs.open(json_file, encoding='utf8') as fh_in:
+        json_obj = json.load(fh_in)
+    with open_lif_file(lif_file, 'w') as fh_out_lif, \
          codecs.open(txt_file, 'w', encoding='utf8') as fh_out_txt:
-        json_obj = json.loads(fh_in.read())
-        lif_obj = LIF()
-        _add_metadata(lif_obj, json_obj)
-        _add_view(lif_obj, json_obj)
-        _add_rest(lif_obj, json_obj)
-        container = Container()
-        container.discriminator = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
-        container.payload = lif_obj
-        fh_out_lif.write(json.dumps(container.as_json(), indent=4))
-        fh_out_txt.write(container.payload.text.value)
+        writer = LIFWriter(fh_out_lif, metadata=_get_metadata(json_obj))
+        view = _create_view()
+        _add_text(writer, fh_out_txt, view.annotations, json_obj)
+        writer.write_view(view)
+        writer.close()
     if test:
         test_lif_file(lif_file)
 
 
-def _add_metadata(lif_obj, json_obj):
-    lif_obj.metadata['id'] = json_obj['id']
-    lif_obj.metadata['authors'] = json_obj['authors']
-    lif_obj.metadata['title'] = json_obj.get('title')
-    lif_obj.metadata['year'] = json_obj.get('year')
-    lif_obj.metadata['references'] = json_obj['references']
-    
+def _get_metadata(json_obj):
+    return { 'id': json_obj['id'],
+             'authors': json_obj['authors'],
+             'title': json_obj.get('title'),
+             'year': json_obj.get('year'),
+             'references': json_obj['references'] }
+
 
-def _add_view(lif_obj, json_obj):
+def _create_view():
     view = View()
-    lif_obj.views.append(view)
     view.id = "structure"
     view.metadata['contains'] = { vocab("Title"): {}, vocab("Abstract"): {},
                                   vocab("Section"): {}, vocab("Header"): {} }
+    return view
 
 
-def _add_rest(lif_obj, json_obj):
-    text_value = StringIO()
-    offset = 0
-    annotations = lif_obj.views[0].annotations
-    offset = _add_annotation(annotations, text_value, 'Title', json_obj.get('title'), offset)
-    offset = _add_annotation(annotations, text_value, 'Abstract', json_obj.get('abstractText'), offset)
+def _add_text(writer, fh_txt, annotations, json_obj):
+    """Write the title, abstract and sections to the LIF writer and the text file
+    and add annotations for them."""
+    ids = IdentifierFactory()
+    elements = [('Title', json_obj.get('title')),
+                ('Abstract', json_obj.get('abstractText'))]
     for section in json_obj['sections']:
-        offset = _add_annotation(annotations, text_value, 'Header', section.get('heading'), offset)
-        offset = _add_annotation(annotations, text_value, 'Section', section.get('text'), offset)
-    lif_obj.text.value = text_value.getvalue()
+        elements.append(('Header', section.get('heading')))
+        elements.append(('Section', section.get('text')))
+    for annotation_type, text in elements:
+        _add_annotation(writer, fh_txt, annotations, ids, annotation_type, text)
 
 
-def _add_annotation(annotations, text_value, annotation_type, text, offset):
+def _add_annotation(writer, fh_txt, annotations, ids, annotation_type, text):
     if text is None:
-        return offset
+        return
     prefix = None
     if annotation_type in ('Title', 'Abstract'):
         prefix = annotation_type.upper()
     if prefix is not None:
         anno = {
-            "id": IdentifierFactory.next_id('Header'),
+            "id": ids.next_id('Header'),
             "@type": vocab('Header'),
-            "start": offset,
-            "end": offset + len(prefix) } 
+            "start": writer.offset,
+            "end": writer.offset + len(prefix) }
         annotations.append(Annotation(anno))
-        text_value.write(prefix + u"\n\n")
-        offset += len(prefix) + 2
+        _write_text(writer, fh_txt, prefix + u"\n\n")
     anno = {
-        "id": IdentifierFactory.next_id(annotation_type),
+        "id": ids.next_id(annotation_type),
         "@type": vocab(annotation_type),
-        "start": offset,
-        "end": offset + len(text) } 
+        "start": writer.offset,
+        "end": writer.offset + len(text) }
     annotations.append(Annotation(anno))
-    text_value.write(text + u"\n\n")
-    return offset + len(text) + 2
+    _write_text(writer, fh_txt, text + u"\n\n")
+
+
+def _write_text(writer, fh_txt, text):
+    writer.write_text(text)
+    fh_txt.write(text)
 
 
 def test_lif_file(lif_file):
@@ -152,13 +206,15 @@ def test_lif_file(lif_file):
 
 
 class IdentifierFactory(object):
-    
-    ids = { 'Title': 0, 'Abstract': 0, 'Header': 0, 'Section': 0 }
 
-    @classmethod
-    def next_id(cls, tagname):
-        cls.ids[tagname] += 1
-        return "{}{:04d}".format(tagname.lower(), cls.ids[tagname])
+    """Hands out identifiers for the annotations of one document."""
+
+    def __init__(self):
+        self.ids = { 'Title': 0, 'Abstract': 0, 'Header': 0, 'Section': 0 }
+
+    def next_id(self, tagname):
+        self.ids[tagname] += 1
+        return "{}{:04d}".format(tagname.lower(), self.ids[tagname])
 
 
 def vocab(annotation_type):
@@ -176,7 +232,22 @@ if __name__ == '__main__':
         json_files = get_files(fnames, science_parse_full_dir, '.pdf.json')
         copy_files_to_sample(json_files, science_parse_sample_dir)
 
-    science_parse_dir = sys.argv[1]
-    lif_dir = sys.argv[2]
-    txt_dir = sys.argv[3]
-    create_lif_files(science_parse_dir, lif_dir, txt_dir, test=False)
+    options, args = getopt.getopt(sys.argv[1:], 'p:',
+                                  ['metrics=', 'memory', 'profile=', 'profile-every=',
+                                   'max-size=', 'max-memory='])
+    options = dict(options)
+    processes = int(options.get('-p', 1))
+    science_parse_dir = args[0]
+    lif_dir = args[1]
+    txt_dir = args[2]
+    if '--metrics' in options:
+        metrics.open_metrics(options['--metrics'])
+        if '--memory' in options:
+            metrics.trace_memory()
+    guards.set_limits(options.get('--max-size'), options.get('--max-memory'))
+    if '--profile' in options:
+        profiling.start_profiling(options['--profile'], int(options.get('--profile-every', 1)))
+    try:
+        create_lif_files(science_parse_dir, lif_dir, txt_dir, test=False, processes=processes)
+    finally:
+        metrics.close_metrics()
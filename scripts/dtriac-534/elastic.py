@@ -12,6 +12,10 @@ from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import NotFoundError
 
 
+# Number of documents sent in one request when loading NDJSON files.
+BULK_SIZE = 1000
+
+
 class Index(object):
 
     def __init__(self, index_name, index_elements=None):
@@ -26,6 +30,35 @@ class Index(object):
             identifier = i if docid is None else docid
             self.es.index(index=self.index, id=identifier, body=element)
 
+    def load_bulk(self, fname, bulk_size=BULK_SIZE):
+        """Load an NDJSON file in the format of the bulk API, with an action line
+        followed by a document line for each document, sending bulk_size documents
+        in each request. Returns the number of documents loaded, documents that
+        were rejected are not counted."""
+        count = 0
+        lines = []
+        with open(fname, encoding='utf8') as fh:
+            for line in fh:
+                lines.append(line)
+                if len(lines) == 2 * bulk_size:
+                    count += self._bulk(lines)
+                    lines = []
+        if lines:
+            count += self._bulk(lines)
+        return count
+
+    def _bulk(self, lines):
+        """Send the lines to the bulk API and return the number of documents that
+        were loaded without an error."""
+        result = self.es.bulk(index=self.index, body=''.join(lines))
+        items = result['items']
+        errors = [list(item.values())[0]['error'] for item in items
+                  if 'error' in list(item.values())[0]]
+        if errors:
+            print("WARNING: %d documents were not loaded, the first error was: %s"
+                  % (len(errors), errors[0].get('reason')))
+        return len(items) - len(errors)
+
     def get(self, message, doc_id, dribble=False):
         print("\n{}".format(message))
         try:
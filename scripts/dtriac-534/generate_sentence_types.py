@@ -58,7 +58,7 @@ def generate_sentence_types(ttk, sen, words):
         fname_in = os.path.join(ttk, fname)
         fname_out = os.path.join(sen, fname)
         lif_in = LIF(fname_in)
-        lif_out = LIF(json_object=lif_in.as_json())
+        lif_out = lif_in.derive()
         sentences_view = _create_view()
         lif_out.views = [sentences_view]
         good_sentences = 0
@@ -6,39 +6,46 @@ site.
 
 Usage:
 
-$ python generate_statistics.py DIRECTORY
+$ python generate_statistics.py (-p PROCESSES) DIRECTORY
 
 DIRECTORY contains JSON files created for documents (not sentences) by
-create_index_docs.py.
+create_index_docs.py. The files are read by PROCESSES worker processes, by
+default one for each CPU, see mapreduce.py.
 
 """
 
 # TODO: needs to be updated for the new format for the index
 
 
-import os, sys, glob, json, codecs
+import os, sys, glob, json, codecs, getopt
 from collections import Counter
 
+from mapreduce import map_reduce, PROCESSES
 
-def write_statistics(directory, outfile):
-    years = Counter()
-    topics = Counter()
-    directory = sys.argv[1]
+
+def write_statistics(directory, outfile, processes=PROCESSES):
     fnames = glob.glob(os.path.join(directory, '*.json'))
-    for fname in fnames:
-        json_object = json.load(codecs.open(fname))
-        year = int(json_object.get('year', 9999))
-        if year != 9999:
-            years[year] += 1
-            for topic in json_object.get('topic_element', []):
-                topics[topic] += 1
-    json_object = { "years": years, "topics": topics }
+    stats = map_reduce(file_statistics, fnames, processes=processes) or {}
+    json_object = { "years": stats.get('years', Counter()),
+                    "topics": stats.get('topics', Counter()) }
     with codecs.open(outfile, 'w') as fh:
         fh.write(json.dumps(json_object, indent=True))
 
 
-if __name__ == '__main__':
+def file_statistics(fname):
+    years = Counter()
+    topics = Counter()
+    json_object = json.load(codecs.open(fname))
+    year = int(json_object.get('year', 9999))
+    if year != 9999:
+        years[year] += 1
+        for topic in json_object.get('topic_element', []):
+            topics[topic] += 1
+    return { "years": years, "topics": topics }
 
-    directory = sys.argv[1]
-    write_statistics(directory, 'stats.json')
 
+if __name__ == '__main__':
+
+    opts, args = getopt.getopt(sys.argv[1:], 'p:')
+    directory = args[0]
+    write_statistics(directory, 'stats.json', int(dict(opts).get('-p', PROCESSES)))
@@ -3,8 +3,16 @@
 Usage:
 
 $ python generate_topics.py LIF_DIR OUT_DIR
+$ python generate_topics.py --metrics METRICS_FILE LIF_DIR OUT_DIR
+$ python generate_topics.py --profile DIR (--profile-every N) LIF_DIR OUT_DIR
+$ python generate_topics.py --max-size MB --max-memory MB LIF_DIR OUT_DIR
 
-This processes all files in LIF_DIR and writes to OUT_DIR.
+This processes all files in LIF_DIR and writes to OUT_DIR. With --metrics the
+time spent on each file and the sizes of its input and output are appended to
+METRICS_FILE, with --memory also the memory allocated for it, see metrics.py.
+With --profile every Nth file is profiled, see profiling.py. Files larger than
+--max-size or that need more memory than --max-memory are skipped, see
+guards.py.
 
 """
 
@@ -18,6 +26,7 @@ import os
 import sys
 import codecs
 import pickle
+import getopt
 
 import gensim
 from gensim import corpora
@@ -28,6 +37,9 @@ from nltk import sent_tokenize
 from nltk.corpus import wordnet as wn
 
 from lif import Container, LIF, View, Annotation
+import metrics
+import profiling
+import guards
 
 
 DATA_DIR = "../topics"
@@ -107,28 +119,39 @@ def generate_topics(lif, top):
             continue
         # if not fname.startswith('z'): continue
 
-        topic_id = 0
         print("{}".format(os.path.basename(fname)))
-        fname_in = os.path.join(lif, fname)
-        fname_out = os.path.join(top, fname)
+        with metrics.document('generate_topics', fname), \
+             profiling.document('generate_topics'):
+            guards.process_guarded(fname, os.path.join(lif, fname), generate_topics_for_file,
+                                   lif, top, fname, lda, topic_idx, dictionary)
+
+
+def generate_topics_for_file(lif, top, fname, lda, topic_idx, dictionary):
+    topic_id = 0
+    fname_in = os.path.join(lif, fname)
+    fname_out = os.path.join(top, fname)
+    metrics.count('bytes_in', metrics.file_size(fname_in))
+    with metrics.phase('parse'):
         lif_in = Container(fname_in).payload
-        lif_out = LIF(json_object=lif_in.as_json())
-        # just to save some space, we get them from the lif file anyway
-        lif_out.metadata = {}
-        topics_view = _create_view()
-        lif_out.views = [topics_view]
-
-        topics_view.annotations.append(markable_annotation(lif_in))
-        doc = prepare_text_for_lda(lif_in.text.value)
-        bow = dictionary.doc2bow(doc)
-        for topic in lda.get_document_topics(bow):
-            topic_id += 1
-            # these are tuples of topic_id and score
-            lemmas = get_lemmas_from_topic_name(topic_idx.get(topic[0]))
-            # print('   %3d  %.04f  %s' % (topic[0], topic[1], lemmas))
-            topics_view.annotations.append(
-                topic_annotation(topic, topic_id, lemmas))
+    lif_out = lif_in.derive()
+    # just to save some space, we get them from the lif file anyway
+    lif_out.metadata = {}
+    topics_view = _create_view()
+    lif_out.views = [topics_view]
+
+    topics_view.annotations.append(markable_annotation(lif_in))
+    doc = prepare_text_for_lda(lif_in.text.value)
+    bow = dictionary.doc2bow(doc)
+    for topic in lda.get_document_topics(bow):
+        topic_id += 1
+        # these are tuples of topic_id and score
+        lemmas = get_lemmas_from_topic_name(topic_idx.get(topic[0]))
+        # print('   %3d  %.04f  %s' % (topic[0], topic[1], lemmas))
+        topics_view.annotations.append(
+            topic_annotation(topic, topic_id, lemmas))
+    with metrics.phase('write'):
         lif_out.write(fname=fname_out, pretty=True)
+    metrics.count('bytes_out', metrics.file_size(fname_out))
 
 
 def prepare_text_for_lda(text):
@@ -192,7 +215,21 @@ def _create_view():
 
 if __name__ == '__main__':
 
-    lif_dir, top_dir = sys.argv[1:3]
+    options, args = getopt.getopt(sys.argv[1:], '', ['metrics=', 'memory', 'profile=',
+                                                   'profile-every=', 'max-size=',
+                                                   'max-memory='])
+    options = dict(options)
+    lif_dir, top_dir = args[:2]
     # build_model(lif_dir)
     # print_model()
-    generate_topics(lif_dir, top_dir)
+    if '--metrics' in options:
+        metrics.open_metrics(options['--metrics'])
+        if '--memory' in options:
+            metrics.trace_memory()
+    guards.set_limits(options.get('--max-size'), options.get('--max-memory'))
+    if '--profile' in options:
+        profiling.start_profiling(options['--profile'], int(options.get('--profile-every', 1)))
+    try:
+        generate_topics(lif_dir, top_dir)
+    finally:
+        metrics.close_metrics()
@@ -0,0 +1,94 @@
+"""guards.py
+
+Guards against documents that are too big to process, for the stages that take
+the --max-size MB and --max-memory MB options (create_lif.py, generate_topics.py
+and create_index_docs.py). These work like the guards in utils.process_guarded()
+of dtriac-19d:
+
+--max-size MB
+    Skip documents whose input file is larger than MB megabytes.
+
+--max-memory MB
+    Skip documents that need more than MB megabytes of memory on top of what the
+    process already uses. The limit is set on the address space of the process
+    (RLIMIT_AS), so exceeding it raises a MemoryError, and is lifted again after
+    the document. This needs the resource module and is ignored without it.
+
+Skipped documents are printed with SKIPPED and have the reason (size or memory)
+in the skipped field of their metrics record. The limits are set in the main
+process before the worker pool is created, so that forked workers inherit them.
+
+Should work for both Python2 and Python3.
+
+"""
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, --max-memory is then ignored
+    resource = None
+
+import metrics
+
+
+MEGABYTE = 1024 * 1024
+
+# The limits in megabytes, None means that there is no limit.
+MAX_SIZE = None
+MAX_MEMORY = None
+
+
+def set_limits(max_size=None, max_memory=None):
+    """Set the limits from the --max-size and --max-memory options, which are
+    strings or None."""
+    global MAX_SIZE, MAX_MEMORY
+    MAX_SIZE = None if max_size is None else int(max_size)
+    MAX_MEMORY = None if max_memory is None else int(max_memory)
+
+
+def process_guarded(fname, input_file, fun, *args):
+    """Return fun(*args), unless input_file is bigger than --max-size or fun needs
+    more memory than --max-memory, then the document is skipped and None is
+    returned. Use this inside metrics.document() so the skip is recorded."""
+    if is_oversized(input_file):
+        skip_document(fname, 'size', "is larger than %dMB" % MAX_SIZE)
+        return None
+    try:
+        with memory_limit(MAX_MEMORY):
+            return fun(*args)
+    except MemoryError:
+        if MAX_MEMORY is None:
+            raise
+        skip_document(fname, 'memory', "needs more than %dMB" % MAX_MEMORY)
+        return None
+
+
+def skip_document(fname, reason, message):
+    print('SKIPPED: %s %s' % (fname, message))
+    metrics.mark('skipped', reason)
+
+
+def is_oversized(input_file):
+    return MAX_SIZE is not None and metrics.file_size(input_file) > MAX_SIZE * MEGABYTE
+
+
+@contextmanager
+def memory_limit(megabytes):
+    """Limit the memory that can be allocated in the body to this many megabytes
+    more than what the process uses now, exceeding it raises a MemoryError. Does
+    nothing if megabytes is None or the limit cannot be set."""
+    size = metrics.virtual_size()
+    if megabytes is None or resource is None or size is None:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = size + megabytes * MEGABYTE
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
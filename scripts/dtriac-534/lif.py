@@ -19,6 +19,26 @@ To read and write a LIF object:
 >>> lif = LIF(infile)
 >>> lif.write(outfile, pretty=True)
 
+To write a Container with a LIF object without first building it in memory use
+the LIFWriter:
+
+>>> writer = LIFWriter(fh)
+>>> writer.write_text(text)
+>>> writer.write_view(view)
+>>> writer.close()
+
+LIF files can be compressed. When reading, gzip and zstd compression are
+detected from the first bytes of the file, so file names do not need to change.
+When writing, files with a .gz or .zst extension are compressed with gzip or
+zstd and other files with the codec set by set_compression() or by the
+LIF_COMPRESSION environment variable, for example
+
+$ export LIF_COMPRESSION=gzip:6
+
+where the number is the compression level. By default files are not compressed.
+Use open_lif_file() to get a file handle that honors the same settings. Zstd
+requires the zstandard package.
+
 Normaly there would be some manipulation of the LIF object between reading and
 writing, most typically by adding views.
 
@@ -32,22 +52,120 @@ Example input files are in ../data/in/lif.
 """
 
 import os
+import io
 import sys
+import gzip
 import codecs
+import copy
 import json
 import subprocess
 
 #from past.builtins import xrange
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+EXTENSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# compression codec (None, 'gzip' or 'zstd') and level used when writing files
+COMPRESSION = None
+COMPRESSION_LEVEL = None
+
+
+def set_compression(codec, level=None):
+    """Set the codec and level used for writing files that do not have a .gz or
+    .zst extension. Use None or 'none' for the codec to switch off compression
+    and None for the level to use the default level of the codec."""
+    global COMPRESSION, COMPRESSION_LEVEL
+    codec = None if codec in (None, 'none') else codec
+    if codec not in (None, 'gzip', 'zstd'):
+        raise ValueError("unknown compression codec: %s" % codec)
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+    COMPRESSION = codec
+    COMPRESSION_LEVEL = None if level is None else int(level)
+
+
+def _write_codec(fname):
+    codec = EXTENSIONS.get(os.path.splitext(fname)[1])
+    if codec is not None:
+        return codec, DEFAULT_LEVELS[codec]
+    if COMPRESSION is not None:
+        level = COMPRESSION_LEVEL
+        return COMPRESSION, DEFAULT_LEVELS[COMPRESSION] if level is None else level
+    return None, None
+
+
+def _read_codec(fname):
+    with open(fname, 'rb') as fh:
+        magic = fh.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return EXTENSIONS.get(os.path.splitext(fname)[1])
+
+
+def _open_binary(fname, mode):
+    """Open a file in binary mode ('rb' or 'wb') with the codec determined by the
+    extension, the magic number or the compression settings."""
+    if mode == 'rb':
+        codec, level = _read_codec(fname), None
+    else:
+        codec, level = _write_codec(fname)
+    if codec == 'gzip':
+        if mode == 'rb':
+            return gzip.GzipFile(fname, mode)
+        return gzip.GzipFile(fname, mode, compresslevel=level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError("reading %s requires the zstandard package" % fname)
+        if mode == 'rb':
+            return zstandard.ZstdDecompressor().stream_reader(open(fname, 'rb'))
+        return zstandard.ZstdCompressor(level=level).stream_writer(open(fname, 'wb'))
+    return io.open(fname, mode)
+
+
+def open_lif_file(fname, mode='r'):
+    """Return a file handle for reading ('r') or writing ('w') unicode text to a
+    possibly compressed file."""
+    if mode == 'r':
+        return codecs.getreader('utf8')(_open_binary(fname, 'rb'))
+    return codecs.getwriter('utf8')(_open_binary(fname, 'wb'))
+
+
+def read_file(fname):
+    """Return the contents of a possibly compressed file as a unicode string."""
+    with _open_binary(fname, 'rb') as fh:
+        return fh.read().decode('utf8')
+
+
+def write_file(fname, text):
+    """Write a unicode string to a file, compressing it if needed."""
+    with _open_binary(fname, 'wb') as fh:
+        fh.write(text.encode('utf8'))
+
+
+if os.environ.get('LIF_COMPRESSION'):
+    set_compression(*os.environ['LIF_COMPRESSION'].split(':'))
+
 
 class LappsObject(object):
 
     def __init__(self, json_file, json_string, json_object):
         self.json_file = json_file
-        self.json_file = json_string
+        self.json_string = json_string
         self.json_object = json_object
         if json_file is not None:
-            self.json_string = codecs.open(json_file).read()
+            self.json_string = read_file(json_file)
             self.json_object = json.loads(self.json_string)
         elif json_string is not None:
             self.json_string = json_string
@@ -63,8 +181,10 @@ class LappsObject(object):
             s = json.dumps(json_obj, sort_keys=True, indent=4, separators=(',', ': '))
         else:
             s = json.dumps(json_obj)
-        fh = sys.stdout if fname is None else codecs.open(fname, 'w')
-        fh.write(s + "\n")
+        if fname is None:
+            sys.stdout.write(s + "\n")
+        else:
+            write_file(fname, s + "\n")
 
 
 class Container(LappsObject):
@@ -111,6 +231,17 @@ class LIF(LappsObject):
                 return view
         return None
 
+    def derive(self):
+        """Return a new LIF object with the text and metadata of this one and no
+        views. The metadata dictionary is shared and the text is a shallow copy,
+        so this is much cheaper than LIF(json_object=lif.as_json()), which
+        creates all views and annotations again."""
+        lif = LIF()
+        lif.context = self.context
+        lif.metadata = self.metadata
+        lif.text = copy.copy(self.text)
+        return lif
+
     def as_json(self):
         d = {"@context": self.context,
              "metadata": self.metadata,
@@ -252,6 +383,90 @@ class Annotation(object):
         return d
 
 
+class LIFWriter(object):
+
+    """Writes a LIF object, by default embedded in a Container, to an open file
+    handle as the annotations come in. First all the text is written, in as
+    many pieces as needed, and then the views, either as complete views or
+    annotation by annotation with begin_view(), write_annotation() (or
+    write_annotations() for a batch) and end_view(). The output is compact
+    JSON. The offset attribute keeps track of how many characters of text were
+    written so far."""
+
+    DISCRIMINATOR = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
+    CONTEXT = "http://vocab.lappsgrid.org/context-1.0.0.jsonld"
+
+    def __init__(self, fh, metadata=None, language='en', container=True):
+        self.fh = fh
+        self.container = container
+        self.offset = 0
+        self.in_text = True
+        self.views_written = 0
+        self.annotations_written = 0
+        if container:
+            fh.write('{"discriminator": %s, "parameters": {}, "payload": '
+                     % json.dumps(self.DISCRIMINATOR))
+        fh.write('{"@context": %s, "metadata": %s, "text": {"language": %s, "@value": "'
+                 % (json.dumps(self.CONTEXT), json.dumps(metadata or {}),
+                    json.dumps(language)))
+
+    def write_text(self, text):
+        if not self.in_text:
+            raise Exception("LIFWriter: cannot add text after the views")
+        # strip the quotes of the JSON string
+        self.fh.write(json.dumps(text)[1:-1])
+        self.offset += len(text)
+
+    def write_view(self, view):
+        self.begin_view(view.id, view.metadata)
+        for annotation in view.annotations:
+            self.write_annotation(annotation)
+        self.end_view()
+
+    def begin_view(self, identifier, metadata):
+        self._end_text()
+        if self.views_written:
+            self.fh.write(', ')
+        self.fh.write('{"id": %s, "metadata": %s, "annotations": ['
+                      % (json.dumps(identifier), json.dumps(metadata)))
+        self.annotations_written = 0
+
+    def write_annotation(self, annotation):
+        """Write an annotation to the current view, annotation is an instance of
+        Annotation or a dictionary."""
+        if isinstance(annotation, Annotation):
+            annotation = annotation.as_json()
+        if self.annotations_written:
+            self.fh.write(', ')
+        self.fh.write(json.dumps(annotation))
+        self.annotations_written += 1
+
+    def write_annotations(self, annotations):
+        """Write a list of annotations to the current view, encoding them in one
+        go, which is faster than writing them one by one."""
+        annotations = [a.as_json() if isinstance(a, Annotation) else a for a in annotations]
+        if not annotations:
+            return
+        if self.annotations_written:
+            self.fh.write(', ')
+        # strip the brackets of the JSON list
+        self.fh.write(json.dumps(annotations)[1:-1])
+        self.annotations_written += len(annotations)
+
+    def end_view(self):
+        self.fh.write(']}')
+        self.views_written += 1
+
+    def close(self):
+        self._end_text()
+        self.fh.write(']}}\n' if self.container else ']}\n')
+
+    def _end_text(self):
+        if self.in_text:
+            self.fh.write('"}, "views": [')
+            self.in_text = False
+
+
 class IdentifierFactory(object):
 
     identifiers = {'docelement': 0, 's': 0, 'lex': 0, 'ng': 0, 'vg': 0}
@@ -6,7 +6,9 @@ Usage:
 
 $ python load_index.py INDEX_NAME DIRECTORY
 
-Load JSON documents from DIRECTORY into an index named INDEX_NAME.
+Load JSON documents from DIRECTORY into an index named INDEX_NAME. NDJSON files
+in DIRECTORY, like the sentence files written by create_index_docs.py, are sent
+to the bulk API as they are.
 
 """
 
@@ -37,6 +39,12 @@ def read_documents(document_directory):
     return documents
 
 
+def bulk_files(document_directory):
+    return [os.path.join(document_directory, fname)
+            for fname in sorted(os.listdir(document_directory))
+            if fname.endswith('.ndjson')]
+
+
 if __name__ == '__main__':
 
     if len(sys.argv) > 2:
@@ -49,3 +57,6 @@ if __name__ == '__main__':
     idx = Index(index_name)
     print("Loading documents into the index...")
     idx.load(docs)
+    for fname in bulk_files(source_directory):
+        print("Loading %s" % fname)
+        print("Loaded %d documents" % idx.load_bulk(fname))
@@ -0,0 +1,120 @@
+"""sorted_table.py
+
+A read-only mapping from strings to strings in a single file that is memory
+mapped, so opening a table takes no time and no memory no matter how big it is,
+and processes that open the same table share the pages that were read.
+
+>>> write_table('verbs.tbl', {'run': '51.3.2', 'eat': '39.1'})
+>>> table = SortedTable('verbs.tbl')
+>>> table.get('run')
+'51.3.2'
+
+The file starts with MAGIC and the number of entries, followed by the offsets
+of the entries and the end of the last entry (all little-endian unsigned 32-bit
+integers) and then the entries, sorted on the UTF-8 bytes of the key, each entry
+is the key, a NUL byte and the value. Lookups are binary searches on the keys.
+
+"""
+
+import os
+import mmap
+import struct
+
+
+MAGIC = b'SRTTBL1\n'
+
+HEADER = struct.Struct('<8sI')
+OFFSET = struct.Struct('<I')
+
+
+def write_table(fname, mapping):
+    """Write a dictionary of strings to a table. The table is written to a
+    temporary file first and then renamed, so processes that have the old table
+    open keep seeing the old table."""
+    items = sorted((key.encode('utf8'), value.encode('utf8'))
+                   for key, value in mapping.items())
+    offsets = []
+    entries = []
+    position = 0
+    for key, value in items:
+        if b'\0' in key:
+            raise ValueError("table keys cannot contain NUL bytes: %r" % key)
+        offsets.append(position)
+        entries.append(key + b'\0' + value)
+        position += len(entries[-1])
+    offsets.append(position)
+    tmp_file = fname + '.tmp'
+    with open(tmp_file, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, len(items)))
+        fh.write(struct.pack('<%dI' % len(offsets), *offsets))
+        fh.write(b''.join(entries))
+    os.rename(tmp_file, fname)
+
+
+class SortedTable(object):
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as fh:
+            self.map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a sorted table" % fname)
+        self.entries = HEADER.size + (self.count + 1) * OFFSET.size
+
+    def __str__(self):
+        return "<SortedTable %s with %d entries>" % (self.fname, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        entry = self._find(key)
+        if entry is None:
+            return default
+        return entry[entry.index(b'\0') + 1:].decode('utf8')
+
+    def keys(self):
+        for i in range(self.count):
+            yield self._key(self._entry(i)).decode('utf8')
+
+    def items(self):
+        for i in range(self.count):
+            key, value = self._entry(i).split(b'\0', 1)
+            yield key.decode('utf8'), value.decode('utf8')
+
+    def close(self):
+        self.map.close()
+
+    def _entry(self, i):
+        start, end = struct.unpack_from('<2I', self.map, HEADER.size + i * OFFSET.size)
+        return self.map[self.entries + start:self.entries + end]
+
+    @staticmethod
+    def _key(entry):
+        return entry[:entry.index(b'\0')]
+
+    def _find(self, key):
+        """Return the entry for a key, or None if there is no such entry."""
+        key = key.encode('utf8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(self._entry(middle)) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count:
+            entry = self._entry(low)
+            if self._key(entry) == key:
+                return entry
+        return None
@@ -1,63 +1,123 @@
+"""vnc_to_lif.py
+
+Create LIF files with verbnet classes from the output of clearwsd.
+
+Usage:
+
+$ python vnc_to_lif.py TXT_FILE VNC_FILE > LIF_FILE
+$ python vnc_to_lif.py --batch (-p PROCESSES) TXT_DIR VNC_DIR LIF_DIR
+
+The second form converts all files in TXT_DIR that have a file with the same
+name in VNC_DIR, using PROCESSES worker processes (see mapreduce.py), and
+writes NAME.lif to LIF_DIR for each file NAME. The clearwsd output is read line
+by line and the annotations are written as soon as they are read, using the
+LIFWriter. For throughput numbers see benchmarks/bench_vnc_to_lif.py.
+
+"""
+
 import os
 import re
 import sys
-from sys import argv
-from lif import LIF, Annotation, View, Container
+import getopt
+from functools import partial
+from collections import Counter
+
+from lif import LIFWriter
+from mapreduce import map_reduce, PROCESSES
+
+
+# Annotated tokens in clearwsd output are on lines starting with # and look
+# like 12[230,236], with the character offsets between square brackets.
+ANNOTATION_LINE = re.compile(r'^#[^\t\n]*', re.M)
+TOKEN = re.compile(r'\d+\[(\d+),(\d+)\]')
 
-def generate_lif(txt, vnc):
+# The clearwsd output is read in blocks of this many characters and the
+# annotations of each block are written in one go.
+BLOCK_SIZE = 1 << 20
+
+
+def generate_lif(txt, vnc, out=None):
     """
-    * txt is a plain text file only with the original text value. 
+    * txt is a plain text file only with the original text value.
     * vnc (verbnetclass) is a output from clearwsd file (mostly in conll format)
-    This function will generate a LIF json file using disambiguation annotation 
-    encoded in the vnc file, using txt as top-level `text` field. 
+    This function will generate a LIF json file using disambiguation annotation
+    encoded in the vnc file, using txt as top-level `text` field. The LIF file
+    is written to out (standard output by default), and the number of
+    annotations is returned.
     """
-    t = open(txt, encoding="utf-8")
-    v = open(vnc, encoding="utf-8")
-    lif_obj = LIF()
-    cont_obj = Container()
-    cont_obj.discriminator = "http://vocab.lappsgrid.org/ns/media/jsonld#lif"
-    cont_obj.payload = lif_obj
-
-    raw_text = t.read()
-    t.close()
-    lif_obj.text.value = raw_text
-
-    vnc_view = View()
-    lif_obj.views.append(vnc_view)
-    vnc_view.id = "verbnettag"
-    vnc_view.metadata['contains'] = { vocab('SemanticTag'): {}}
-
-    annotations = [line for line in v if line.startswith('#')]
-    v.close()
-    for annotation in annotations:
-        splitted = annotation.split('\t')[0].split()
-        
-        oid = splitted[1]
-        osent =  splitted[2]
-        otoken =  splitted[3]
-        olemma =  " ".join(splitted[4:-1]) # some lemmas have space inside
-        olabel = splitted[-1]
-        properly_annotated = re.match(r'\d+\[(\d+),(\d+)\]', otoken)
-        if properly_annotated is None: 
-            continue
-        s, e = map(int, properly_annotated.groups())
-        ann = {}
-        ann["id"] = "vnc_" + oid
-        ann["start"] = s
-        ann["end"] = e
-        ann["@type"] = vocab("SemanticTag")
-        ann["features"] = { "tags": [olabel], "type": "VerbNetClass",
-                "lemma": olemma, "text": raw_text[s:e]}
-        ann_obj = Annotation(ann)
-        vnc_view.annotations.append(ann_obj)
-    cont_obj.write()
+    out = sys.stdout if out is None else out
+    with open(txt, encoding="utf-8") as t:
+        raw_text = t.read()
+    writer = LIFWriter(out)
+    writer.write_text(raw_text)
+    writer.begin_view("verbnettag", {'contains': {vocab('SemanticTag'): {}}})
+    with open(vnc, encoding="utf-8") as v:
+        for block in parse_vnc(v):
+            writer.write_annotations(
+                [{"id": "vnc_" + oid, "@type": vocab("SemanticTag"),
+                  "features": {"tags": [olabel], "type": "VerbNetClass",
+                               "lemma": olemma, "text": raw_text[s:e]},
+                  "start": s, "end": e}
+                 for oid, s, e, olemma, olabel in block])
+    writer.end_view()
+    writer.close()
+    return writer.annotations_written
+
+
+def parse_vnc(fh):
+    """Read clearwsd output from a file handle in blocks and generate for each
+    block a list with the identifier, offsets, lemma and label of the annotated
+    tokens in it."""
+    rest = ''
+    while True:
+        block = fh.read(BLOCK_SIZE)
+        text = rest + block
+        if block:
+            # only complete lines, the rest goes with the next block
+            cut = text.rfind('\n') + 1
+            text, rest = text[:cut], text[cut:]
+        annotations = []
+        for line in ANNOTATION_LINE.finditer(text):
+            splitted = line.group().split()
+            properly_annotated = TOKEN.match(splitted[3])
+            if properly_annotated is None:
+                continue
+            # some lemmas have space inside
+            annotations.append((splitted[1], int(properly_annotated.group(1)),
+                                int(properly_annotated.group(2)),
+                                " ".join(splitted[4:-1]), splitted[-1]))
+        yield annotations
+        if not block:
+            return
+
 
+def convert_dir(txt_dir, vnc_dir, lif_dir, processes=PROCESSES):
+    """Convert all pairs of text files and clearwsd files with the same name and
+    return a Counter with the number of files and annotations."""
+    if not os.path.exists(lif_dir):
+        os.makedirs(lif_dir)
+    names = sorted(name for name in os.listdir(txt_dir)
+                   if os.path.isfile(os.path.join(vnc_dir, name)))
+    mapper = partial(convert_file, txt_dir, vnc_dir, lif_dir)
+    return map_reduce(mapper, names, processes=processes) or Counter()
+
+
+def convert_file(txt_dir, vnc_dir, lif_dir, name):
+    with open(os.path.join(lif_dir, name + '.lif'), 'w', encoding='utf-8') as out:
+        count = generate_lif(os.path.join(txt_dir, name), os.path.join(vnc_dir, name), out)
+    return Counter(files=1, annotations=count)
 
 
 def vocab(annotation_type):
     return "http://vocab.lappsgrid.org/%s" % annotation_type
 
+
 if __name__ == "__main__":
-    txtfile = argv[1]
-    vncfile = argv[2]
-    generate_lif(txtfile, vncfile)
+
+    opts, args = getopt.getopt(sys.argv[1:], 'p:', ['batch'])
+    options = dict(opts)
+    if '--batch' in options:
+        counts = convert_dir(args[0], args[1], args[2], int(options.get('-p', PROCESSES)))
+        print("Converted %d files with %d annotations" % (counts['files'], counts['annotations']))
+    else:
+        generate_lif(args[0], args[1])